@@ -16,19 +16,20 @@
 
 __all__ = [
     'Controller', 'BluetoothAdapterError', 'AccessoryDisconnectedError', 'AccessoryNotFoundError',
-    'AlreadyPairedError', 'AuthenticationError', 'BackoffError', 'BusyError', 'CharacteristicPermissionError',
-    'ConfigLoadingError', 'ConfigSavingError', 'ConfigurationError', 'FormatError', 'HomeKitException',
-    'HttpException', 'IncorrectPairingIdError', 'InvalidAuthTagError', 'InvalidError', 'InvalidSignatureError',
-    'MaxPeersError', 'MaxTriesError', 'ProtocolError', 'RequestRejected', 'UnavailableError', 'UnknownError',
-    'UnpairedError'
+    'AccessoryTimeoutError', 'AlreadyPairedError', 'AuthenticationError', 'BackoffError', 'BusyError',
+    'CharacteristicPermissionError', 'ConfigLoadingError', 'ConfigSavingError', 'ConfigurationError', 'FormatError',
+    'HomeKitException', 'HttpException', 'IncorrectPairingIdError', 'InvalidAuthTagError', 'InvalidError',
+    'InvalidSignatureError', 'MaxPeersError', 'MaxTriesError', 'ProtocolError', 'RequestRejected', 'UnavailableError',
+    'UnknownError', 'UnpairedError'
 ]
 
 from homekit.controller import Controller
 from homekit.exceptions import BluetoothAdapterError, AccessoryDisconnectedError, AccessoryNotFoundError, \
-    AlreadyPairedError, AuthenticationError, BackoffError, BusyError, CharacteristicPermissionError, \
-    ConfigLoadingError, ConfigSavingError, ConfigurationError, FormatError, HomeKitException, HttpException, \
-    IncorrectPairingIdError, InvalidAuthTagError, InvalidError, InvalidSignatureError, MaxPeersError, MaxTriesError, \
-    ProtocolError, RequestRejected, UnavailableError, UnknownError, UnpairedError
+    AccessoryTimeoutError, AlreadyPairedError, AuthenticationError, BackoffError, BusyError, \
+    CharacteristicPermissionError, ConfigLoadingError, ConfigSavingError, ConfigurationError, FormatError, \
+    HomeKitException, HttpException, IncorrectPairingIdError, InvalidAuthTagError, InvalidError, \
+    InvalidSignatureError, MaxPeersError, MaxTriesError, ProtocolError, RequestRejected, UnavailableError, \
+    UnknownError, UnpairedError
 
 from homekit.tools import IP_TRANSPORT_SUPPORTED
 
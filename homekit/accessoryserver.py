@@ -15,34 +15,37 @@
 #
 
 import binascii
-import hashlib
 import io
 import json
 from json.decoder import JSONDecodeError
+import os
 import select
 
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from socketserver import ThreadingMixIn
 
-import hkdf
 from zeroconf import Zeroconf, ServiceInfo
 import socket
 import sys
 import logging
-import ed25519
 
 from cryptography.hazmat.primitives.asymmetric import x25519
 from cryptography.hazmat.primitives import serialization
 
 from homekit.crypto.chacha20poly1305 import chacha20_aead_decrypt, chacha20_aead_encrypt
+from homekit.crypto.hap_cipher import HapCipher
 from homekit.crypto.srp import SrpServer
+from homekit.crypto.primitives import hkdf_sha512, get_signing_key, get_verifying_key, create_ed25519_keypair
 
 from homekit.exceptions import ConfigurationError, ConfigLoadingError, ConfigSavingError, FormatError, \
     CharacteristicPermissionError
 from homekit.http_impl import HttpStatusCodes
+from homekit.http_impl.frame_writer import send_buffers
 from homekit.model import Accessories, Categories
 from homekit.model.characteristics import CharacteristicsTypes
-from homekit.protocol import TLV
+from homekit.protocol import TLV, get_control_keys, get_resume_key, get_resume_session_id
+from homekit.protocol.tlv import TlvMessage
+from homekit.protocol.session_cache import SessionCache
 from homekit.protocol.statuscodes import HapStatusCodes
 
 
@@ -69,6 +72,8 @@ class AccessoryServer(ThreadingMixIn, HTTPServer):
         self.data = AccessoryServerData(config_file)
         self.data.increase_configuration_number()
         self.sessions = {}
+        # sessions that can be resumed by pair verify (see AccessoryRequestHandler._post_pair_resume)
+        self.session_cache = SessionCache()
         self.zeroconf = Zeroconf()
         self.mdns_type = '_hap._tcp.local.'
         self.mdns_name = self.data.name + '._hap._tcp.local.'
@@ -377,14 +382,11 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
         if AccessoryRequestHandler.DEBUG_CRYPT:
             self.log_message('data >%i< >%s<', len(data), binascii.hexlify(data))
 
-        # get the crypto key from the session
-        c2a_key = self.server.sessions[self.session_id]['controller_to_accessory_key']
+        # get the cipher from the session
+        c2a_cipher = self.server.sessions[self.session_id]['controller_to_accessory_cipher']
 
         # verify & decrypt the read data
-        cnt_bytes = self.server.sessions[self.session_id]['controller_to_accessory_count'].to_bytes(8,
-                                                                                                    byteorder='little')
-        decrypted = chacha20_aead_decrypt(len_bytes, c2a_key, cnt_bytes, bytes([0, 0, 0, 0]),
-                                          data)
+        decrypted = c2a_cipher.decrypt_frame(data_len, data)
         if decrypted is False:
             # crypto error, log it and request close of connection
             self.log_error('SEVERE: Could not decrypt %s', binascii.hexlify(data))
@@ -394,8 +396,6 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
         if AccessoryRequestHandler.DEBUG_CRYPT:
             self.log_message('crypted request >%s<', decrypted)
 
-        self.server.sessions[self.session_id]['controller_to_accessory_count'] += 1
-
         # replace the original rfile with a fake with the decrypted stuff
         old_rfile = self.rfile
         self.rfile = io.BytesIO(decrypted)
@@ -409,36 +409,22 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
         BaseHTTPRequestHandler.handle_one_request(self)
 
         # read the plaintext and send it out encrypted
-        self.wfile.seek(0)
-        in_data = self.wfile.read(65537)
+        in_data = self.wfile.getbuffer()
 
         if AccessoryRequestHandler.DEBUG_CRYPT:
-            self.log_message('response >%s<', in_data)
+            self.log_message('response >%s<', bytes(in_data))
             self.log_message('len(response) %s', len(in_data))
 
-        block_size = 1024
-        out_data = bytearray()
-        while len(in_data) > 0:
-            block = in_data[:block_size]
-            if AccessoryRequestHandler.DEBUG_CRYPT:
-                self.log_message('==> BLOCK: len %s', len(block))
-            in_data = in_data[block_size:]
-
-            len_bytes = len(block).to_bytes(2, byteorder='little')
-            a2c_key = self.server.sessions[self.session_id]['accessory_to_controller_key']
-            cnt_bytes = self.server.sessions[self.session_id]['accessory_to_controller_count'].\
-                to_bytes(8, byteorder='little')
-            ciper_and_mac = chacha20_aead_encrypt(len_bytes, a2c_key, cnt_bytes, bytes([0, 0, 0, 0]), block)
-            self.server.sessions[self.session_id]['accessory_to_controller_count'] += 1
-            out_data += len_bytes + ciper_and_mac[0] + ciper_and_mac[1]
+        a2c_cipher = self.server.sessions[self.session_id]['accessory_to_controller_cipher']
+        buffers = a2c_cipher.encrypt_frames(in_data)
+        in_data.release()
 
         # change back to originals to handle multiple calls
         self.rfile = old_rfile
         self.wfile = old_wfile
 
-        # send data to original requester
-        self.wfile.write(out_data)
-        self.wfile.flush()
+        # send all frames to original requester at once
+        send_buffers(self.connection, buffers)
 
     def _get_characteristics(self):
         """
@@ -650,18 +636,15 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
         self.wfile.write(result_bytes)
 
     def _post_pair_verify(self):
-        d_req = TLV.decode_bytes(self.body)
+        d_req = TlvMessage(self.body)
 
-        # Order is not consistent, so force things in to order specified in spec
-        d_req = TLV.reorder(d_req, [
-            TLV.kTLVType_State,
-            TLV.kTLVType_PublicKey,
-            TLV.kTLVType_EncryptedData,
-        ])
+        if d_req.get(TLV.kTLVType_Method) == bytearray([TLV.kTLVMethod_Resume]) and self._post_pair_resume(d_req):
+            return
+        # if the session could not be resumed, go on with a normal pair verify using the public key
 
         d_res = []
 
-        if d_req[0][0] == TLV.kTLVType_State and d_req[0][1] == TLV.M1:
+        if d_req.get(TLV.kTLVType_State) == TLV.M1:
             # step #2 Accessory -> iOS Device Verify Start Response
             if AccessoryRequestHandler.DEBUG_PAIR_VERIFY:
                 self.log_message('Step #2 /pair-verify')
@@ -675,7 +658,7 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
             self.server.sessions[self.session_id]['accessory_pub_key'] = accessory_spk
 
             # 2) generate shared secret
-            ios_device_curve25519_pub_key_bytes = bytes(d_req[1][1])
+            ios_device_curve25519_pub_key_bytes = bytes(d_req[TLV.kTLVType_PublicKey])
             self.server.sessions[self.session_id]['ios_device_pub_key'] = ios_device_curve25519_pub_key_bytes
             ios_device_curve25519_pub_key = x25519.X25519PublicKey.from_public_bytes(
                 ios_device_curve25519_pub_key_bytes)
@@ -688,8 +671,7 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
                 ios_device_curve25519_pub_key_bytes
 
             # 4) sign accessory info for accessory signature
-            # accessory_ltsk = ed25519.SigningKey(self.server.data.accessory_ltsk + self.server.data.accessory_ltpk)
-            accessory_ltsk = ed25519.SigningKey(self.server.data.accessory_ltsk)
+            accessory_ltsk = get_signing_key(self.server.data.accessory_ltsk)
             accessory_signature = accessory_ltsk.sign(accessory_info)
 
             # 5) sub tlv
@@ -700,8 +682,8 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
             sub_tlv_b = TLV.encode_list(sub_tlv)
 
             # 6) derive session key
-            hkdf_inst = hkdf.Hkdf('Pair-Verify-Encrypt-Salt'.encode(), shared_secret, hash=hashlib.sha512)
-            session_key = hkdf_inst.expand('Pair-Verify-Encrypt-Info'.encode(), 32)
+            session_key = hkdf_sha512('Pair-Verify-Encrypt-Salt'.encode(), shared_secret,
+                                      'Pair-Verify-Encrypt-Info'.encode())
             self.server.sessions[self.session_id]['session_key'] = session_key
 
             # 7) encrypt sub tlv
@@ -723,7 +705,7 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
                 self.log_message('after step #2\n%s', TLV.to_string(d_res))
             return
 
-        if d_req[0][0] == TLV.kTLVType_State and d_req[0][1] == TLV.M3:
+        if d_req.get(TLV.kTLVType_State) == TLV.M3:
             # step #4 Accessory -> iOS Device Verify Finish Response
             if AccessoryRequestHandler.DEBUG_PAIR_VERIFY:
                 self.log_message('Step #4 /pair-verify')
@@ -732,50 +714,42 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
 
             # 1) verify ios' authtag
             # 2) decrypt
-            encrypted = d_req[1][1]
+            encrypted = d_req[TLV.kTLVType_EncryptedData]
             decrypted = chacha20_aead_decrypt(bytes(), session_key, 'PV-Msg03'.encode(), bytes([0, 0, 0, 0]),
                                               encrypted)
             if decrypted is False:
                 self.send_error_reply(TLV.M4, TLV.kTLVError_Authentication)
                 self.log_error('error in step #4: authtag %s %s', d_res, self.server.sessions)
                 return
-            d1 = TLV.decode_bytes(decrypted)
-            assert d1[0][0] == TLV.kTLVType_Identifier
-            assert d1[1][0] == TLV.kTLVType_Signature
+            d1 = TlvMessage(decrypted)
+            assert TLV.kTLVType_Identifier in d1
+            assert TLV.kTLVType_Signature in d1
 
             # 3) get ios_device_ltpk
-            ios_device_pairing_id = d1[0][1]
+            ios_device_pairing_id = d1[TLV.kTLVType_Identifier]
             self.server.sessions[self.session_id]['ios_device_pairing_id'] = ios_device_pairing_id
             ios_device_ltpk_bytes = self.server.data.get_peer_key(ios_device_pairing_id)
             if ios_device_ltpk_bytes is None:
                 self.send_error_reply(TLV.M4, TLV.kTLVError_Authentication)
                 self.log_error('error in step #4: not paired %s %s', d_res, self.server.sessions)
                 return
-            ios_device_lptk = ed25519.VerifyingKey(ios_device_ltpk_bytes)
+            ios_device_lptk = get_verifying_key(ios_device_ltpk_bytes)
 
             # 4) verify ios_device_info
-            ios_device_sig = d1[1][1]
+            ios_device_sig = d1[TLV.kTLVType_Signature]
             ios_device_curve25519_pub_key_bytes = self.server.sessions[self.session_id]['ios_device_pub_key']
             accessory_spk = self.server.sessions[self.session_id]['accessory_pub_key']
             ios_device_info = ios_device_curve25519_pub_key_bytes + ios_device_pairing_id + accessory_spk
-            try:
-                ios_device_lptk.verify(bytes(ios_device_sig), bytes(ios_device_info))
-            except ed25519.BadSignatureError:
+            if not ios_device_lptk.verify(ios_device_sig, ios_device_info):
                 self.send_error_reply(TLV.M4, TLV.kTLVError_Authentication)
                 self.log_error('error in step #4: signature %s %s', d_res, self.server.sessions)
                 return
 
             #
             shared_secret = self.server.sessions[self.session_id]['shared_secret']
-            hkdf_inst = hkdf.Hkdf('Control-Salt'.encode(), shared_secret, hash=hashlib.sha512)
-            controller_to_accessory_key = hkdf_inst.expand('Control-Write-Encryption-Key'.encode(), 32)
-            self.server.sessions[self.session_id]['controller_to_accessory_key'] = controller_to_accessory_key
-            self.server.sessions[self.session_id]['controller_to_accessory_count'] = 0
-
-            hkdf_inst = hkdf.Hkdf('Control-Salt'.encode(), shared_secret, hash=hashlib.sha512)
-            accessory_to_controller_key = hkdf_inst.expand('Control-Read-Encryption-Key'.encode(), 32)
-            self.server.sessions[self.session_id]['accessory_to_controller_key'] = accessory_to_controller_key
-            self.server.sessions[self.session_id]['accessory_to_controller_count'] = 0
+            self._set_session_keys(shared_secret)
+            self.server.session_cache.add(get_resume_session_id(shared_secret), bytes(ios_device_pairing_id),
+                                          shared_secret)
 
             d_res.append((TLV.kTLVType_State, TLV.M4,))
 
@@ -786,21 +760,72 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
 
         self.send_error(HttpStatusCodes.METHOD_NOT_ALLOWED)
 
-    def _post_pairings(self):
-        d_req = TLV.decode_bytes(self.body)
+    def _set_session_keys(self, shared_secret):
+        controller_to_accessory_key, accessory_to_controller_key = get_control_keys(shared_secret)
+        self.server.sessions[self.session_id]['controller_to_accessory_cipher'] = \
+            HapCipher(controller_to_accessory_key)
+        self.server.sessions[self.session_id]['accessory_to_controller_cipher'] = \
+            HapCipher(accessory_to_controller_key)
+
+    def _post_pair_resume(self, d_req) -> bool:
+        """
+        Tries to resume a session that was established by an earlier pair verify. The request contains the session id
+        and data encrypted with a key derived from the session's shared secret. If the session is known and the data
+        could be decrypted, the new session keys are derived from the cached shared secret and the response is sent.
 
-        # Order is not consistent, so force things in to order specified in spec
-        d_req = TLV.reorder(d_req, [
-            TLV.kTLVType_State,
-            TLV.kTLVType_Method,
+        :param d_req: the decoded request TLV as TlvMessage
+        :return: True if the session was resumed, False if a normal pair verify must be performed
+        """
+        required = [TLV.kTLVType_PublicKey, TLV.kTLVType_SessionID, TLV.kTLVType_EncryptedData]
+        if d_req.get(TLV.kTLVType_State) != TLV.M1 or not all(key in d_req for key in required):
+            return False
+
+        if AccessoryRequestHandler.DEBUG_PAIR_VERIFY:
+            self.log_message('Step #2 /pair-verify (resume)')
+
+        # 1) look up the session, each session can only be resumed once
+        ios_key_pub = bytes(d_req[TLV.kTLVType_PublicKey])
+        session_id = bytes(d_req[TLV.kTLVType_SessionID])
+        resumable = self.server.session_cache.pop(session_id)
+        if resumable is None:
+            return False
+        ios_device_pairing_id, resumed_secret = resumable
+        if self.server.data.get_peer_key(ios_device_pairing_id) is None:
+            # the pairing was removed in the meantime
+            return False
+
+        # 2) verify the request
+        request_key = get_resume_key(resumed_secret, ios_key_pub, session_id, 'Pair-Resume-Request-Info')
+        if chacha20_aead_decrypt(bytes(), request_key, 'PR-Msg01'.encode(), bytes([0, 0, 0, 0]),
+                                 d_req[TLV.kTLVType_EncryptedData]) is False:
+            return False
+
+        # 3) new session id and response
+        new_session_id = os.urandom(8)
+        response_key = get_resume_key(resumed_secret, ios_key_pub, new_session_id, 'Pair-Resume-Response-Info')
+        encrypted_data_with_auth_tag = chacha20_aead_encrypt(bytes(), response_key, 'PR-Msg02'.encode(),
+                                                             bytes([0, 0, 0, 0]), bytes())
+        tmp = bytearray(encrypted_data_with_auth_tag[0])
+        tmp += encrypted_data_with_auth_tag[1]
+
+        # 4) derive the new shared secret and the session keys
+        shared_secret = get_resume_key(resumed_secret, ios_key_pub, new_session_id, 'Pair-Resume-Shared-Secret-Info')
+        self.server.sessions[self.session_id]['ios_device_pairing_id'] = ios_device_pairing_id
+        self._set_session_keys(shared_secret)
+        self.server.session_cache.add(get_resume_session_id(shared_secret), ios_device_pairing_id, shared_secret)
 
-            # AddPairing/RemovePairing, M1
-            TLV.kTLVType_Identifier,
+        d_res = [
+            (TLV.kTLVType_State, TLV.M2),
+            (TLV.kTLVType_SessionID, new_session_id),
+            (TLV.kTLVType_EncryptedData, tmp),
+        ]
+        self._send_response_tlv(d_res)
+        if AccessoryRequestHandler.DEBUG_PAIR_VERIFY:
+            self.log_message('after step #2 (resume)\n%s', TLV.to_string(d_res))
+        return True
 
-            # AddPairing, M1
-            TLV.kTLVType_PublicKey,
-            TLV.kTLVType_Permissions,
-        ])
+    def _post_pairings(self):
+        d_req = TlvMessage(self.body)
 
         self.log_message('POST /pairings request body:\n%s', TLV.to_string(d_req))
 
@@ -809,8 +834,10 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
 
         d_res = []
 
-        if d_req[0][0] == TLV.kTLVType_State and d_req[0][1] == TLV.M1 \
-                and d_req[1][0] == TLV.kTLVType_Method and d_req[1][1] == TLV.AddPairing:
+        state = d_req.get(TLV.kTLVType_State)
+        method = d_req.get(TLV.kTLVType_Method)
+
+        if state == TLV.M1 and method == TLV.AddPairing:
             self.log_message('Step #2 /pairings add pairing')
             d_res.append((TLV.kTLVType_State, TLV.M2,))
 
@@ -824,9 +851,9 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
                 self.log_error('error in step #2: admin bit')
                 return
 
-            additional_controller_pairing_identifier = d_req[2][1]
-            additional_controller_LTPK = d_req[3][1]
-            additional_controller_permissions = d_req[4][1]
+            additional_controller_pairing_identifier = d_req[TLV.kTLVType_Identifier]
+            additional_controller_LTPK = d_req[TLV.kTLVType_PublicKey]
+            additional_controller_permissions = d_req[TLV.kTLVType_Permissions]
             is_admin = additional_controller_permissions == b'\x01'
 
             # 3) pairing exists?
@@ -856,8 +883,7 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
 
             return
 
-        if d_req[0][0] == TLV.kTLVType_State and d_req[0][1] == TLV.M1 \
-                and d_req[1][0] == TLV.kTLVType_Method and d_req[1][1] == TLV.RemovePairing:
+        if state == TLV.M1 and method == TLV.RemovePairing:
             # step #2 Accessory -> iOS Device remove pairing response
             self.log_message('Step #2 /pairings remove pairings')
 
@@ -871,7 +897,8 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
                 return
 
             # 3) remove pairing and republish device
-            server_data.remove_peer(d_req[2][1])
+            server_data.remove_peer(d_req[TLV.kTLVType_Identifier])
+            self.server.session_cache.remove_pairing(bytes(d_req[TLV.kTLVType_Identifier]))
             self.server.publish_device()
 
             d_res.append((TLV.kTLVType_State, TLV.M2,))
@@ -889,8 +916,7 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
             #    self.close_connection = True
             return
 
-        if d_req[0][0] == TLV.kTLVType_State and d_req[0][1] == TLV.M1 \
-                and d_req[1][0] == TLV.kTLVType_Method and d_req[1][1] == TLV.ListPairings:
+        if state == TLV.M1 and method == TLV.ListPairings:
             # step #2 Accessory -> iOS Device list pairing response
             self.log_message('Step #2 /pairings list pairings')
 
@@ -951,24 +977,14 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
         self.wfile.write(result_bytes)
 
     def _post_pair_setup(self):
-        d_req = TLV.decode_bytes(self.body)
-
-        # Order is not consistent, so force things in to order specified in spec
-        d_req = TLV.reorder(d_req, [
-            TLV.kTLVType_State,
-            TLV.kTLVType_Method,
-            # For M3
-            TLV.kTLVType_PublicKey,
-            TLV.kTLVType_Proof,
-            # For M5
-            TLV.kTLVType_EncryptedData,
-        ])
+        d_req = TlvMessage(self.body)
 
         self.log_message('POST /pair-setup request body:\n%s', TLV.to_string(d_req))
 
         d_res = []
+        state = d_req.get(TLV.kTLVType_State)
 
-        if d_req[0][0] == TLV.kTLVType_State and d_req[0][1] == TLV.M1:
+        if state == TLV.M1:
             # step #2 Accessory -> iOS Device SRP Start Response
             self.log_message('Step #2 /pair-setup')
 
@@ -1013,22 +1029,22 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
             self.log_message('after step #2:\n%s', TLV.to_string(d_res))
             return
 
-        if d_req[0][0] == TLV.kTLVType_State and d_req[0][1] == TLV.M3:
+        if state == TLV.M3:
             # step #4 Accessory -> iOS Device SRP Verify Response
             self.log_message('Step #4 /pair-setup')
 
             # 1) use ios pub key to compute shared secret key
-            ios_pub_key = int.from_bytes(d_req[1][1], "big")
+            ios_pub_key = int.from_bytes(d_req[TLV.kTLVType_PublicKey], "big")
             server = self.server.sessions[self.session_id]['srp']
             server.set_client_public_key(ios_pub_key)
 
-            hkdf_inst = hkdf.Hkdf('Pair-Setup-Encrypt-Salt'.encode(), SrpServer.to_byte_array(server.get_session_key()),
-                                  hash=hashlib.sha512)
-            session_key = hkdf_inst.expand('Pair-Setup-Encrypt-Info'.encode(), 32)
+            session_key = hkdf_sha512('Pair-Setup-Encrypt-Salt'.encode(),
+                                      SrpServer.to_byte_array(server.get_session_key()),
+                                      'Pair-Setup-Encrypt-Info'.encode())
             self.server.sessions[self.session_id]['session_key'] = session_key
 
             # 2) verify ios proof
-            ios_proof = int.from_bytes(d_req[2][1], "big")
+            ios_proof = int.from_bytes(d_req[TLV.kTLVType_Proof], "big")
             if not server.verify_clients_proof(ios_proof):
                 d_res.append((TLV.kTLVType_State, TLV.M4,))
                 d_res.append((TLV.kTLVType_Error, TLV.kTLVError_Authentication,))
@@ -1052,7 +1068,7 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
             self.log_message('after step #4:\n%s', TLV.to_string(d_res))
             return
 
-        if d_req[0][0] == TLV.kTLVType_State and d_req[0][1] == TLV.M5:
+        if state == TLV.M5:
             # step #6 Accessory -> iOS Device Exchange Response
             self.log_message('Step #6 /pair-setup')
 
@@ -1060,7 +1076,7 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
             # done by chacha20_aead_decrypt
 
             # 2) decrypt and test
-            encrypted_data = d_req[1][1]
+            encrypted_data = d_req[TLV.kTLVType_EncryptedData]
             decrypted_data = chacha20_aead_decrypt(bytes(), self.server.sessions[self.session_id]['session_key'],
                                                    'PS-Msg05'.encode(), bytes([0, 0, 0, 0]),
                                                    encrypted_data)
@@ -1072,26 +1088,24 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
                 self.log_error('error in step #6 %s %s', d_res, self.server.sessions)
                 return
 
-            d_req_2 = TLV.decode_bytearray(decrypted_data)
+            d_req_2 = TlvMessage(decrypted_data)
 
             # 3) Derive ios_device_x
             shared_secret = self.server.sessions[self.session_id]['srp'].get_session_key()
-            hkdf_inst = hkdf.Hkdf('Pair-Setup-Controller-Sign-Salt'.encode(), SrpServer.to_byte_array(shared_secret),
-                                  hash=hashlib.sha512)
-            ios_device_x = hkdf_inst.expand('Pair-Setup-Controller-Sign-Info'.encode(), 32)
+            ios_device_x = hkdf_sha512('Pair-Setup-Controller-Sign-Salt'.encode(),
+                                       SrpServer.to_byte_array(shared_secret),
+                                       'Pair-Setup-Controller-Sign-Info'.encode())
 
             # 4) construct ios_device_info
-            ios_device_pairing_id = d_req_2[0][1]  # should be TLV.kTLVType_Identifier
-            ios_device_ltpk = d_req_2[1][1]  # should be TLV.kTLVType_PublicKey
+            ios_device_pairing_id = d_req_2[TLV.kTLVType_Identifier]
+            ios_device_ltpk = d_req_2[TLV.kTLVType_PublicKey]
             ios_device_info = ios_device_x + ios_device_pairing_id + ios_device_ltpk
 
             # 5) verify signature
-            ios_device_sig = d_req_2[2][1]  # should be [TLV.kTLVType_Signature
+            ios_device_sig = d_req_2[TLV.kTLVType_Signature]
 
-            verify_key = ed25519.VerifyingKey(bytes(ios_device_ltpk))
-            try:
-                verify_key.verify(bytes(ios_device_sig), bytes(ios_device_info))
-            except ed25519.BadSignatureError:
+            verify_key = get_verifying_key(ios_device_ltpk)
+            if not verify_key.verify(ios_device_sig, ios_device_info):
                 self.send_error_reply(TLV.M6, TLV.kTLVError_Authentication)
                 self.log_error('error in step #6 %s %s', d_res, self.server.sessions)
                 return
@@ -1102,24 +1116,17 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
             # Response Generation
             # 1) generate accessoryLTPK if not existing
             if self.server.data.accessory_ltsk is None or self.server.data.accessory_ltpk is None:
-                accessory_ltsk, accessory_ltpk = ed25519.create_keypair()
-                self.server.data.set_accessory_keys(
-                    accessory_ltpk.to_bytes(),
-                    accessory_ltsk.to_bytes(),
-                )
-            else:
-                accessory_ltsk = ed25519.SigningKey(
-                    self.server.data.accessory_ltsk + self.server.data.accessory_ltpk
-                )
-                accessory_ltpk = ed25519.VerifyingKey(self.server.data.accessory_ltpk)
+                accessory_ltsk, accessory_ltpk = create_ed25519_keypair()
+                self.server.data.set_accessory_keys(accessory_ltpk, accessory_ltsk)
+            accessory_ltsk = get_signing_key(self.server.data.accessory_ltsk)
+            accessory_ltpk = accessory_ltsk.public_key
 
             # 2) derive AccessoryX
-            hkdf_inst = hkdf.Hkdf('Pair-Setup-Accessory-Sign-Salt'.encode(), SrpServer.to_byte_array(shared_secret),
-                                  hash=hashlib.sha512)
-            accessory_x = hkdf_inst.expand('Pair-Setup-Accessory-Sign-Info'.encode(), 32)
+            accessory_x = hkdf_sha512('Pair-Setup-Accessory-Sign-Salt'.encode(), SrpServer.to_byte_array(shared_secret),
+                                      'Pair-Setup-Accessory-Sign-Info'.encode())
 
             # 3)
-            accessory_info = accessory_x + self.server.data.accessory_pairing_id_bytes + accessory_ltpk.to_bytes()
+            accessory_info = accessory_x + self.server.data.accessory_pairing_id_bytes + accessory_ltpk
 
             # 4) generate signature
             accessory_signature = accessory_ltsk.sign(accessory_info)
@@ -1127,7 +1134,7 @@ class AccessoryRequestHandler(BaseHTTPRequestHandler):
             # 5) construct sub_tlv
             sub_tlv = [
                 (TLV.kTLVType_Identifier, self.server.data.accessory_pairing_id_bytes),
-                (TLV.kTLVType_PublicKey, accessory_ltpk.to_bytes()),
+                (TLV.kTLVType_PublicKey, accessory_ltpk),
                 (TLV.kTLVType_Signature, accessory_signature)
             ]
             sub_tlv_b = TLV.encode_list(sub_tlv)
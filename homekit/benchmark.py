@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Micro benchmarks for the crypto used by HomeKit sessions. The results are seconds per operation (the best of several
+repeats) and can be written as json. If a baseline (an earlier result file) is given, the run fails if a benchmark got
+slower than the baseline by more than the tolerance.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from cryptography.hazmat.primitives.asymmetric import x25519
+from cryptography.hazmat.primitives import serialization
+
+from homekit.crypto import HapCipher, SrpClient, SrpServer, available_aead_backends, chacha20_aead_decrypt, \
+    chacha20_aead_encrypt, set_aead_backend
+from homekit.crypto.chacha20poly1305 import poly1305_mac
+from homekit.crypto.primitives import create_ed25519_keypair, get_signing_key, get_verifying_key, hkdf_sha512
+from homekit.http_impl.response import HttpResponse
+from homekit.log_support import setup_logging, add_log_arguments
+from homekit.protocol import get_control_keys, get_resume_key, get_resume_session_id, get_session_keys
+from homekit.protocol.session_cache import SessionCache
+from homekit.protocol.tlv import TLV
+
+FRAME_SIZES = [0, 16, 64, 256, 1024]
+MULTI_FRAME_SIZE = 8 * HapCipher.MAX_FRAME_LENGTH
+
+
+class PairVerifyStandIn:
+    """
+    The accessory side of pair verify (including pair resume) without any transport, so get_session_keys can be
+    measured without network and HTTP overhead. It is a slimmed down version of what AccessoryRequestHandler does.
+    """
+
+    def __init__(self):
+        self.accessory_pairing_id = '12:34:56:00:01:0A'
+        self.accessory_ltsk, accessory_ltpk = create_ed25519_keypair()
+        self.controller_pairing_id = 'decc6fa3-de3e-41c9-adba-ef7409821bfc'
+        controller_ltsk, self.controller_ltpk = create_ed25519_keypair()
+        self.pairing_data = {
+            'AccessoryPairingID': self.accessory_pairing_id,
+            'AccessoryLTPK': accessory_ltpk.hex(),
+            'iOSPairingId': self.controller_pairing_id,
+            'iOSDeviceLTSK': controller_ltsk.hex(),
+            'iOSDeviceLTPK': self.controller_ltpk.hex(),
+        }
+        self.session_cache = SessionCache()
+        self._state = {}
+
+    def write(self, request, expected):
+        d_req = {key: bytes(value) for key, value in TLV.decode_bytes(request)}
+        if d_req[TLV.kTLVType_State] == TLV.M3:
+            return self._m4(d_req)
+        if d_req.get(TLV.kTLVType_Method) == bytes([TLV.kTLVMethod_Resume]):
+            resumable = self.session_cache.pop(d_req[TLV.kTLVType_SessionID])
+            if resumable is not None:
+                return self._resume_m2(d_req, resumable[1])
+        return self._m2(d_req)
+
+    def _m2(self, d_req):
+        key = x25519.X25519PrivateKey.generate()
+        accessory_spk = key.public_key().public_bytes(encoding=serialization.Encoding.Raw,
+                                                      format=serialization.PublicFormat.Raw)
+        ios_pub_key = d_req[TLV.kTLVType_PublicKey]
+        shared_secret = key.exchange(x25519.X25519PublicKey.from_public_bytes(ios_pub_key))
+        signature = get_signing_key(self.accessory_ltsk).sign(accessory_spk + self.accessory_pairing_id.encode() +
+                                                              ios_pub_key)
+        sub_tlv = TLV.encode_list([
+            (TLV.kTLVType_Identifier, self.accessory_pairing_id.encode()),
+            (TLV.kTLVType_Signature, signature)
+        ])
+        session_key = hkdf_sha512(b'Pair-Verify-Encrypt-Salt', shared_secret, b'Pair-Verify-Encrypt-Info')
+        encrypted = chacha20_aead_encrypt(bytes(), session_key, b'PV-Msg02', bytes(4), sub_tlv)
+        self._state = {'shared_secret': shared_secret, 'session_key': session_key, 'accessory_spk': accessory_spk,
+                       'ios_pub_key': ios_pub_key}
+        return [[TLV.kTLVType_State, TLV.M2], [TLV.kTLVType_PublicKey, bytearray(accessory_spk)],
+                [TLV.kTLVType_EncryptedData, encrypted[0] + encrypted[1]]]
+
+    def _m4(self, d_req):
+        decrypted = chacha20_aead_decrypt(bytes(), self._state['session_key'], b'PV-Msg03', bytes(4),
+                                          d_req[TLV.kTLVType_EncryptedData])
+        d_sub = {key: bytes(value) for key, value in TLV.decode_bytes(decrypted)}
+        ios_device_info = self._state['ios_pub_key'] + d_sub[TLV.kTLVType_Identifier] + self._state['accessory_spk']
+        if not get_verifying_key(self.controller_ltpk).verify(d_sub[TLV.kTLVType_Signature], ios_device_info):
+            return [[TLV.kTLVType_State, TLV.M4], [TLV.kTLVType_Error, TLV.kTLVError_Authentication]]
+        shared_secret = self._state['shared_secret']
+        get_control_keys(shared_secret)
+        self.session_cache.add(get_resume_session_id(shared_secret), self.controller_pairing_id, shared_secret)
+        return [[TLV.kTLVType_State, TLV.M4]]
+
+    def _resume_m2(self, d_req, resumed_secret):
+        ios_pub_key = d_req[TLV.kTLVType_PublicKey]
+        request_key = get_resume_key(resumed_secret, ios_pub_key, d_req[TLV.kTLVType_SessionID],
+                                     'Pair-Resume-Request-Info')
+        if chacha20_aead_decrypt(bytes(), request_key, b'PR-Msg01', bytes(4),
+                                 d_req[TLV.kTLVType_EncryptedData]) is False:
+            return self._m2(d_req)
+        new_session_id = os.urandom(8)
+        response_key = get_resume_key(resumed_secret, ios_pub_key, new_session_id, 'Pair-Resume-Response-Info')
+        encrypted = chacha20_aead_encrypt(bytes(), response_key, b'PR-Msg02', bytes(4), bytes())
+        shared_secret = get_resume_key(resumed_secret, ios_pub_key, new_session_id, 'Pair-Resume-Shared-Secret-Info')
+        get_control_keys(shared_secret)
+        self.session_cache.add(get_resume_session_id(shared_secret), self.controller_pairing_id, shared_secret)
+        return [[TLV.kTLVType_State, TLV.M2], [TLV.kTLVType_SessionID, bytearray(new_session_id)],
+                [TLV.kTLVType_EncryptedData, encrypted[0] + encrypted[1]]]
+
+
+def _aead_benchmarks(backend: str) -> dict:
+    key = os.urandom(32)
+    iv = os.urandom(8)
+    constant = bytes(4)
+    aad = os.urandom(2)
+
+    def encrypt(data):
+        return lambda: chacha20_aead_encrypt(aad, key, iv, constant, data)
+
+    def decrypt(data):
+        cipher_text = chacha20_aead_encrypt(aad, key, iv, constant, data)
+        cipher_text_and_tag = cipher_text[0] + cipher_text[1]
+        return lambda: chacha20_aead_decrypt(aad, key, iv, constant, cipher_text_and_tag)
+
+    def frames(data):
+        def run():
+            cipher = HapCipher(key)
+            for offset in range(0, len(data), HapCipher.MAX_FRAME_LENGTH):
+                cipher.encrypt_frame(data[offset:offset + HapCipher.MAX_FRAME_LENGTH])
+        return run
+
+    benchmarks = {}
+    for size in FRAME_SIZES:
+        data = os.urandom(size)
+        benchmarks['aead_encrypt[{b}][{s}]'.format(b=backend, s=size)] = encrypt(data)
+        benchmarks['aead_decrypt[{b}][{s}]'.format(b=backend, s=size)] = decrypt(data)
+    benchmarks['hap_cipher_frames[{b}][{s}]'.format(b=backend, s=MULTI_FRAME_SIZE)] = \
+        frames(os.urandom(MULTI_FRAME_SIZE))
+    return benchmarks
+
+
+def _srp_exchange():
+    server = SrpServer('Pair-Setup', '123-45-678')
+    client = SrpClient('Pair-Setup', '123-45-678')
+    client.set_salt(server.get_salt())
+    client.set_server_public_key(server.get_public_key())
+    server.set_client_public_key(client.get_public_key())
+    client_proof = client.get_proof()
+    if not server.verify_clients_proof(client_proof):
+        raise AssertionError('client proof not verified')
+    if not client.verify_servers_proof(server.get_proof(client_proof)):
+        raise AssertionError('server proof not verified')
+
+
+def _general_benchmarks() -> dict:
+    otk = os.urandom(32)
+    message = os.urandom(1024)
+    shared_secret = os.urandom(32)
+    stand_in = PairVerifyStandIn()
+    session_cache = SessionCache()
+
+    def session_keys_with_resume():
+        get_session_keys(None, stand_in.pairing_data, stand_in.write, session_cache)
+
+    # a 64 KiB chunked response in frames of 1024 bytes like esp-homekit based accessories send it
+    chunked = b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n' + \
+        b''.join(b'200\r\n' + os.urandom(512) + b'\r\n' for _ in range(128)) + b'0\r\n\r\n'
+    frames = [chunked[offset:offset + 1024] for offset in range(0, len(chunked), 1024)]
+
+    def parse_chunked_response():
+        response = HttpResponse()
+        for frame in frames:
+            response.parse(frame)
+
+    return {
+        'poly1305_mac[1024]': lambda: poly1305_mac(message, otk),
+        'hkdf_sha512': lambda: hkdf_sha512(b'Pair-Verify-Encrypt-Salt', shared_secret, b'Pair-Verify-Encrypt-Info'),
+        'control_keys': lambda: get_control_keys(shared_secret),
+        'srp_exchange': _srp_exchange,
+        'get_session_keys': lambda: get_session_keys(None, stand_in.pairing_data, stand_in.write),
+        # the first call does the full pair verify, all later ones resume
+        'get_session_keys_resume': session_keys_with_resume,
+        'http_response_chunked[64k]': parse_chunked_response,
+    }
+
+
+def measure(function, min_time: float = 0.2, repeats: int = 3) -> float:
+    """
+    Measures the time per call of a function.
+
+    :param function: the function to call without parameters
+    :param min_time: the minimal duration of one repeat in seconds, the number of calls is raised until it is reached
+    :param repeats: the number of repeats
+    :return: the best time per call in seconds
+    """
+    function()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        duration = time.perf_counter() - start
+        if duration >= min_time or number >= 1 << 20:
+            break
+        number *= 2 if duration == 0 else max(2, min(10, int(min_time / duration) + 1))
+    best = duration / number
+    for _ in range(1, repeats):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def run_benchmarks(backends=None, name_filter=None, min_time: float = 0.2, repeats: int = 3) -> dict:
+    """
+    Runs all benchmarks. The aead benchmarks are run once for each backend.
+
+    :param backends: list of the aead backend names to measure, defaults to all available backends
+    :param name_filter: only benchmarks whose names contain this string are run (optional)
+    :param min_time: see measure
+    :param repeats: see measure
+    :return: a dict with information on the system and 'results' mapping the benchmark names to seconds per call
+    """
+    if backends is None:
+        backends = available_aead_backends()
+    results = {}
+    try:
+        for backend in backends:
+            set_aead_backend(backend)
+            for name, function in sorted(_aead_benchmarks(backend).items()):
+                if name_filter is None or name_filter in name:
+                    results[name] = measure(function, min_time, repeats)
+    finally:
+        set_aead_backend(None)
+    for name, function in sorted(_general_benchmarks().items()):
+        if name_filter is None or name_filter in name:
+            results[name] = measure(function, min_time, repeats)
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'aead_backends': backends,
+        'results': results,
+    }
+
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance: float = 0.25) -> list:
+    """
+    Compares results to a baseline. Benchmarks that are only in one of both are ignored.
+
+    :param results: the result of run_benchmarks
+    :param baseline: an earlier result of run_benchmarks
+    :param tolerance: the allowed slow down, 0.25 means 25% slower than the baseline still passes
+    :return: list of tuples of name, baseline time and current time for all benchmarks that regressed
+    """
+    regressions = []
+    for name, current in sorted(results['results'].items()):
+        reference = baseline['results'].get(name)
+        if reference is not None and current > reference * (1 + tolerance):
+            regressions.append((name, reference, current))
+    return regressions
+
+
+def setup_args_parser():
+    parser = argparse.ArgumentParser(description='HomeKit crypto benchmarks')
+    parser.add_argument('-o', action='store', dest='output', help='write the results as json to this file')
+    parser.add_argument('-b', action='store', dest='baseline', help='compare the results to this result file')
+    parser.add_argument('-t', action='store', dest='tolerance', type=float, default=0.25,
+                        help='allowed slow down compared to the baseline (defaults to 0.25 for 25%%)')
+    parser.add_argument('--backend', action='append', dest='backends',
+                        help='aead backend to measure (can be repeated, defaults to all available backends)')
+    parser.add_argument('-k', action='store', dest='filter', help='only run benchmarks whose name contains this')
+    parser.add_argument('--min-time', action='store', dest='min_time', type=float, default=0.2,
+                        help='minimal duration of each measurement in seconds')
+    add_log_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = setup_args_parser()
+
+    setup_logging(args.loglevel)
+
+    results = run_benchmarks(args.backends, args.filter, args.min_time)
+    for name, seconds in sorted(results['results'].items()):
+        print('{n:<40} {t:12.3f} us'.format(n=name, t=seconds * 1e6))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=4, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        for name, reference, current in regressions:
+            print('REGRESSION {n}: {r:.3f} us -> {c:.3f} us'.format(n=name, r=reference * 1e6, c=current * 1e6))
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,147 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+
+logger = logging.getLogger('homekit.controller.accessory_cache')
+
+
+def normalize_config_num(config_num):
+    """
+    Brings configuration numbers into one form. Bonjour delivers the c# as string, BLE discovery the cn as int.
+
+    :param config_num: the configuration number as str or int, None if unknown
+    :return: the configuration number as int or None
+    """
+    if config_num is None:
+        return None
+    try:
+        return int(config_num)
+    except (TypeError, ValueError):
+        return None
+
+
+class AccessoryCache(object):
+    """
+    Keeps the accessory databases (the result of list_accessories_and_characteristics) of paired accessories on disk,
+    so they are available right after a restart without asking the accessories. Each entry is stored with the
+    configuration number (c# for IP, cn for BLE accessories) it was read at. The accessories increase this number if
+    their database changes, so an entry is only valid as long as discovery reports the same number.
+
+    The entries are stored as one JSON file per accessory in the given directory.
+    """
+
+    def __init__(self, directory: str):
+        """
+        :param directory: the directory for the cache files, it is created if it does not exist
+        """
+        self.directory = directory
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _filename(self, pairing_id: str) -> str:
+        return os.path.join(self.directory, re.sub(r'[^0-9A-Za-z_-]', '_', pairing_id) + '.json')
+
+    def _load(self, pairing_id: str):
+        # must be called with the lock held
+        if pairing_id in self._entries:
+            return self._entries[pairing_id]
+        entry = None
+        try:
+            with open(self._filename(pairing_id), 'r') as input_fp:
+                data = json.load(input_fp)
+            if data.get('pairing_id') == pairing_id and isinstance(data.get('accessories'), list):
+                entry = (normalize_config_num(data.get('config_num')), data['accessories'])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning('ignoring unreadable cache entry for %s: %s', pairing_id, e)
+        self._entries[pairing_id] = entry
+        return entry
+
+    def get(self, pairing_id: str, config_num=None):
+        """
+        Returns the cached accessory database of an accessory.
+
+        :param pairing_id: the accessory's pairing id (AccessoryPairingID)
+        :param config_num: the configuration number the accessory currently reports, None if it is not known
+        :return: the accessories as returned by list_accessories_and_characteristics or None if there is no entry or
+                 the entry belongs to another configuration number
+        """
+        with self._lock:
+            entry = self._load(pairing_id)
+        if entry is None:
+            return None
+        config_num = normalize_config_num(config_num)
+        if config_num is not None and entry[0] != config_num:
+            return None
+        return entry[1]
+
+    def get_config_num(self, pairing_id: str):
+        """
+        :param pairing_id: the accessory's pairing id
+        :return: the configuration number of the cached entry, None if there is no entry or the number is unknown
+        """
+        with self._lock:
+            entry = self._load(pairing_id)
+        return None if entry is None else entry[0]
+
+    def put(self, pairing_id: str, config_num, accessories: list):
+        """
+        Stores the accessory database of an accessory. Problems writing the file are logged, the entry is kept in
+        memory anyway.
+
+        :param pairing_id: the accessory's pairing id
+        :param config_num: the configuration number the database belongs to, None if it is not known
+        :param accessories: the accessories as returned by list_accessories_and_characteristics
+        """
+        config_num = normalize_config_num(config_num)
+        with self._lock:
+            self._entries[pairing_id] = (config_num, accessories)
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                # write to a temporary file first, so readers never see a partially written entry
+                fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'w') as output_fp:
+                        json.dump({'pairing_id': pairing_id, 'config_num': config_num, 'accessories': accessories},
+                                  output_fp)
+                    os.replace(tmp_name, self._filename(pairing_id))
+                except BaseException:
+                    os.remove(tmp_name)
+                    raise
+            except OSError as e:
+                logger.warning('could not write cache entry for %s: %s', pairing_id, e)
+
+    def remove(self, pairing_id: str):
+        """
+        Forgets the accessory database of an accessory, e.g. after the pairing was removed.
+
+        :param pairing_id: the accessory's pairing id
+        """
+        with self._lock:
+            self._entries[pairing_id] = None
+            try:
+                os.remove(self._filename(pairing_id))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning('could not remove cache entry for %s: %s', pairing_id, e)
@@ -0,0 +1,99 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from homekit.model.characteristics import CharacteristicsTypes
+from homekit.model.services import ServicesTypes
+
+
+def _full_type(types, type_name: str) -> str:
+    # the full upper case UUID, unknown types (e.g. vendor specific ones) are only upper cased
+    try:
+        return types.get_uuid(type_name)
+    except KeyError:
+        return type_name.upper()
+
+
+class AccessoryIndex(object):
+    """
+    Lookup tables over an accessory database (the result of list_accessories_and_characteristics), so single
+    characteristics and characteristics or services of a type are found without walking through all accessories.
+    The index is built once and does not notice later changes of the database.
+    """
+
+    def __init__(self, accessories: list):
+        """
+        :param accessories: the accessory data as described in the spec on page 73 and following
+        """
+        self.accessories = accessories
+        self._characteristics = {}
+        self._services = {}
+        self._characteristics_by_type = {}
+        self._services_by_type = {}
+        for accessory in accessories:
+            aid = accessory['aid']
+            for service in accessory['services']:
+                s_type = _full_type(ServicesTypes, service['type'])
+                self._services_by_type.setdefault(s_type, []).append((aid, service['iid']))
+                for characteristic in service['characteristics']:
+                    key = (aid, characteristic['iid'])
+                    self._characteristics[key] = characteristic
+                    self._services[key] = service
+                    c_type = _full_type(CharacteristicsTypes, characteristic['type'])
+                    self._characteristics_by_type.setdefault(c_type, []).append(key)
+
+    def __len__(self):
+        return len(self._characteristics)
+
+    def get(self, aid: int, iid: int):
+        """
+        :param aid: the accessory id
+        :param iid: the instance id of the characteristic
+        :return: the characteristic's data or None if there is no such characteristic
+        """
+        return self._characteristics.get((aid, iid))
+
+    def get_service(self, aid: int, iid: int):
+        """
+        :param aid: the accessory id
+        :param iid: the instance id of the characteristic
+        :return: the data of the service containing the characteristic or None if there is no such characteristic
+        """
+        return self._services.get((aid, iid))
+
+    def get_format(self, aid: int, iid: int):
+        """
+        :param aid: the accessory id
+        :param iid: the instance id of the characteristic
+        :return: the format of the characteristic (see CharacteristicFormats) or None if it is not known
+        """
+        characteristic = self._characteristics.get((aid, iid))
+        if characteristic is None:
+            return None
+        return characteristic.get('format')
+
+    def find_characteristics(self, characteristic_type: str) -> list:
+        """
+        :param characteristic_type: the type as short or full UUID or as name (see CharacteristicsTypes)
+        :return: the list of 2-tupels of aid and iid of the characteristics of the type, in database order
+        """
+        return self._characteristics_by_type.get(_full_type(CharacteristicsTypes, characteristic_type), [])
+
+    def find_services(self, service_type: str) -> list:
+        """
+        :param service_type: the type as short or full UUID or as name (see ServicesTypes)
+        :return: the list of 2-tupels of aid and iid of the services of the type, in database order
+        """
+        return self._services_by_type.get(_full_type(ServicesTypes, service_type), [])
@@ -0,0 +1,495 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+The asyncio variant of the IP controller path. The sessions use asyncio streams, so waiting for responses and events
+does not hold a thread. Pair setup and pair verify reuse the blocking protocol functions: they run in the event loop's
+executor and their write_fun hands each request back to the event loop.
+"""
+import asyncio
+import json
+import logging
+import uuid
+from json.decoder import JSONDecodeError
+
+from homekit.controller.controller import Controller
+from homekit.controller.ip_implementation import normalize_accessories, characteristics_url, parse_characteristics, \
+    characteristics_write_body, events_body, parse_status, parse_event, parse_pairings
+from homekit.controller.tools import AbstractPairing
+from homekit.exceptions import AccessoryNotFoundError, AccessoryDisconnectedError, EncryptionError, \
+    AlreadyPairedError, TransportNotSupportedError, AccessoryTimeoutError
+from homekit.http_impl import HttpContentTypes
+from homekit.model.characteristics import CharacteristicsTypes
+from homekit.http_impl.async_secure_http import AsyncSecureHttp, plain_request
+from homekit.protocol import get_session_keys, perform_pair_setup_part1, perform_pair_setup_part2
+from homekit.protocol.tlv import TLV, TlvMessage
+from homekit.tools import IP_TRANSPORT_SUPPORTED
+from homekit.zeroconf_impl import find_device_ip_and_port
+
+logger = logging.getLogger('homekit.controller.async_ip_implementation')
+
+
+def create_async_write(loop, reader, writer, host: str, port: int, target: str, timeout=10):
+    """
+    Creates a write_fun for the protocol functions (e.g. get_session_keys) that are run in an executor thread. Each
+    request is sent by the event loop over the given streams.
+
+    :param loop: the event loop that owns the streams
+    :param reader: the asyncio StreamReader of the connection
+    :param writer: the asyncio StreamWriter of the connection
+    :param host: the host of the accessory
+    :param port: the port of the accessory
+    :param target: /pair-setup or /pair-verify
+    :param timeout: the number of seconds to wait for each response
+    :return: the write function
+    """
+    def write_http(request, expected):
+        future = asyncio.run_coroutine_threadsafe(plain_request(reader, writer, host, port, target, request), loop)
+        response = future.result(timeout)
+        return TlvMessage(response.read(), expected)
+
+    return write_http
+
+
+class AsyncIpSession(object):
+    """
+    A secured session with an IP accessory using asyncio streams. Use AsyncIpSession.connect to create one.
+    """
+
+    def __init__(self, pairing_data, reader, writer, c2a_key, a2c_key):
+        self.pairing_data = pairing_data
+        self.sec_http = AsyncSecureHttp(reader, writer, c2a_key, a2c_key, pairing_data['AccessoryIP'],
+                                        pairing_data['AccessoryPort'])
+
+    @staticmethod
+    async def _verify(host, port, pairing_data, session_cache):
+        loop = asyncio.get_event_loop()
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            write_fun = create_async_write(loop, reader, writer, host, port, '/pair-verify')
+            keys = await loop.run_in_executor(None, get_session_keys, None, pairing_data, write_fun, session_cache)
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer, keys
+
+    @staticmethod
+    async def connect(pairing_data, session_cache=None):
+        """
+        Connects to the accessory and performs pair verify (or pair resume if the session cache contains a session
+        with the accessory). If the accessory can not be reached at the known address, it is looked up via zeroconf.
+
+        :param pairing_data: the pairing data of the accessory
+        :param session_cache: the SessionCache used to resume an earlier session with the accessory (optional)
+        :return: the AsyncIpSession
+        :raises AccessoryNotFoundError: if the device can not be found via zeroconf
+        """
+        logger.debug('init session')
+        connected = None
+        if 'AccessoryIP' in pairing_data and 'AccessoryPort' in pairing_data:
+            # if it is known, try it
+            try:
+                connected = await AsyncIpSession._verify(pairing_data['AccessoryIP'], pairing_data['AccessoryPort'],
+                                                         pairing_data, session_cache)
+            except Exception:
+                connected = None
+        if connected is None:
+            # no connection yet, so ip / port might have changed and we need to fall back to slow zeroconf lookup
+            device_id = pairing_data['AccessoryPairingID']
+            loop = asyncio.get_event_loop()
+            connection_data = await loop.run_in_executor(None, find_device_ip_and_port, device_id)
+            if connection_data is None:
+                raise AccessoryNotFoundError('Device {id} not found'.format(id=device_id))
+            pairing_data['AccessoryIP'] = connection_data['ip']
+            pairing_data['AccessoryPort'] = connection_data['port']
+            connected = await AsyncIpSession._verify(connection_data['ip'], connection_data['port'], pairing_data,
+                                                     session_cache)
+        reader, writer, (c2a_key, a2c_key) = connected
+        logger.debug('session established')
+        return AsyncIpSession(pairing_data, reader, writer, c2a_key, a2c_key)
+
+    def is_alive(self):
+        """
+        :return: False if the session was closed or its connection broke
+        """
+        return self.sec_http.is_connected()
+
+    def close(self):
+        """
+        Close the session. This closes the connection.
+        """
+        self.sec_http.close()
+
+    async def get(self, url):
+        """
+        Perform HTTP get via the encrypted session.
+        :param url: The url to request
+        :return: a homekit.http_impl.HttpResponse object
+        """
+        return await self.sec_http.get(url)
+
+    async def put(self, url, body, content_type=HttpContentTypes.JSON):
+        """
+        Perform HTTP put via the encrypted session.
+        :param url: The url to request
+        :param body: the body of the put request
+        :param content_type: the content of the content-type header
+        :return: a homekit.http_impl.HttpResponse object
+        """
+        return await self.sec_http.put(url, body, content_type)
+
+    async def post(self, url, body, content_type=HttpContentTypes.JSON):
+        """
+        Perform HTTP post via the encrypted session.
+        :param url: The url to request
+        :param body: the body of the post request
+        :param content_type: the content of the content-type header
+        :return: a homekit.http_impl.HttpResponse object
+        """
+        return await self.sec_http.post(url, body, content_type)
+
+
+class AsyncEventIterator:
+    """
+    Asynchronous iterator over the events of characteristics. Each item is a list of 3-tupels of aid, iid and the
+    value, e.g. [(1, 9, 26.1), (1, 10, 30.5)].
+    """
+
+    def __init__(self, stream, errors):
+        """
+        :param stream: the EventStream of the session that registered for the events
+        :param errors: the characteristics that could not be registered (see AsyncIpPairing.get_events)
+        """
+        self._stream = stream
+        self.errors = errors
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            response = await self._stream.__anext__()
+            body = response.read().decode()
+            if len(body) == 0:
+                continue
+            try:
+                return parse_event(body)
+            except JSONDecodeError:
+                raise AccessoryDisconnectedError("Received malformed event from device")
+
+    def close(self):
+        """
+        Stops the iteration. The accessory keeps sending the events until the session is closed.
+        """
+        self._stream.close()
+
+
+class AsyncIpPairing(AbstractPairing):
+    """
+    This represents a paired HomeKit IP accessory that is used from asyncio code. All requests share one session,
+    which is created on first use and replaced if its connection broke.
+    """
+
+    def __init__(self, pairing_data, session_cache=None, accessory_cache=None):
+        """
+        :param pairing_data: the pairing data as loaded from file or obtained after pairing
+        :param session_cache: the SessionCache used to resume sessions on reconnects (optional)
+        :param accessory_cache: the AccessoryCache that keeps the accessory database across restarts (optional)
+        """
+        self.pairing_data = pairing_data
+        self.session_cache = session_cache
+        self.accessory_cache = accessory_cache
+        self.session = None
+        self._connecting = None
+
+    def close(self):
+        """
+        Close the pairing's communications. This closes the session.
+        """
+        if self.session:
+            self.session.close()
+            self.session = None
+
+    def _get_pairing_data(self):
+        """
+        This method returns the internal pairing data. DO NOT mess around with it.
+
+        :return: a dict containing the data
+        """
+        return self.pairing_data
+
+    async def get_session(self):
+        """
+        Returns the session of the pairing, connecting if there is no working session yet. Concurrent callers share
+        one connect.
+
+        :return: the AsyncIpSession
+        :raises AccessoryNotFoundError: if the device can not be found via zeroconf
+        """
+        if self.session is not None and self.session.is_alive():
+            return self.session
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(AsyncIpSession.connect(self.pairing_data, self.session_cache))
+        connecting = self._connecting
+        try:
+            session = await asyncio.shield(connecting)
+        finally:
+            if self._connecting is connecting and connecting.done():
+                self._connecting = None
+        if self.session is not session:
+            self.close()
+            self.session = session
+        return session
+
+    async def _request(self, method, *args):
+        session = await self.get_session()
+        try:
+            return await getattr(session, method)(*args)
+        except (AccessoryDisconnectedError, EncryptionError):
+            session.close()
+            raise
+
+    async def list_accessories_and_characteristics(self):
+        """
+        This retrieves a current set of accessories and characteristics behind this pairing. If the pairing has an
+        accessory cache, the cached set is returned as long as the configuration number did not change.
+
+        :return: the accessory data as described in the spec on page 73 and following
+        :raises AccessoryNotFoundError: if the device can not be found via zeroconf
+        """
+        accessories = self._get_cached_accessories()
+        if accessories is not None:
+            return accessories
+        response = await self._request('get', '/accessories')
+        accessories = normalize_accessories(json.loads(response.read().decode())['accessories'])
+        self.pairing_data['accessories'] = accessories
+        self._cache_accessories(accessories)
+        return accessories
+
+    async def list_pairings(self):
+        """
+        This method returns all pairings of a HomeKit accessory. See IpPairing.list_pairings for the keys of the
+        dicts.
+
+        :return: a list of dicts
+        :raises: UnknownError: if it receives unexpected data
+        :raises: UnpairedError: if the polled accessory is not paired
+        """
+        request_tlv = TLV.encode_list([
+            (TLV.kTLVType_State, TLV.M1),
+            (TLV.kTLVType_Method, TLV.ListPairings)
+        ])
+        response = await self._request('post', '/pairings', request_tlv, HttpContentTypes.TLV)
+        return parse_pairings(response.read())
+
+    async def get_characteristics(self, characteristics, include_meta=False, include_perms=False, include_type=False,
+                                  include_events=False):
+        """
+        This method is used to get the current readouts of any characteristic of the accessory. See
+        IpPairing.get_characteristics for the parameters.
+
+        :return: a dict mapping 2-tupels of aid and iid to dicts with value or status and description
+        """
+        url = characteristics_url(characteristics, include_meta, include_perms, include_type, include_events)
+        response = await self._request('get', url)
+        try:
+            data = json.loads(response.read().decode())['characteristics']
+        except JSONDecodeError:
+            self.close()
+            raise AccessoryDisconnectedError("Session closed after receiving malformed response from device")
+        return parse_characteristics(data)
+
+    async def put_characteristics(self, characteristics, do_conversion=False):
+        """
+        Update the values of writable characteristics. See IpPairing.put_characteristics for the parameters.
+
+        :return: a dict from (aid, iid) onto {status, description}
+        :raises FormatError: if the input value could not be converted to the target type and conversion was
+                             requested
+        """
+        if 'accessories' not in self.pairing_data:
+            await self.list_accessories_and_characteristics()
+        data = characteristics_write_body(characteristics, self.get_accessory_index(), do_conversion)
+        response = await self._request('put', '/characteristics', data)
+        if response.code != 204:
+            try:
+                data = json.loads(response.read().decode())['characteristics']
+            except JSONDecodeError:
+                self.close()
+                raise AccessoryDisconnectedError("Session closed after receiving malformed response from device")
+            return parse_status(data)
+        return {}
+
+    async def get_events(self, characteristics, maxsize=100):
+        """
+        Registers for events on characteristics and returns an asynchronous iterator over them:
+
+            events = await pairing.get_events([(1, 10)])
+            async for event in events:
+                ...
+
+        :param characteristics: a list of 2-tupels of accessory id (aid) and instance id (iid)
+        :param maxsize: how many unconsumed events are kept, older ones are dropped
+        :return: the AsyncEventIterator, its errors attribute maps 2-tupels of aid and iid to dicts with status and
+                 description for the characteristics that could not be registered
+        """
+        session = await self.get_session()
+        # events can arrive right after the response, so the stream must exist before the request is sent
+        stream = session.sec_http.events(maxsize)
+        try:
+            response = await session.put('/characteristics', events_body(characteristics))
+        except (AccessoryDisconnectedError, EncryptionError):
+            session.close()
+            raise
+        errors = {}
+        if response.code != 204:
+            try:
+                data = json.loads(response.read().decode())
+            except JSONDecodeError:
+                self.close()
+                raise AccessoryDisconnectedError("Session closed after receiving malformed response from device")
+            errors = parse_status(data['characteristics'], include_success=False)
+        return AsyncEventIterator(stream, errors)
+
+    async def identify(self):
+        """
+        This call can be used to trigger the identification of a paired accessory.
+
+        :return True, if the identification was run, False otherwise
+        """
+        if 'accessories' not in self.pairing_data:
+            await self.list_accessories_and_characteristics()
+        identify = self.get_accessory_index().find_characteristics(CharacteristicsTypes.IDENTIFY)
+        if not identify:
+            return False
+        aid, iid = identify[0]
+        await self.put_characteristics([(aid, iid, True)])
+        return True
+
+    async def remove_pairing_request(self, request_tlv):
+        """
+        Sends a request to the /pairings endpoint.
+
+        :param request_tlv: the encoded TLV
+        :return: the response as TlvMessage
+        """
+        response = await self._request('post', '/pairings', request_tlv, HttpContentTypes.TLV)
+        return TlvMessage(response.read())
+
+
+class AsyncController(Controller):
+    """
+    A controller whose IP pairings are AsyncIpPairings. Loading, saving and discovery work as in Controller,
+    perform_pairing and remove_pairing are coroutines. BLE accessories are not supported: their pairings are loaded and
+    saved, but requests to them fail with TransportNotSupportedError.
+    """
+
+    def _create_ip_pairing(self, pairing_data):
+        return AsyncIpPairing(pairing_data, self.session_cache, self.accessory_cache)
+
+    async def perform_pairing(self, alias, accessory_id, pin):
+        """
+        This performs a pairing attempt with the IP accessory identified by its id. See Controller.perform_pairing for
+        details.
+
+        :param alias: the alias for the accessory in the controllers data
+        :param accessory_id: the accessory's id
+        :param pin: the accessory's pin
+        :raises AccessoryNotFoundError: if no accessory with the given id can be found
+        :raises AlreadyPairedError: if the alias was already used
+        :raises MalformedPinError: if the pin is malformed
+        """
+        Controller.check_pin_format(pin)
+        if not IP_TRANSPORT_SUPPORTED:
+            raise TransportNotSupportedError('IP')
+        if alias in self.pairings:
+            raise AlreadyPairedError('Alias "{a}" is already paired.'.format(a=alias))
+
+        loop = asyncio.get_event_loop()
+        connection_data = await loop.run_in_executor(None, find_device_ip_and_port, accessory_id)
+        if connection_data is None:
+            raise AccessoryNotFoundError('Cannot find accessory with id "{i}".'.format(i=accessory_id))
+        reader, writer = await asyncio.open_connection(connection_data['ip'], connection_data['port'])
+        try:
+            write_fun = create_async_write(loop, reader, writer, connection_data['ip'], connection_data['port'],
+                                           '/pair-setup')
+            salt, pub_key = await loop.run_in_executor(None, perform_pair_setup_part1, write_fun)
+            pairing = await loop.run_in_executor(None, perform_pair_setup_part2, pin, str(uuid.uuid4()), write_fun,
+                                                 salt, pub_key)
+        finally:
+            writer.close()
+        pairing['AccessoryIP'] = connection_data['ip']
+        pairing['AccessoryPort'] = connection_data['port']
+        pairing['Connection'] = 'IP'
+        self.pairings[alias] = self._create_ip_pairing(pairing)
+
+    async def remove_pairing(self, alias):
+        """
+        Remove a pairing between the controller and the IP accessory. See Controller.remove_pairing for details.
+
+        :param alias: the controller's alias for the accessory
+        :raises AuthenticationError: if the controller isn't authenticated to the accessory.
+        :raises AccessoryNotFoundError: if the device can not be found via zeroconf
+        :raises UnknownError: on unknown errors
+        """
+        pairing = self.pairings[alias]
+        if not isinstance(pairing, AsyncIpPairing):
+            raise TransportNotSupportedError(pairing._get_pairing_data()['Connection'])
+        request_tlv = Controller._create_remove_pairing_request(pairing._get_pairing_data())
+        data = await pairing.remove_pairing_request(request_tlv)
+        self._handle_remove_pairing_response(alias, data)
+
+    async def get_characteristics(self, characteristics, timeout=10, max_workers=8, **kwargs):
+        """
+        Reads characteristics of several accessories at once. See Controller.get_characteristics for the parameters
+        and the result, max_workers limits the number of accessories that are queried at the same time.
+        """
+        return await self._fan_out(lambda pairing, c: pairing.get_characteristics(c, **kwargs), characteristics,
+                                   timeout, max_workers)
+
+    async def put_characteristics(self, characteristics, timeout=10, max_workers=8, do_conversion=False):
+        """
+        Writes characteristics of several accessories at once. See Controller.put_characteristics for the parameters
+        and the result.
+        """
+        return await self._fan_out(lambda pairing, c: pairing.put_characteristics(c, do_conversion), characteristics,
+                                   timeout, max_workers)
+
+    async def _fan_out(self, function, requests, timeout, max_workers):
+        results = {}
+        errors = {}
+        semaphore = asyncio.Semaphore(max(1, max_workers))
+
+        async def run(alias, arguments):
+            if alias not in self.pairings:
+                errors[alias] = AccessoryNotFoundError('Unknown alias "{a}"'.format(a=alias))
+                return
+            pairing = self.pairings[alias]
+            if not isinstance(pairing, AsyncIpPairing):
+                # e.g. a BlePairing from load_data, its requests would block the event loop
+                errors[alias] = TransportNotSupportedError(pairing._get_pairing_data()['Connection'])
+                return
+            async with semaphore:
+                try:
+                    results[alias] = await asyncio.wait_for(function(pairing, arguments), timeout)
+                except asyncio.TimeoutError:
+                    errors[alias] = AccessoryTimeoutError(
+                        'No answer from "{a}" within {t} seconds'.format(a=alias, t=timeout))
+                except Exception as e:
+                    errors[alias] = e
+
+        await asyncio.gather(*[run(alias, arguments) for alias, arguments in requests.items()])
+        return results, errors
@@ -27,16 +27,17 @@ import struct
 from distutils.util import strtobool
 
 from homekit.controller.tools import AbstractPairing
-from homekit.protocol.tlv import TLV
+from homekit.protocol.tlv import TLV, TlvParser
 from homekit.model.characteristics import CharacteristicsTypes
 from homekit.protocol import get_session_keys
 from homekit.protocol.opcodes import HapBleOpCodes
 from homekit.protocol.statuscodes import HapBleStatusCodes
 from homekit.model.services.service_types import ServicesTypes
-from homekit.crypto import chacha20_aead_decrypt, chacha20_aead_encrypt
+from homekit.crypto import HapCipher
 from homekit.model.characteristics.characteristic_formats import BleCharacteristicFormats, CharacteristicFormats
 from homekit.model.characteristics.characteristic_units import BleCharacteristicUnits
 from homekit.exceptions import FormatError, RequestRejected, AccessoryDisconnectedError
+from homekit.log_support import DIAGNOSTICS, LazyFormat, lazy_hex
 
 from homekit.tools import BLE_TRANSPORT_SUPPORTED
 
@@ -55,16 +56,19 @@ logger = logging.getLogger(__name__)
 
 class BlePairing(AbstractPairing):
 
-    def __init__(self, pairing_data, adapter='hci0'):
+    def __init__(self, pairing_data, adapter='hci0', accessory_cache=None):
         """
         Initialize a Pairing by using the data either loaded from file or obtained after calling
         Controller.perform_pairing().
 
         :param pairing_data:
+        :param adapter: the bluetooth adapter to be used (defaults to hci0)
+        :param accessory_cache: the AccessoryCache that keeps the accessory database across restarts (optional)
         """
         self.adapter = adapter
         self.pairing_data = pairing_data
         self.session = None
+        self.accessory_cache = accessory_cache
 
     def close(self):
         pass
@@ -72,14 +76,38 @@ class BlePairing(AbstractPairing):
     def list_accessories_and_characteristics(self):
         if 'accessories' in self.pairing_data:
             return self.pairing_data['accessories']
+        accessories = self._get_cached_accessories()
+        if accessories is not None:
+            return accessories
 
         manager = DeviceManager(adapter_name=self.adapter)
         device = manager.make_device(self.pairing_data['AccessoryMAC'])
         device.connect()
         resolved_data = read_characteristics(device)
         self.pairing_data['accessories'] = resolved_data['data']
+        self._cache_accessories(resolved_data['data'])
         return resolved_data['data']
 
+    def set_config_num(self, config_num) -> bool:
+        """
+        See AbstractPairing.set_config_num. If the accessory database is outdated, an open session is closed as well,
+        since it maps the characteristics of the old database onto those of the device.
+
+        :param config_num: the configuration number as reported by discovery
+        :return: True if the known accessory database is outdated
+        """
+        outdated = AbstractPairing.set_config_num(self, config_num)
+        if outdated and self.session:
+            self.session.close()
+            self.session = None
+        return outdated
+
+    def _create_session(self):
+        # the session maps the characteristics of the accessory database onto those of the device, so the database
+        # must be known. It may have been left out of the pairing data, e.g. if it is kept by the accessory cache.
+        self.list_accessories_and_characteristics()
+        return BleSession(self.pairing_data, self.adapter)
+
     def list_pairings(self):
         # TODO implementation still missing
         pass
@@ -99,15 +127,13 @@ class BlePairing(AbstractPairing):
         :return True, if the identification was run, False otherwise
         """
         if not self.session:
-            self.session = BleSession(self.pairing_data, self.adapter)
-        cid = -1
-        aid = -1
-        for a in self.pairing_data['accessories']:
-            for s in a['services']:
-                for c in s['characteristics']:
-                    if CharacteristicsTypes.get_short_uuid(c['type'].upper()) == CharacteristicsTypes.IDENTIFY:
-                        aid = a['aid']
-                        cid = c['iid']
+            self.session = self._create_session()
+        if 'accessories' not in self.pairing_data:
+            self.list_accessories_and_characteristics()
+        aid, cid = -1, -1
+        identify = self.get_accessory_index().find_characteristics(CharacteristicsTypes.IDENTIFY)
+        if identify:
+            aid, cid = identify[-1]
         self.put_characteristics([(aid, cid, True)])
         # TODO check for errors
         return True
@@ -131,7 +157,7 @@ class BlePairing(AbstractPairing):
                  }
         """
         if not self.session:
-            self.session = BleSession(self.pairing_data, self.adapter)
+            self.session = self._create_session()
 
         results = {}
         for aid, cid in characteristics:
@@ -257,7 +283,7 @@ class BlePairing(AbstractPairing):
         characteristic = self._find_characteristic_in_pairing_data(aid, cid)
         if characteristic:
             char_format = characteristic['format']
-        logger.debug('value: %s format: %s', value.hex(), char_format)
+        logger.debug('value: %s format: %s', lazy_hex(value), char_format)
 
         if char_format == CharacteristicFormats.bool:
             value = struct.unpack('?', value)[0]
@@ -281,20 +307,16 @@ class BlePairing(AbstractPairing):
 
     def _find_characteristic_in_pairing_data(self, aid, cid):
         """
-        Iterate over the accessories in the pairing data. If a characteristic with the correct accessory id and
-        characteristic id is found, the characteristic is returned. If no characteristic is found, it returns None.
+        Looks up the characteristic with the given accessory id and characteristic id in the accessory data of the
+        pairing. If no characteristic is found, it returns None.
 
         :param aid: the accessory id
         :param cid: the characteristic id
         :return: the characteristic or None
         """
-        for a in self.pairing_data['accessories']:
-            if a['aid'] == int(aid):
-                for s in a['services']:
-                    for c in s['characteristics']:
-                        if c['iid'] == int(cid):
-                            return c
-        return None
+        if 'accessories' not in self.pairing_data:
+            self.list_accessories_and_characteristics()
+        return self.get_accessory_index().get(int(aid), int(cid))
 
     def put_characteristics(self, characteristics, do_conversion=False):
         """
@@ -309,7 +331,7 @@ class BlePairing(AbstractPairing):
                              requested
         """
         if not self.session:
-            self.session = BleSession(self.pairing_data, self.adapter)
+            self.session = self._create_session()
 
         results = {}
 
@@ -322,8 +344,12 @@ class BlePairing(AbstractPairing):
                 }
                 continue
 
-            value = TLV.encode_list([(1, self._convert_from_python(aid, cid, value))])
-            body = len(value).to_bytes(length=2, byteorder='little') + value
+            # the body is the 2 byte length followed by the TLV, encoded directly behind the length
+            value_tlv = [(TLV.kTLVHAPParamValue, self._convert_from_python(aid, cid, value))]
+            length = TLV.encoded_length(value_tlv)
+            body = bytearray(2 + length)
+            body[0:2] = length.to_bytes(length=2, byteorder='little')
+            TLV.encode_into(value_tlv, body, 2)
 
             try:
                 fc, fc_info = self.session.find_characteristic_by_iid(cid)
@@ -348,10 +374,8 @@ class BleSession(object):
     def __init__(self, pairing_data, adapter):
         self.adapter = adapter
         self.pairing_data = pairing_data
-        self.c2a_counter = 0
-        self.a2c_counter = 0
-        self.c2a_key = None
-        self.a2c_key = None
+        self.c2a_cipher = None
+        self.a2c_cipher = None
         self.device = None
         mac_address = self.pairing_data['AccessoryMAC']
 
@@ -402,11 +426,11 @@ class BleSession(object):
             sys.exit(-1)
 
         write_fun = create_ble_pair_setup_write(pair_verify_char, pair_verify_char_info['iid'])
-        self.c2a_key, self.a2c_key = get_session_keys(None, self.pairing_data, write_fun)
-        logger.debug('keys: \n\t\tc2a: %s\n\t\ta2c: %s', self.c2a_key.hex(), self.a2c_key.hex())
+        c2a_key, a2c_key = get_session_keys(None, self.pairing_data, write_fun)
+        logger.debug('keys: \n\t\tc2a: %s\n\t\ta2c: %s', c2a_key.hex(), a2c_key.hex())
 
-        self.c2a_counter = 0
-        self.a2c_counter = 0
+        self.c2a_cipher = HapCipher(c2a_key)
+        self.a2c_cipher = HapCipher(a2c_key)
 
     def __del__(self):
         self.close()
@@ -430,17 +454,12 @@ class BleSession(object):
 
         logger.debug('data: %s', data)
 
-        cnt_bytes = self.c2a_counter.to_bytes(8, byteorder='little')
-        cipher_and_mac = chacha20_aead_encrypt(bytes(), self.c2a_key, cnt_bytes, bytes([0, 0, 0, 0]), data)
-        cipher_and_mac[0].extend(cipher_and_mac[1])
-        data = cipher_and_mac[0]
-        logger.debug('cipher and mac %s', cipher_and_mac[0].hex())
+        data = self.c2a_cipher.encrypt(data)
+        logger.debug('cipher and mac %s', lazy_hex(data))
 
         result = feature_char.write_value(value=data)
         logger.debug('write resulted in: %s', result)
 
-        self.c2a_counter += 1
-
         data = []
         while not data or len(data) == 0:
             time.sleep(1)
@@ -450,18 +469,17 @@ class BleSession(object):
                 raise AccessoryDisconnectedError('Characteristic read failed')
 
         resp_data = bytearray([b for b in data])
-        logger.debug('read: %s', bytearray(resp_data).hex())
+        logger.debug('read: %s', lazy_hex(resp_data))
 
-        data = chacha20_aead_decrypt(bytes(), self.a2c_key, self.a2c_counter.to_bytes(8, byteorder='little'),
-                                     bytes([0, 0, 0, 0]), resp_data)
+        data = self.a2c_cipher.decrypt(resp_data)
 
-        logger.debug('decrypted: %s', bytearray(data).hex())
+        logger.debug('decrypted: %s', lazy_hex(data))
 
         if not data:
             return {}
 
         # parse header and check stuff
-        logger.debug('parse sig read response %s', bytes([int(a) for a in data]).hex())
+        logger.debug('parse sig read response %s', lazy_hex(data))
 
         # handle the header data
         cf = data[0]
@@ -476,15 +494,13 @@ class BleSession(object):
         if status != HapBleStatusCodes.SUCCESS:
             raise RequestRejected(status, HapBleStatusCodes[status])
 
-        self.a2c_counter += 1
-
         # get body length
         length = int.from_bytes(data[3:5], byteorder='little')
         logger.debug('expected body length %d (got %d)', length, len(data[5:]))
 
         # parse tlvs and analyse information
         tlv = TLV.decode_bytes(data[5:])
-        logger.debug('received TLV: %s', TLV.to_string(tlv))
+        logger.debug('received TLV: %s', LazyFormat(TLV.to_string, tlv))
         return dict(tlv)
 
 
@@ -533,7 +549,8 @@ def find_characteristic_by_uuid(device, service_uuid, char_uuid):
 def create_ble_pair_setup_write(characteristic, characteristic_id):
     def write(request, expected):
         # TODO document me
-        logger.debug('entering write function %s', TLV.to_string(TLV.decode_bytes(request)))
+        if DIAGNOSTICS and logger.isEnabledFor(logging.DEBUG):
+            logger.debug('entering write function %s', TLV.to_string(TLV.decode_bytes(request)))
         request_tlv = TLV.encode_list([
             (TLV.kTLVHAPParamParamReturnResponse, bytearray(b'\x01')),
             (TLV.kTLVHAPParamValue, request)
@@ -543,32 +560,35 @@ def create_ble_pair_setup_write(characteristic, characteristic_id):
         data.extend(characteristic_id.to_bytes(length=2, byteorder='little'))
         data.extend(len(request_tlv).to_bytes(length=2, byteorder='little'))
         data.extend(request_tlv)
-        logger.debug('sent %s', bytes(data).hex())
+        logger.debug('sent %s', lazy_hex(data))
         characteristic.write_value(value=data)
         data = []
         while len(data) == 0:
             time.sleep(1)
             logger.debug('reading characteristic')
             data = characteristic.read_value()
-        resp_data = [b for b in data]
+        resp_data = bytes([int(a) for a in data])
 
-        expected_length = int.from_bytes(bytes(resp_data[3:5]), byteorder='little')
+        expected_length = int.from_bytes(resp_data[3:5], byteorder='little')
         logger.debug(
             'control field: {c:x}, tid: {t:x}, status: {s:x}, length: {length}'.format(c=resp_data[0], t=resp_data[1],
                                                                                        s=resp_data[2],
                                                                                        length=expected_length))
-        while len(resp_data[3:]) < expected_length:
+        # the body contains the response TLV as value parameter, it is parsed while the remaining data is read
+        parser = TlvParser(expected=[TLV.kTLVHAPParamValue], stream_keys=[TLV.kTLVHAPParamValue],
+                           inner=TlvParser(expected, ()))
+        received = len(resp_data) - 5
+        logger.debug('received %s', lazy_hex(resp_data))
+        result = parser.feed(resp_data[5:])
+        while received < expected_length:
             time.sleep(1)
             logger.debug('reading characteristic')
-            data = characteristic.read_value()
-            resp_data.extend([b for b in data])
-            logger.debug('data %s of %s', len(resp_data[3:]), expected_length)
-
-        logger.debug('received %s', bytes(resp_data).hex())
-        logger.debug('decode %s', bytes(resp_data[5:]).hex())
-        resp_tlv = TLV.decode_bytes(bytes([int(a) for a in resp_data[5:]]), expected=[TLV.kTLVHAPParamValue])
-        result = TLV.decode_bytes(resp_tlv[0][1], expected)
-        logger.debug('leaving write function %s', TLV.to_string(result))
+            data = bytes([int(a) for a in characteristic.read_value()])
+            received += len(data)
+            logger.debug('received %s, data %s of %s', lazy_hex(data), received, expected_length)
+            result.extend(parser.feed(data))
+        result.extend(parser.close())
+        logger.debug('leaving write function %s', LazyFormat(TLV.to_string, result))
         return result
 
     return write
@@ -667,7 +687,7 @@ def read_characteristics(device):
 def parse_sig_read_response(data, expected_tid):
     # TODO document me
     # parse header and check stuff
-    logger.debug('parse sig read response %s', bytes([int(a) for a in data]).hex())
+    logger.debug('parse sig read response %s', lazy_hex(data))
 
     # handle the header data
     cf = data[0]
@@ -716,7 +736,7 @@ def parse_sig_read_response(data, expected_tid):
             characteristic_format = BleCharacteristicFormats.get(int(t[1][0]), 'unknown')
             unit = BleCharacteristicUnits.get(int.from_bytes(unit_bytes, byteorder='big'), 'unknown')
         if t[0] == TLV.kTLVHAPParamGATTValidRange:
-            logger.debug('range: %s', t[1].hex())
+            logger.debug('range: %s', lazy_hex(t[1]))
             lower = None
             upper = None
             if characteristic_format == 'int32' or characteristic_format == 'int':
@@ -16,6 +16,7 @@
 
 import logging
 
+from homekit.log_support import lazy_hex
 from homekit.model import Categories
 from homekit.model.status_flags import BleStatusFlags
 
@@ -31,7 +32,7 @@ def parse_manufacturer_specific(input_data):
              identifier (key 'acid'), human readable version of the category (key 'category'), the global state number
              (key 'gsn'), the configuration number (key 'cn') and the compatible version (key 'cv')
     """
-    logging.debug('manufacturer specific data: %s', input_data.hex())
+    logging.debug('manufacturer specific data: %s', lazy_hex(input_data))
 
     # the type must be 0x06 as defined on page 124 table 6-29
     ty = input_data[0]
@@ -65,7 +66,7 @@ def parse_manufacturer_specific(input_data):
         cv = input_data[0]
         input_data = input_data[1:]
         if len(input_data) > 0:
-            logging.debug('remaining data: %s', input_data.hex())
+            logging.debug('remaining data: %s', lazy_hex(input_data))
         return {'manufacturer': 'apple', 'type': ty, 'sf': sf, 'flags': flags, 'device_id': device_id, 'acid': acid,
                 'gsn': gsn, 'cn': cn, 'cv': cv, 'category': Categories[int(acid)]}
 
@@ -18,18 +18,21 @@ import json
 from json.decoder import JSONDecodeError
 import logging
 import random
+import time
 import uuid
 import re
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-from homekit.exceptions import AccessoryNotFoundError, ConfigLoadingError, UnknownError, \
+from homekit.exceptions import AccessoryNotFoundError, AccessoryTimeoutError, ConfigLoadingError, UnknownError, \
     AuthenticationError, ConfigSavingError, AlreadyPairedError, TransportNotSupportedError, MalformedPinError
-from homekit.protocol.tlv import TLV
-from homekit.http_impl import HomeKitHTTPConnection
+from homekit.protocol.tlv import TLV, TlvMessage
+from homekit.http_impl import HomeKitHTTPConnection, HttpContentTypes
 from homekit.protocol.statuscodes import HapStatusCodes
 from homekit.protocol import perform_pair_setup_part1, perform_pair_setup_part2, create_ip_pair_setup_write
 from homekit.model.services.service_types import ServicesTypes
 from homekit.model.characteristics.characteristic_types import CharacteristicsTypes
 from homekit.protocol.opcodes import HapBleOpCodes
+from homekit.protocol.session_cache import SessionCache
 from homekit.tools import IP_TRANSPORT_SUPPORTED, BLE_TRANSPORT_SUPPORTED
 
 if BLE_TRANSPORT_SUPPORTED:
@@ -39,7 +42,7 @@ if BLE_TRANSPORT_SUPPORTED:
 
 if IP_TRANSPORT_SUPPORTED:
     from homekit.zeroconf_impl import discover_homekit_devices, find_device_ip_and_port
-    from homekit.controller.ip_implementation import IpPairing, IpSession
+    from homekit.controller.ip_implementation import IpPairing, SessionPool
 
 
 class Controller(object):
@@ -47,14 +50,25 @@ class Controller(object):
     This class represents a HomeKit controller (normally your iPhone or iPad).
     """
 
-    def __init__(self, ble_adapter='hci0'):
+    def __init__(self, ble_adapter='hci0', sessions_per_pairing=1, keepalive_interval=60, accessory_cache=None):
         """
         Initialize an empty controller. Use 'load_data()' to load the pairing data.
 
         :param ble_adapter: the bluetooth adapter to be used (defaults to hci0)
+        :param sessions_per_pairing: the number of sessions kept open with each IP accessory (defaults to 1)
+        :param keepalive_interval: the number of seconds after which idle sessions with IP accessories are probed,
+                                   None disables the probes (defaults to 60)
+        :param accessory_cache: an AccessoryCache that keeps the accessory databases of the pairings across restarts.
+                                If it is set, save_data does not write the accessory databases to the pairing file.
+                                Use update_config_numbers to notice changed databases.
         """
         self.pairings = {}
         self.ble_adapter = ble_adapter
+        # pair verify results of IP accessories, so reconnects can use pair resume
+        self.session_cache = SessionCache()
+        self.sessions_per_pairing = sessions_per_pairing
+        self.keepalive_interval = keepalive_interval
+        self.accessory_cache = accessory_cache
         self.logger = logging.getLogger('homekit.controller.Controller')
 
     @staticmethod
@@ -227,6 +241,11 @@ class Controller(object):
 
         return True
 
+    def _create_ip_pairing(self, pairing_data):
+        session_pool = SessionPool(pairing_data, self.session_cache, self.sessions_per_pairing,
+                                   self.keepalive_interval)
+        return IpPairing(pairing_data, self.session_cache, session_pool, self.accessory_cache)
+
     def shutdown(self):
         """
         Shuts down the controller by closing all connections that might be held open by the pairings of the controller.
@@ -242,6 +261,110 @@ class Controller(object):
         """
         return self.pairings
 
+    def update_config_numbers(self, devices):
+        """
+        Hands the configuration numbers from a discovery to the pairings. Pairings whose accessory database changed
+        since it was read drop it, so it is read again from the accessory on next use:
+
+            controller.update_config_numbers(Controller.discover(5))
+
+        :param devices: the result of discover (the c# is used) or discover_ble (the cn is used)
+        :return: the list of the aliases of the pairings whose accessory database is outdated
+        """
+        config_nums = {}
+        for device in devices:
+            device_id = device.get('id', device.get('device_id'))
+            config_num = device.get('c#', device.get('cn'))
+            if device_id is not None and config_num is not None:
+                config_nums[device_id] = config_num
+        outdated = []
+        for alias, pairing in self.pairings.items():
+            pairing_id = pairing._get_pairing_data().get('AccessoryPairingID')
+            if pairing_id in config_nums and pairing.set_config_num(config_nums[pairing_id]):
+                outdated.append(alias)
+        return outdated
+
+    def get_characteristics(self, characteristics, timeout=10, max_workers=8, **kwargs):
+        """
+        Reads characteristics of several accessories at once. The accessories are queried concurrently, so this takes
+        about as long as the slowest accessory instead of the sum of all of them.
+
+        :param characteristics: a dict mapping the aliases of pairings to lists of 2-tupels of aid and iid
+        :param timeout: the number of seconds each accessory has to answer, counted from the start of its request
+        :param max_workers: how many accessories are queried at the same time
+        :param kwargs: passed on to the get_characteristics of each pairing (e.g. include_meta)
+        :return: a tuple of two dicts. The first maps the aliases to the results of the pairings' get_characteristics,
+                 the second maps the aliases of the accessories that failed to the exceptions. Unknown aliases fail
+                 with AccessoryNotFoundError, accessories that did not answer in time with AccessoryTimeoutError.
+        """
+        return self._fan_out(lambda pairing, c: pairing.get_characteristics(c, **kwargs), characteristics, timeout,
+                             max_workers)
+
+    def put_characteristics(self, characteristics, timeout=10, max_workers=8, do_conversion=False):
+        """
+        Writes characteristics of several accessories at once. See get_characteristics for the handling of timeouts
+        and errors.
+
+        :param characteristics: a dict mapping the aliases of pairings to lists of 3-tupels of aid, iid and the value
+        :param timeout: the number of seconds each accessory has to answer, counted from the start of its request
+        :param max_workers: how many accessories are written to at the same time
+        :param do_conversion: passed on to the put_characteristics of each pairing
+        :return: a tuple of two dicts. The first maps the aliases to the results of the pairings' put_characteristics,
+                 the second maps the aliases of the accessories that failed to the exceptions.
+        """
+        return self._fan_out(lambda pairing, c: pairing.put_characteristics(c, do_conversion), characteristics,
+                             timeout, max_workers)
+
+    def _fan_out(self, function, requests, timeout, max_workers):
+        results = {}
+        errors = {}
+        started = {}
+
+        def run(alias, pairing, arguments):
+            started[alias] = time.monotonic()
+            return function(pairing, arguments)
+
+        futures = {}
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(requests))))
+        try:
+            for alias, arguments in requests.items():
+                if alias not in self.pairings:
+                    errors[alias] = AccessoryNotFoundError('Unknown alias "{a}"'.format(a=alias))
+                    continue
+                futures[executor.submit(run, alias, self.pairings[alias], arguments)] = alias
+
+            pending = set(futures)
+            while pending:
+                # the timeout of each accessory starts when a worker picks up its request
+                now = time.monotonic()
+                deadline = None
+                for future in list(pending):
+                    alias = futures[future]
+                    if alias not in started or future.done():
+                        continue
+                    if now - started[alias] >= timeout:
+                        pending.remove(future)
+                        errors[alias] = AccessoryTimeoutError(
+                            'No answer from "{a}" within {t} seconds'.format(a=alias, t=timeout))
+                    elif deadline is None or started[alias] + timeout < deadline:
+                        deadline = started[alias] + timeout
+                wait_time = None if deadline is None else deadline - now
+                if len(started) < len(futures):
+                    # requests still waiting for a worker may start at any time, e.g. when a request that timed
+                    # out returns, so check for them regularly
+                    wait_time = 0.1 if wait_time is None else min(wait_time, 0.1)
+                done, _ = wait(pending, wait_time, FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    try:
+                        results[futures[future]] = future.result()
+                    except Exception as e:
+                        errors[futures[future]] = e
+        finally:
+            # requests that timed out are not waited for
+            executor.shutdown(wait=False)
+        return results, errors
+
     def load_data(self, filename):
         """
         Loads the pairing data of the controller from a file.
@@ -265,11 +388,12 @@ class Controller(object):
                     if data[pairing_id]['Connection'] == 'IP':
                         if not IP_TRANSPORT_SUPPORTED:
                             raise TransportNotSupportedError('IP')
-                        self.pairings[pairing_id] = IpPairing(data[pairing_id])
+                        self.pairings[pairing_id] = self._create_ip_pairing(data[pairing_id])
                     elif data[pairing_id]['Connection'] == 'BLE':
                         if not BLE_TRANSPORT_SUPPORTED:
                             raise TransportNotSupportedError('BLE')
-                        self.pairings[pairing_id] = BlePairing(data[pairing_id], self.ble_adapter)
+                        self.pairings[pairing_id] = BlePairing(data[pairing_id], self.ble_adapter,
+                                                               self.accessory_cache)
                     else:
                         # ignore anything else, issue warning
                         self.logger.warning('could not load pairing %s of type "%s"', pairing_id,
@@ -292,6 +416,9 @@ class Controller(object):
         for pairing_id in self.pairings:
             # package visibility like in java would be nice here
             data[pairing_id] = self.pairings[pairing_id]._get_pairing_data()
+            if self.accessory_cache is not None:
+                # the accessory databases are kept by the cache
+                data[pairing_id] = {k: v for k, v in data[pairing_id].items() if k != 'accessories'}
         try:
             with open(filename, 'w') as output_fp:
                 json.dump(data, output_fp, indent='  ')
@@ -390,7 +517,7 @@ class Controller(object):
             pairing['AccessoryIP'] = connection_data['ip']
             pairing['AccessoryPort'] = connection_data['port']
             pairing['Connection'] = 'IP'
-            self.pairings[alias] = IpPairing(pairing)
+            self.pairings[alias] = self._create_ip_pairing(pairing)
 
         return finish_pairing
 
@@ -461,7 +588,7 @@ class Controller(object):
             pairing['AccessoryMAC'] = accessory_mac
             pairing['Connection'] = 'BLE'
 
-            self.pairings[alias] = BlePairing(pairing, adapter)
+            self.pairings[alias] = BlePairing(pairing, adapter, self.accessory_cache)
 
         return finish_pairing
 
@@ -483,21 +610,17 @@ class Controller(object):
         connection_type = pairing_data['Connection']
 
         # Prepare the common (for IP and BLE) request data
-        request_tlv = TLV.encode_list([
-            (TLV.kTLVType_State, TLV.M1),
-            (TLV.kTLVType_Method, TLV.RemovePairing),
-            (TLV.kTLVType_Identifier, pairing_data['iOSPairingId'].encode())
-        ])
+        request_tlv = Controller._create_remove_pairing_request(pairing_data)
 
         if connection_type == 'IP':
             if not IP_TRANSPORT_SUPPORTED:
                 raise TransportNotSupportedError('IP')
-            session = IpSession(pairing_data)
-            # decode is required because post needs a string representation
-            response = session.post('/pairings', request_tlv.decode())
-            session.close()
+            pairing = self.pairings[alias]
+            if not pairing.session:
+                pairing.session = SessionPool(pairing_data, self.session_cache)
+            response = pairing.session.post('/pairings', request_tlv, HttpContentTypes.TLV)
             data = response.read()
-            data = TLV.decode_bytes(data)
+            data = TlvMessage(data)
         elif connection_type == 'BLE':
             if not BLE_TRANSPORT_SUPPORTED:
                 raise TransportNotSupportedError('BLE')
@@ -520,17 +643,34 @@ class Controller(object):
 
             session = BleSession(pairing_data, self.ble_adapter)
             response = session.request(pair_remove_char, pair_remove_char_id, HapBleOpCodes.CHAR_WRITE, body)
-            data = TLV.decode_bytes(response[1])
+            data = TlvMessage(response[1])
         else:
             raise Exception('not implemented (neither IP nor BLE)')
 
+        self._handle_remove_pairing_response(alias, data)
+
+    @staticmethod
+    def _create_remove_pairing_request(pairing_data):
+        return TLV.encode_list([
+            (TLV.kTLVType_State, TLV.M1),
+            (TLV.kTLVType_Method, TLV.RemovePairing),
+            (TLV.kTLVType_Identifier, pairing_data['iOSPairingId'].encode())
+        ])
+
+    def _handle_remove_pairing_response(self, alias, data):
         # act upon the response (the same is returned for IP and BLE accessories)
         # handle the result, spec says, if it has only one entry with state == M2 we unpaired, else its an error.
-        logging.debug('response data: %s', data)
-        if len(data) == 1 and data[0][0] == TLV.kTLVType_State and data[0][1] == TLV.M2:
+        logging.debug('response data: %s', data.to_list())
+        if len(data) == 1 and data.get(TLV.kTLVType_State) == TLV.M2:
+            pairing_data = self.pairings[alias]._get_pairing_data()
+            self.pairings[alias].close()
             del self.pairings[alias]
+            if 'AccessoryPairingID' in pairing_data:
+                self.session_cache.remove_pairing(pairing_data['AccessoryPairingID'])
+                if self.accessory_cache is not None:
+                    self.accessory_cache.remove(pairing_data['AccessoryPairingID'])
         else:
-            if data[1][0] == TLV.kTLVType_Error and data[1][1] == TLV.kTLVError_Authentication:
+            if data.get(TLV.kTLVType_Error) == TLV.kTLVError_Authentication:
                 raise AuthenticationError('Remove pairing failed: missing authentication')
             else:
                 raise UnknownError('Remove pairing failed: unknown error')
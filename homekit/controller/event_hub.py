@@ -0,0 +1,360 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Receives the events of many IP accessories with a single thread. The sockets of all sessions are watched with one
+selector (epoll, kqueue or select, whatever the platform offers best) instead of one blocking reader per accessory.
+"""
+
+import heapq
+import json
+from json.decoder import JSONDecodeError
+import logging
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from homekit.controller.ip_implementation import IpPairing, IpSession, events_body, parse_event, parse_status
+from homekit.exceptions import AccessoryDisconnectedError, AccessoryNotFoundError, AccessoryTimeoutError, \
+    EncryptionError, TransportNotSupportedError
+
+logger = logging.getLogger('homekit.controller.event_hub')
+
+
+class EventHub(object):
+    """
+    Registers for events of characteristics on many IP pairings and dispatches the events to handlers:
+
+        def changed(alias, aid, iid, value):
+            ...
+
+        hub = EventHub(controller.get_pairings())
+        hub.add_handler(changed)
+        hub.start()
+        hub.subscribe('alias', [(1, 10), (1, 11)])
+
+    Each pairing gets a session of its own that is only used for the events. Connecting and registering for events
+    runs on a few worker threads, reading and decrypting the events as they arrive and calling the handlers is done by
+    the hub's thread. If a connection breaks, it is reconnected with growing delays and the events of all subscribed
+    characteristics are registered again.
+    """
+
+    def __init__(self, pairings, error_callback=None, max_workers=4, min_retry_delay=1, max_retry_delay=60,
+                 session_factory=None):
+        """
+        :param pairings: a dict mapping aliases to IpPairings, e.g. the result of Controller.get_pairings()
+        :param error_callback: called with the alias and the exception if connecting to an accessory or registering
+                               for events failed or if a connection broke (optional)
+        :param max_workers: how many accessories are connected to at the same time
+        :param min_retry_delay: the number of seconds to wait before the first reconnect
+        :param max_retry_delay: the maximum number of seconds between two reconnects, the delay doubles up to this on
+                                each failed attempt
+        :param session_factory: creates a session from pairing data and session cache, defaults to IpSession
+        """
+        self.pairings = pairings
+        self.error_callback = error_callback
+        self.max_workers = max_workers
+        self.min_retry_delay = min_retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.session_factory = session_factory if session_factory is not None else IpSession
+        self._handlers = []
+        # the following is protected by the lock
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+        self._sessions = {}
+        self._connecting = set()
+        self._retry_delays = {}
+        self._commands = deque()
+        self._stopped = True
+        # the following is only used by the hub's thread
+        self._selector = None
+        self._timers = []
+        self._wakeup = None
+        self._thread = None
+        self._executor = None
+
+    def add_handler(self, handler):
+        """
+        Registers a function that is called with alias, aid, iid and the value for each event. It is called from the
+        hub's thread and should return quickly.
+
+        :param handler: the function
+        """
+        self._handlers.append(handler)
+
+    def remove_handler(self, handler):
+        """
+        :param handler: a function registered with add_handler
+        """
+        self._handlers.remove(handler)
+
+    def subscribe(self, alias, characteristics):
+        """
+        Registers for events of characteristics. This returns at once, the accessory is connected to in the
+        background. Characteristics whose events the accessory rejects are logged and dropped.
+
+        :param alias: the alias of the pairing
+        :param characteristics: a list of 2-tupels of aid and iid
+        :raises AccessoryNotFoundError: if the alias is unknown
+        :raises TransportNotSupportedError: if the pairing is no IP pairing
+        """
+        if alias not in self.pairings:
+            raise AccessoryNotFoundError('Unknown alias "{a}"'.format(a=alias))
+        if not isinstance(self.pairings[alias], IpPairing):
+            raise TransportNotSupportedError('BLE')
+        with self._lock:
+            subscribed = self._subscriptions.setdefault(alias, set())
+            added = [tuple(c) for c in characteristics if tuple(c) not in subscribed]
+            subscribed.update(added)
+            session = self._sessions.get(alias)
+            if self._stopped or not added:
+                return
+            if session is None:
+                self._connect_soon(alias)
+            else:
+                self._executor.submit(self._register, alias, session, added)
+
+    def unsubscribe(self, alias, characteristics=None):
+        """
+        Unregisters from events of characteristics. The session with the accessory is closed once no characteristic
+        is left.
+
+        :param alias: the alias of the pairing
+        :param characteristics: a list of 2-tupels of aid and iid, None for all characteristics of the pairing
+        """
+        with self._lock:
+            subscribed = self._subscriptions.get(alias, set())
+            if characteristics is None:
+                removed = set(subscribed)
+            else:
+                removed = subscribed & {tuple(c) for c in characteristics}
+            subscribed -= removed
+            if not subscribed:
+                self._subscriptions.pop(alias, None)
+            session = self._sessions.get(alias)
+            if session is None or not removed or self._stopped:
+                return
+            if not subscribed:
+                self._call_soon(self._close_session, alias, session)
+            else:
+                self._executor.submit(self._register, alias, session, sorted(removed), False)
+
+    def get_subscriptions(self):
+        """
+        :return: a dict mapping aliases to sets of 2-tupels of aid and iid
+        """
+        with self._lock:
+            return {alias: set(subscribed) for alias, subscribed in self._subscriptions.items()}
+
+    def start(self):
+        """
+        Starts the hub's thread and connects to all accessories with subscriptions.
+        """
+        with self._lock:
+            if not self._stopped:
+                return
+            self._stopped = False
+            self._selector = selectors.DefaultSelector()
+            self._wakeup = socket.socketpair()
+            self._wakeup[0].setblocking(False)
+            self._wakeup[1].setblocking(False)
+            self._selector.register(self._wakeup[0], selectors.EVENT_READ)
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            self._commands.clear()
+            self._timers = []
+            for alias in self._subscriptions:
+                self._connect_soon(alias)
+            self._thread = threading.Thread(target=self._run, name='EventHub', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops the hub's thread and closes all sessions. The subscriptions are kept for the next start.
+        """
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._wake_up()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+        for sock in self._wakeup:
+            sock.close()
+        self._selector.close()
+
+    def _wake_up(self):
+        try:
+            self._wakeup[1].send(b'\x00')
+        except (BlockingIOError, InterruptedError):
+            # the thread is woken up already
+            pass
+
+    def _call_soon(self, function, *args):
+        # must be called with the lock held, the function is run by the hub's thread
+        self._commands.append((function, args))
+        self._wake_up()
+
+    def _connect_soon(self, alias):
+        # must be called with the lock held
+        if self._stopped or alias in self._connecting or alias in self._sessions or not self._subscriptions.get(alias):
+            return
+        self._connecting.add(alias)
+        self._executor.submit(self._connect, alias)
+
+    def _connect(self, alias):
+        # runs on a worker thread
+        try:
+            pairing = self.pairings[alias]
+            session = self.session_factory(pairing._get_pairing_data(), pairing.session_cache)
+        except Exception as e:
+            with self._lock:
+                self._connecting.discard(alias)
+                if not self._stopped:
+                    self._call_soon(self._retry, alias)
+            self._report(alias, e)
+            return
+        session.sec_http.external_reader = True
+        session.sec_http.add_event_listener(lambda response: self._dispatch(alias, response))
+        with self._lock:
+            self._connecting.discard(alias)
+            subscribed = sorted(self._subscriptions.get(alias, ()))
+            if self._stopped or not subscribed:
+                session.close()
+                return
+            self._sessions[alias] = session
+            # the socket must be watched before the request is sent, otherwise the response is not read
+            self._call_soon(self._add_session, alias, session)
+        self._register(alias, session, subscribed)
+
+    def _register(self, alias, session, characteristics, enable=True):
+        # runs on a worker thread
+        try:
+            response = session.sec_http.put('/characteristics', events_body(characteristics, enable))
+            if response.code is None:
+                raise AccessoryTimeoutError('No response to registering for events')
+            if response.code != 204:
+                errors = parse_status(json.loads(response.read().decode())['characteristics'], include_success=False)
+                if errors and enable:
+                    logger.warning('events of %s rejected by %s: %s', sorted(errors), alias, errors)
+                    with self._lock:
+                        self._subscriptions.get(alias, set()).difference_update(errors)
+        except (AccessoryDisconnectedError, AccessoryTimeoutError, EncryptionError, JSONDecodeError, KeyError) as e:
+            with self._lock:
+                if not self._stopped:
+                    self._call_soon(self._lost, alias, session)
+            self._report(alias, e)
+            return
+        with self._lock:
+            if enable:
+                self._retry_delays.pop(alias, None)
+
+    def _report(self, alias, error):
+        logger.debug('events of %s failed: %s', alias, error)
+        if self.error_callback:
+            try:
+                self.error_callback(alias, error)
+            except Exception:
+                logger.exception('error callback failed')
+
+    def _dispatch(self, alias, response):
+        # runs on the hub's thread
+        body = response.read().decode()
+        if not body:
+            return
+        try:
+            events = parse_event(body)
+        except (JSONDecodeError, KeyError, TypeError):
+            logger.debug('dropping malformed event from %s: %s', alias, body)
+            return
+        for aid, iid, value in events:
+            for handler in list(self._handlers):
+                try:
+                    handler(alias, aid, iid, value)
+                except Exception:
+                    logger.exception('event handler failed')
+
+    def _add_session(self, alias, session):
+        if self._sessions.get(alias) is not session:
+            session.close()
+            return
+        try:
+            # otherwise an accessory that vanished without closing the connection is not noticed
+            session.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        except OSError:
+            pass
+        self._selector.register(session.sock, selectors.EVENT_READ, (alias, session))
+
+    def _close_session(self, alias, session):
+        # returns False if the session was closed before
+        with self._lock:
+            current = self._sessions.get(alias) is session
+            if current:
+                del self._sessions[alias]
+        try:
+            # the socket of the SecureHttp is kept even if the session was closed
+            self._selector.unregister(session.sec_http.sock)
+        except (KeyError, ValueError):
+            if not current:
+                return False
+        session.close()
+        return True
+
+    def _lost(self, alias, session):
+        if self._close_session(alias, session):
+            self._retry(alias)
+
+    def _retry(self, alias):
+        with self._lock:
+            delay = self._retry_delays.get(alias, self.min_retry_delay)
+            self._retry_delays[alias] = min(2 * delay, self.max_retry_delay)
+        heapq.heappush(self._timers, (time.monotonic() + delay, alias))
+
+    def _run(self):
+        while True:
+            timeout = None
+            if self._timers:
+                timeout = max(0, self._timers[0][0] - time.monotonic())
+            for key, _ in self._selector.select(timeout):
+                if key.data is None:
+                    try:
+                        self._wakeup[0].recv(4096)
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                    continue
+                alias, session = key.data
+                try:
+                    session.sec_http.read_available()
+                except (AccessoryDisconnectedError, EncryptionError) as e:
+                    self._lost(alias, session)
+                    self._report(alias, e)
+            with self._lock:
+                if self._stopped:
+                    sessions = list(self._sessions.items())
+                    break
+                commands = list(self._commands)
+                self._commands.clear()
+            for function, args in commands:
+                function(*args)
+            now = time.monotonic()
+            while self._timers and self._timers[0][0] <= now:
+                _, alias = heapq.heappop(self._timers)
+                with self._lock:
+                    self._connect_soon(alias)
+        for alias, session in sessions:
+            self._close_session(alias, session)
@@ -18,7 +18,9 @@ import json
 from json.decoder import JSONDecodeError
 import time
 import logging
+import threading
 
+from homekit.controller.accessory_index import AccessoryIndex
 from homekit.controller.tools import AbstractPairing, check_convert_value
 from homekit.protocol.statuscodes import HapStatusCodes
 from homekit.exceptions import AccessoryNotFoundError, UnknownError, UnpairedError, \
@@ -26,26 +28,180 @@ from homekit.exceptions import AccessoryNotFoundError, UnknownError, UnpairedErr
 from homekit.http_impl import HomeKitHTTPConnection, HttpContentTypes
 from homekit.http_impl.secure_http import SecureHttp
 from homekit.protocol import get_session_keys, create_ip_pair_verify_write
-from homekit.protocol.tlv import TLV
+from homekit.protocol.tlv import TLV, TlvMessage
 from homekit.model.characteristics import CharacteristicsTypes
 from homekit.zeroconf_impl import find_device_ip_and_port
 from homekit.model.services import ServicesTypes
 
 
+def normalize_accessories(accessories):
+    """
+    Converts the types of the services and characteristics in the result of GET /accessories to the upper case long
+    form of the UUIDs.
+
+    :param accessories: the list of accessories as sent by the accessory, it is modified
+    :return: the list of accessories
+    """
+    for accessory in accessories:
+        for service in accessory['services']:
+            service['type'] = service['type'].upper()
+            try:
+                service['type'] = ServicesTypes.get_uuid(service['type'])
+            except KeyError:
+                pass
+
+            for characteristic in service['characteristics']:
+                characteristic['type'] = characteristic['type'].upper()
+                try:
+                    characteristic['type'] = CharacteristicsTypes.get_uuid(characteristic['type'])
+                except KeyError:
+                    pass
+    return accessories
+
+
+def characteristics_url(characteristics, include_meta=False, include_perms=False, include_type=False,
+                        include_events=False):
+    """
+    Creates the url to read characteristics (see page 84). Only parameters that are True are added, some accessories
+    reject requests with parameters like ev=0.
+
+    :param characteristics: a list of 2-tupels of accessory id and instance id
+    :return: the url
+    """
+    url = '/characteristics?id=' + ','.join([str(x[0]) + '.' + str(x[1]) for x in characteristics])
+    if include_meta:
+        url += '&meta=1'
+    if include_perms:
+        url += '&perms=1'
+    if include_type:
+        url += '&type=1'
+    if include_events:
+        url += '&ev=1'
+    return url
+
+
+def parse_characteristics(data):
+    """
+    :param data: the list of characteristics of the response to reading characteristics
+    :return: a dict mapping 2-tupels of aid and iid to dicts with value or status and description
+    """
+    tmp = {}
+    for c in data:
+        key = (c['aid'], c['iid'])
+        del c['aid']
+        del c['iid']
+
+        if 'status' in c and c['status'] == 0:
+            del c['status']
+        if 'status' in c and c['status'] != 0:
+            c['description'] = HapStatusCodes[c['status']]
+        tmp[key] = c
+    return tmp
+
+
+def characteristics_write_body(characteristics, index, do_conversion=False):
+    """
+    Creates the body to write characteristics.
+
+    :param characteristics: a list of 3-tupels of accessory id, instance id and the value
+    :param index: the AccessoryIndex of the accessory data, used to look up the format if do_conversion is True
+    :param do_conversion: select if the values are converted to the format of the characteristic
+    :return: the body as string
+    :raises FormatError: if a value could not be converted
+    """
+    data = []
+    for aid, iid, value in characteristics:
+        if do_conversion:
+            value = check_convert_value(value, index.get_format(aid, iid))
+        data.append({'aid': aid, 'iid': iid, 'value': value})
+    return json.dumps({'characteristics': data})
+
+
+def events_body(characteristics, enable=True):
+    """
+    Creates the body to register (or unregister) for events of characteristics.
+
+    :param characteristics: a list of 2-tupels of accessory id and instance id
+    :param enable: True to register, False to unregister
+    :return: the body as string
+    """
+    return json.dumps({'characteristics': [{'aid': c[0], 'iid': c[1], 'ev': enable} for c in characteristics]})
+
+
+def parse_status(data, include_success=True):
+    """
+    :param data: the list of characteristics of a multi status response
+    :param include_success: False to leave out the characteristics with status 0
+    :return: a dict from (aid, iid) onto {status, description}
+    """
+    return {(d['aid'], d['iid']): {'status': d['status'], 'description': HapStatusCodes[d['status']]} for d in data
+            if include_success or d['status'] != 0}
+
+
+def parse_event(body):
+    """
+    :param body: the body of an EVENT message as string
+    :return: list of 3-tupels of aid, iid and the value
+    :raises JSONDecodeError: if the body is not valid JSON
+    """
+    return [(c['aid'], c['iid'], c['value']) for c in json.loads(body)['characteristics']]
+
+
+def parse_pairings(data):
+    """
+    Parses the response to a list pairings request (see IpPairing.list_pairings for the keys of the dicts).
+
+    :param data: the body of the response as bytes-like object
+    :return: a list of dicts
+    :raises: UnknownError: if it receives unexpected data
+    :raises: UnpairedError: if the polled accessory is not paired
+    """
+    data = TlvMessage(data)
+
+    if data.get(TLV.kTLVType_State) != TLV.M2:
+        raise UnknownError('unexpected data received: ' + str(data.to_list()))
+    elif data.get(TLV.kTLVType_Error) == TLV.kTLVError_Authentication:
+        raise UnpairedError('Must be paired')
+    else:
+        tmp = []
+        # the pairings are divided by separators, but each identifier starts a new pairing in any case
+        for entry in data.split(start=TLV.kTLVType_Identifier):
+            if TLV.kTLVType_Identifier not in entry:
+                continue
+            r = {'pairingId': entry[TLV.kTLVType_Identifier].decode()}
+            if TLV.kTLVType_PublicKey in entry:
+                r['publicKey'] = entry[TLV.kTLVType_PublicKey].hex()
+            if TLV.kTLVType_Permissions in entry:
+                permissions = entry[TLV.kTLVType_Permissions]
+                controller_type = 'regular'
+                if permissions == b'\x01':
+                    controller_type = 'admin'
+                r['permissions'] = int.from_bytes(permissions, byteorder='little')
+                r['controllerType'] = controller_type
+            tmp.append(r)
+        return tmp
+
+
 class IpPairing(AbstractPairing):
     """
     This represents a paired HomeKit IP accessory.
     """
 
-    def __init__(self, pairing_data):
+    def __init__(self, pairing_data, session_cache=None, session_pool=None, accessory_cache=None):
         """
         Initialize a Pairing by using the data either loaded from file or obtained after calling
         Controller.perform_pairing().
 
         :param pairing_data:
+        :param session_cache: the SessionCache used to resume sessions on reconnects (optional)
+        :param session_pool: the SessionPool used for all requests (optional, a pool with one session is created on
+                             first use otherwise)
+        :param accessory_cache: the AccessoryCache that keeps the accessory database across restarts (optional)
         """
         self.pairing_data = pairing_data
-        self.session = None
+        self.session_cache = session_cache
+        self.session = session_pool
+        self.accessory_cache = accessory_cache
 
     def close(self):
         """
@@ -64,38 +220,23 @@ class IpPairing(AbstractPairing):
 
     def list_accessories_and_characteristics(self):
         """
-        This retrieves a current set of accessories and characteristics behind this pairing.
+        This retrieves a current set of accessories and characteristics behind this pairing. If the pairing has an
+        accessory cache, the cached set is returned as long as the configuration number did not change.
 
         :return: the accessory data as described in the spec on page 73 and following
         :raises AccessoryNotFoundError: if the device can not be found via zeroconf
         """
+        accessories = self._get_cached_accessories()
+        if accessories is not None:
+            return accessories
         if not self.session:
-            self.session = IpSession(self.pairing_data)
-        try:
-            response = self.session.get('/accessories')
-        except (AccessoryDisconnectedError, EncryptionError):
-            self.session.close()
-            self.session = None
-            raise
+            self.session = SessionPool(self.pairing_data, self.session_cache)
+        response = self.session.get('/accessories')
         tmp = response.read().decode()
-        accessories = json.loads(tmp)['accessories']
-
-        for accessory in accessories:
-            for service in accessory['services']:
-                service['type'] = service['type'].upper()
-                try:
-                    service['type'] = ServicesTypes.get_uuid(service['type'])
-                except KeyError:
-                    pass
-
-                for characteristic in service['characteristics']:
-                    characteristic['type'] = characteristic['type'].upper()
-                    try:
-                        characteristic['type'] = CharacteristicsTypes.get_uuid(characteristic['type'])
-                    except KeyError:
-                        pass
+        accessories = normalize_accessories(json.loads(tmp)['accessories'])
 
         self.pairing_data['accessories'] = accessories
+        self._cache_accessories(accessories)
         return accessories
 
     def list_pairings(self):
@@ -114,41 +255,13 @@ class IpPairing(AbstractPairing):
         :raises: UnpairedError: if the polled accessory is not paired
         """
         if not self.session:
-            self.session = IpSession(self.pairing_data)
+            self.session = SessionPool(self.pairing_data, self.session_cache)
         request_tlv = TLV.encode_list([
             (TLV.kTLVType_State, TLV.M1),
             (TLV.kTLVType_Method, TLV.ListPairings)
         ])
-        try:
-            response = self.session.sec_http.post('/pairings', request_tlv.decode())
-            data = response.read()
-        except (AccessoryDisconnectedError, EncryptionError):
-            self.session.close()
-            self.session = None
-            raise
-        data = TLV.decode_bytes(data)
-
-        if not (data[0][0] == TLV.kTLVType_State and data[0][1] == TLV.M2):
-            raise UnknownError('unexpected data received: ' + str(data))
-        elif data[1][0] == TLV.kTLVType_Error and data[1][1] == TLV.kTLVError_Authentication:
-            raise UnpairedError('Must be paired')
-        else:
-            tmp = []
-            r = {}
-            for d in data[1:]:
-                if d[0] == TLV.kTLVType_Identifier:
-                    r = {}
-                    tmp.append(r)
-                    r['pairingId'] = d[1].decode()
-                if d[0] == TLV.kTLVType_PublicKey:
-                    r['publicKey'] = d[1].hex()
-                if d[0] == TLV.kTLVType_Permissions:
-                    controller_type = 'regular'
-                    if d[1] == b'\x01':
-                        controller_type = 'admin'
-                    r['permissions'] = int.from_bytes(d[1], byteorder='little')
-                    r['controllerType'] = controller_type
-            return tmp
+        response = self.session.post('/pairings', request_tlv, HttpContentTypes.TLV)
+        return parse_pairings(response.read())
 
     def get_characteristics(self, characteristics, include_meta=False, include_perms=False, include_type=False,
                             include_events=False):
@@ -169,43 +282,18 @@ class IpPairing(AbstractPairing):
                  }
         """
         if not self.session:
-            self.session = IpSession(self.pairing_data)
-        url = '/characteristics?id=' + ','.join([str(x[0]) + '.' + str(x[1]) for x in characteristics])
-        if include_meta:
-            url += '&meta=1'
-        if include_perms:
-            url += '&perms=1'
-        if include_type:
-            url += '&type=1'
-        if include_events:
-            url += '&ev=1'
+            self.session = SessionPool(self.pairing_data, self.session_cache)
+        url = characteristics_url(characteristics, include_meta, include_perms, include_type, include_events)
 
-        try:
-            response = self.session.get(url)
-        except (AccessoryDisconnectedError, EncryptionError):
-            self.session.close()
-            self.session = None
-            raise
+        response = self.session.get(url)
 
         try:
             data = json.loads(response.read().decode())['characteristics']
         except JSONDecodeError:
-            self.session.close()
-            self.session = None
+            self.session.discard_served()
             raise AccessoryDisconnectedError("Session closed after receiving malformed response from device")
 
-        tmp = {}
-        for c in data:
-            key = (c['aid'], c['iid'])
-            del c['aid']
-            del c['iid']
-
-            if 'status' in c and c['status'] == 0:
-                del c['status']
-            if 'status' in c and c['status'] != 0:
-                c['description'] = HapStatusCodes[c['status']]
-            tmp[key] = c
-        return tmp
+        return parse_characteristics(data)
 
     def put_characteristics(self, characteristics, do_conversion=False):
         """
@@ -220,49 +308,22 @@ class IpPairing(AbstractPairing):
                              requested
         """
         if not self.session:
-            self.session = IpSession(self.pairing_data)
+            self.session = SessionPool(self.pairing_data, self.session_cache)
         if 'accessories' not in self.pairing_data:
             self.list_accessories_and_characteristics()
-        data = []
-        characteristics_set = set()
-        for characteristic in characteristics:
-            aid = characteristic[0]
-            iid = characteristic[1]
-            value = characteristic[2]
-            if do_conversion:
-                # evaluate proper format
-                c_format = None
-                for d in self.pairing_data['accessories']:
-                    if 'aid' in d and d['aid'] == aid:
-                        for s in d['services']:
-                            for c in s['characteristics']:
-                                if 'iid' in c and c['iid'] == iid:
-                                    c_format = c['format']
-
-                value = check_convert_value(value, c_format)
-            characteristics_set.add('{a}.{i}'.format(a=aid, i=iid))
-            data.append({'aid': aid, 'iid': iid, 'value': value})
-        data = json.dumps({'characteristics': data})
+        data = characteristics_write_body(characteristics, self.get_accessory_index(), do_conversion)
 
-        try:
-            response = self.session.put('/characteristics', data)
-        except (AccessoryDisconnectedError, EncryptionError):
-            self.session.close()
-            self.session = None
-            raise
+        response = self.session.put('/characteristics', data)
 
         if response.code != 204:
             data = response.read().decode()
             try:
                 data = json.loads(data)['characteristics']
             except JSONDecodeError:
-                self.session.close()
-                self.session = None
+                self.session.discard_served()
                 raise AccessoryDisconnectedError("Session closed after receiving malformed response from device")
 
-            data = {(d['aid'], d['iid']): {'status': d['status'], 'description': HapStatusCodes[d['status']]} for d in
-                    data}
-            return data
+            return parse_status(data)
         return {}
 
     def get_events(self, characteristics, callback_fun, max_events=-1, max_seconds=-1):
@@ -287,64 +348,44 @@ class IpPairing(AbstractPairing):
                  {(1, 37): {'description': 'Notification is not supported for characteristic.', 'status': -70406}}
         """
         if not self.session:
-            self.session = IpSession(self.pairing_data)
-        data = []
-        characteristics_set = set()
-        for characteristic in characteristics:
-            aid = characteristic[0]
-            iid = characteristic[1]
-            characteristics_set.add('{a}.{i}'.format(a=aid, i=iid))
-            data.append({'aid': aid, 'iid': iid, 'ev': True})
-        data = json.dumps({'characteristics': data})
+            self.session = SessionPool(self.pairing_data, self.session_cache)
+        data = events_body(characteristics)
 
+        # events are sent on the connection that registered for them, so all requests have to use the same session
+        session = self.session.acquire()
         try:
-            response = self.session.put('/characteristics', data)
+            response = session.put('/characteristics', data)
         except (AccessoryDisconnectedError, EncryptionError):
-            self.session.close()
-            self.session = None
+            self.session.discard(session)
             raise
 
         # handle error responses
         if response.code != 204:
-            tmp = {}
             try:
                 data = json.loads(response.read().decode())
             except JSONDecodeError:
-                self.session.close()
-                self.session = None
+                self.session.discard(session)
                 raise AccessoryDisconnectedError("Session closed after receiving malformed response from device")
 
-            for characteristic in data['characteristics']:
-                status = characteristic['status']
-                if status == 0:
-                    continue
-                aid = characteristic['aid']
-                iid = characteristic['iid']
-                tmp[(aid, iid)] = {'status': status, 'description': HapStatusCodes[status]}
-            return tmp
+            return parse_status(data['characteristics'], include_success=False)
 
         # wait for incoming events
         event_count = 0
         s = time.time()
         while (max_events == -1 or event_count < max_events) and (max_seconds == -1 or s + max_seconds >= time.time()):
             try:
-                r = self.session.sec_http.handle_event_response()
-                body = r.read().decode()
+                r = session.sec_http.handle_event_response()
             except (AccessoryDisconnectedError, EncryptionError):
-                self.session.close()
-                self.session = None
+                self.session.discard(session)
                 raise
+            body = r.read().decode()
 
             if len(body) > 0:
                 try:
-                    r = json.loads(body)
+                    tmp = parse_event(body)
                 except JSONDecodeError:
-                    self.session.close()
-                    self.session = None
+                    self.session.discard(session)
                     raise AccessoryDisconnectedError("Session closed after receiving malformed response from device")
-                tmp = []
-                for c in r['characteristics']:
-                    tmp.append((c['aid'], c['iid'], c['value']))
                 callback_fun(tmp)
                 event_count += 1
         return {}
@@ -360,32 +401,26 @@ class IpPairing(AbstractPairing):
         :return True, if the identification was run, False otherwise
         """
         if not self.session:
-            self.session = IpSession(self.pairing_data)
+            self.session = SessionPool(self.pairing_data, self.session_cache)
         if 'accessories' not in self.pairing_data:
             self.list_accessories_and_characteristics()
 
         # we are looking for a characteristic of the identify type
-        identify_type = CharacteristicsTypes.get_uuid(CharacteristicsTypes.IDENTIFY)
-
-        # search all accessories, all services and all characteristics
-        for accessory in self.pairing_data['accessories']:
-            aid = accessory['aid']
-            for service in accessory['services']:
-                for characteristic in service['characteristics']:
-                    iid = characteristic['iid']
-                    c_type = CharacteristicsTypes.get_uuid(characteristic['type'])
-                    if identify_type == c_type:
-                        # found the identify characteristic, so let's put a value there
-                        self.put_characteristics([(aid, iid, True)])
-                        return True
-        return False
+        identify = self.get_accessory_index().find_characteristics(CharacteristicsTypes.IDENTIFY)
+        if not identify:
+            return False
+        # found the identify characteristic, so let's put a value there
+        aid, iid = identify[0]
+        self.put_characteristics([(aid, iid, True)])
+        return True
 
 
 class IpSession(object):
-    def __init__(self, pairing_data):
+    def __init__(self, pairing_data, session_cache=None):
         """
 
         :param pairing_data:
+        :param session_cache: the SessionCache used to resume an earlier session with the accessory (optional)
         :raises AccessoryNotFoundError: if the device can not be found via zeroconf
         """
         logging.debug('init session')
@@ -398,7 +433,7 @@ class IpSession(object):
             try:
                 conn.connect()
                 write_fun = create_ip_pair_verify_write(conn)
-                c2a_key, a2c_key = get_session_keys(conn, pairing_data, write_fun)
+                c2a_key, a2c_key = get_session_keys(conn, pairing_data, write_fun, session_cache)
                 connected = True
             except Exception:
                 connected = False
@@ -413,7 +448,7 @@ class IpSession(object):
             pairing_data['AccessoryIP'] = connection_data['ip']
             pairing_data['AccessoryPort'] = connection_data['port']
             write_fun = create_ip_pair_verify_write(conn)
-            c2a_key, a2c_key = get_session_keys(conn, pairing_data, write_fun)
+            c2a_key, a2c_key = get_session_keys(conn, pairing_data, write_fun, session_cache)
 
         logging.debug('session established')
         self.sock = conn.sock
@@ -421,11 +456,27 @@ class IpSession(object):
         self.a2c_key = a2c_key
         self.pairing_data = pairing_data
         self.sec_http = SecureHttp(self)
+        self.last_used = time.monotonic()
+
+    def is_alive(self):
+        """
+        :return: False if the session was closed or its connection broke
+        """
+        return self.sock is not None and self.sec_http.is_connected()
+
+    def add_disconnect_listener(self, listener):
+        """
+        Registers a function that is called without parameters once the session's connection broke.
+
+        :param listener: the function
+        """
+        self.sec_http.add_disconnect_listener(listener)
 
     def close(self):
         """
         Close the session. This closes the socket.
         """
+        self.sec_http.close()
         try:
             self.sock.close()
         except OSError:
@@ -447,6 +498,7 @@ class IpSession(object):
         :param url: The url to request
         :return: a homekit.http_impl.HttpResponse object
         """
+        self.last_used = time.monotonic()
         return self.sec_http.get(url)
 
     def put(self, url, body, content_type=HttpContentTypes.JSON):
@@ -457,6 +509,7 @@ class IpSession(object):
         :param content_type: the content of the content-type header
         :return: a homekit.http_impl.HttpResponse object
         """
+        self.last_used = time.monotonic()
         return self.sec_http.put(url, body, content_type)
 
     def post(self, url, body, content_type=HttpContentTypes.JSON):
@@ -467,4 +520,258 @@ class IpSession(object):
         :param content_type: the content of the content-type header
         :return: a homekit.http_impl.HttpResponse object
         """
+        self.last_used = time.monotonic()
         return self.sec_http.post(url, body, content_type)
+
+
+class SessionPool(object):
+    """
+    Keeps up to `size` sessions with one IP accessory and shares them between all requests of an IpPairing. Since
+    requests can be pipelined on a session, a session is not reserved for a single request. A background thread keeps
+    the pool filled: it replaces sessions whose connection broke (using pair resume where possible) and probes idle
+    sessions so dead connections are noticed before the next request. Only a request that finds no session at all
+    has to wait for a connect and pair verify.
+    """
+
+    # the probe if the accessory database is not known, this is answered by any accessory with a value or (since iid 1
+    # usually is the accessory information service) an error status
+    PROBE_TARGET = '/characteristics?id=1.1'
+
+    # the number of seconds to wait before a failed connect is tried again
+    RECONNECT_DELAY = 5
+
+    # the number of failed connects after which the background thread waits for the next request
+    RECONNECT_ATTEMPTS = 3
+
+    def __init__(self, pairing_data, session_cache=None, size=1, keepalive_interval=60, session_factory=None):
+        """
+        :param pairing_data: the pairing data of the accessory
+        :param session_cache: the SessionCache used to resume sessions on reconnects (optional)
+        :param size: the number of sessions kept with the accessory
+        :param keepalive_interval: the number of seconds a session may be idle before it is probed, None disables the
+                                   probes
+        :param session_factory: creates a session from pairing data and session cache, defaults to IpSession
+        """
+        self.pairing_data = pairing_data
+        self.session_cache = session_cache
+        self.size = size
+        self.keepalive_interval = keepalive_interval
+        self.session_factory = session_factory if session_factory is not None else IpSession
+        self._sessions = []
+        self._connecting = 0
+        self._failures = 0
+        self._next = 0
+        self._closed = False
+        self._thread = None
+        self._condition = threading.Condition()
+        # the session that served the last request of each thread
+        self._served = threading.local()
+        # the accessory database and the probe target found in it, see _probe_target
+        self._probe = (None, SessionPool.PROBE_TARGET)
+
+    def __len__(self):
+        with self._condition:
+            self._drop_dead()
+            return len(self._sessions)
+
+    def _drop_dead(self):
+        alive = []
+        for session in self._sessions:
+            if session.is_alive():
+                alive.append(session)
+            else:
+                session.close()
+        self._sessions = alive
+
+    def _connect(self):
+        session = self.session_factory(self.pairing_data, self.session_cache)
+        session.add_disconnect_listener(self._wake_up)
+        with self._condition:
+            self._connecting -= 1
+            if self._closed:
+                session.close()
+            else:
+                self._sessions.append(session)
+            self._failures = 0
+            self._condition.notify_all()
+        return session
+
+    def _wake_up(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    def acquire(self):
+        """
+        Returns a session to send requests on. If no session is open, one is created, otherwise an open one is used
+        and missing sessions are created in the background.
+
+        :return: the IpSession
+        :raises AccessoryNotFoundError: if the device can not be found via zeroconf
+        """
+        with self._condition:
+            self._closed = False
+            self._failures = 0
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._maintain, name='SessionPool', daemon=True)
+                self._thread.start()
+            while True:
+                self._drop_dead()
+                if self._sessions:
+                    if len(self._sessions) + self._connecting < self.size:
+                        self._condition.notify_all()
+                    self._next = (self._next + 1) % len(self._sessions)
+                    return self._sessions[self._next]
+                if self._connecting == 0:
+                    self._connecting += 1
+                    break
+                # the background thread is connecting, wait for its result
+                self._condition.wait()
+        try:
+            return self._connect()
+        except Exception:
+            with self._condition:
+                self._connecting -= 1
+                self._condition.notify_all()
+            raise
+
+    def discard(self, session):
+        """
+        Closes a session that should not be used any more, e.g. after it returned malformed data. It is replaced in
+        the background.
+
+        :param session: the session
+        """
+        session.close()
+        self._wake_up()
+
+    def discard_served(self):
+        """
+        Discards the session that served the calling thread's last request, e.g. after that request's response was
+        malformed. The other sessions and the requests pipelined on them are not affected.
+        """
+        session = getattr(self._served, 'session', None)
+        self._served.session = None
+        if session is not None:
+            self.discard(session)
+
+    def reset(self):
+        """
+        Closes all sessions. New sessions are created in the background.
+        """
+        with self._condition:
+            sessions = self._sessions
+            self._sessions = []
+            self._condition.notify_all()
+        for session in sessions:
+            session.close()
+
+    def close(self):
+        """
+        Closes all sessions and stops the background thread. Using the pool afterwards opens it again.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self.reset()
+
+    def _request(self, method, *args):
+        session = self.acquire()
+        self._served.session = session
+        try:
+            return getattr(session, method)(*args)
+        except (AccessoryDisconnectedError, EncryptionError):
+            self.discard(session)
+            raise
+
+    def get(self, url):
+        """
+        Perform HTTP get on one of the pool's sessions.
+        :param url: The url to request
+        :return: a homekit.http_impl.HttpResponse object
+        """
+        return self._request('get', url)
+
+    def put(self, url, body, content_type=HttpContentTypes.JSON):
+        """
+        Perform HTTP put on one of the pool's sessions.
+        :param url: The url to request
+        :param body: the body of the put request
+        :param content_type: the content of the content-type header
+        :return: a homekit.http_impl.HttpResponse object
+        """
+        return self._request('put', url, body, content_type)
+
+    def post(self, url, body, content_type=HttpContentTypes.JSON):
+        """
+        Perform HTTP post on one of the pool's sessions.
+        :param url: The url to request
+        :param body: the body of the post request
+        :param content_type: the content of the content-type header
+        :return: a homekit.http_impl.HttpResponse object
+        """
+        return self._request('post', url, body, content_type)
+
+    def _probe_target(self):
+        """
+        :return: the url that is read to probe an idle session: the name of the first accessory if the accessory
+                 database is known, otherwise PROBE_TARGET
+        """
+        accessories = self.pairing_data.get('accessories')
+        if accessories is not self._probe[0]:
+            target = SessionPool.PROBE_TARGET
+            if accessories:
+                names = AccessoryIndex(accessories).find_characteristics(CharacteristicsTypes.NAME)
+                if names:
+                    target = '/characteristics?id={aid}.{iid}'.format(aid=names[0][0], iid=names[0][1])
+            self._probe = (accessories, target)
+        return self._probe[1]
+
+    def _maintain(self):
+        retry_at = 0
+        next_probe = time.monotonic() + (self.keepalive_interval or 0)
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed:
+                        return
+                    self._drop_dead()
+                    now = time.monotonic()
+                    missing = self.size - len(self._sessions) - self._connecting
+                    reconnect = missing > 0 and self._failures < SessionPool.RECONNECT_ATTEMPTS
+                    if reconnect and now >= retry_at:
+                        self._connecting += 1
+                        task = 'connect'
+                        break
+                    if self.keepalive_interval and now >= next_probe:
+                        sessions = list(self._sessions)
+                        task = 'probe'
+                        break
+                    deadlines = []
+                    if reconnect:
+                        deadlines.append(retry_at)
+                    if self.keepalive_interval:
+                        deadlines.append(next_probe)
+                    self._condition.wait(max(0, min(deadlines) - now) if deadlines else None)
+
+            if task == 'connect':
+                try:
+                    self._connect()
+                except Exception as e:
+                    logging.debug('reconnect failed: %s', e)
+                    retry_at = time.monotonic() + SessionPool.RECONNECT_DELAY
+                    with self._condition:
+                        self._connecting -= 1
+                        self._failures += 1
+                        self._condition.notify_all()
+            else:
+                next_probe = now + self.keepalive_interval
+                for session in sessions:
+                    if now - session.last_used < self.keepalive_interval:
+                        next_probe = min(next_probe, session.last_used + self.keepalive_interval)
+                        continue
+                    try:
+                        if session.get(self._probe_target()).code is None:
+                            # no answer within the timeout
+                            self.discard(session)
+                    except (AccessoryDisconnectedError, EncryptionError):
+                        self.discard(session)
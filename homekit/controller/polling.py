@@ -0,0 +1,244 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Polls characteristics that do not support events. Each characteristic is read at the interval it should be fresh
+within. The interval grows while the value does not change and falls back as soon as it changes. All characteristics of
+an accessory that are due at about the same time are read with one request.
+"""
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from homekit.exceptions import AccessoryNotFoundError
+
+logger = logging.getLogger('homekit.controller.polling')
+
+
+class _PolledCharacteristic(object):
+
+    def __init__(self, aid, iid, interval, max_interval, next_due):
+        self.aid = aid
+        self.iid = iid
+        self.interval = interval
+        self.max_interval = max_interval
+        # the interval used at the moment, between interval and max_interval
+        self.current = interval
+        self.next_due = next_due
+        self.value = None
+        self.has_value = False
+
+
+class PollingScheduler(object):
+    """
+    Reads characteristics of pairings in the background and reports changed values:
+
+        def changed(alias, aid, iid, value):
+            ...
+
+        scheduler = PollingScheduler(controller.get_pairings(), changed)
+        scheduler.add('alias', [(1, 10), (1, 11)], interval=5, max_interval=60)
+        scheduler.start()
+
+    The pairings are used through get_characteristics, so IP and BLE pairings are supported. Each pairing has at most
+    one request running at a time.
+    """
+
+    # characteristics of the accessory are read along with a due one if their remaining time is below this part of
+    # their current interval
+    COALESCE_FACTOR = 0.25
+
+    def __init__(self, pairings, callback, error_callback=None, backoff=2.0, jitter=0.1, max_workers=4,
+                 clock=time.monotonic):
+        """
+        :param pairings: a dict mapping aliases to pairings, e.g. the result of Controller.get_pairings()
+        :param callback: called with alias, aid, iid and the value for the first value of a characteristic and each
+                         change. It is called from the scheduler's worker threads and should return quickly.
+        :param error_callback: called with the alias and the exception if reading the characteristics of a pairing
+                               failed (optional)
+        :param backoff: the factor the interval grows by each time the value did not change
+        :param jitter: the part of the interval by which reads are moved earlier at random, so characteristics added
+                       together do not stay in lock step
+        :param max_workers: how many pairings are read at the same time
+        :param clock: the time source (defaults to time.monotonic)
+        """
+        self.pairings = pairings
+        self.callback = callback
+        self.error_callback = error_callback
+        self.backoff = backoff
+        self.jitter = jitter
+        self.max_workers = max_workers
+        self.clock = clock
+        self._characteristics = {}
+        self._busy = set()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._executor = None
+        self._stopped = True
+
+    def add(self, alias, characteristics, interval: float, max_interval: float = None):
+        """
+        Starts polling characteristics. The characteristics are first read together at a random point within the
+        first interval, so pairings added at the same time are not read in a burst. If the pairing is already polled,
+        they are first read with its next read instead.
+
+        :param alias: the alias of the pairing
+        :param characteristics: a list of 2-tupels of aid and iid
+        :param interval: the number of seconds within which a changed value should be noticed
+        :param max_interval: the maximum number of seconds between two reads of a value that does not change,
+                             defaults to 8 times the interval
+        """
+        if max_interval is None:
+            max_interval = 8 * interval
+        max_interval = max(interval, max_interval)
+        now = self.clock()
+        first_due = now + random.uniform(0, interval)
+        with self._condition:
+            polled = self._characteristics.setdefault(alias, {})
+            if polled:
+                # join the next read of the pairing so the characteristics are read together from the start
+                first_due = min(min(c.next_due for c in polled.values()), now + interval)
+            for aid, iid in characteristics:
+                polled[(aid, iid)] = _PolledCharacteristic(aid, iid, interval, max_interval, first_due)
+            self._condition.notify()
+
+    def remove(self, alias, characteristics=None):
+        """
+        Stops polling characteristics.
+
+        :param alias: the alias of the pairing
+        :param characteristics: a list of 2-tupels of aid and iid, None to stop polling all characteristics of the
+                                pairing
+        """
+        with self._condition:
+            if characteristics is None:
+                self._characteristics.pop(alias, None)
+                return
+            polled = self._characteristics.get(alias, {})
+            for key in characteristics:
+                polled.pop(tuple(key), None)
+            if not polled:
+                self._characteristics.pop(alias, None)
+
+    def next_due(self):
+        """
+        :return: the point in time (of the scheduler's clock) the next read is due or None if nothing is polled
+        """
+        with self._condition:
+            return self._next_due()
+
+    def _next_due(self):
+        due = None
+        for alias, polled in self._characteristics.items():
+            if alias in self._busy:
+                continue
+            for characteristic in polled.values():
+                if due is None or characteristic.next_due < due:
+                    due = characteristic.next_due
+        return due
+
+    def _collect(self, now):
+        # must be called with the lock held, marks the returned pairings as busy
+        batches = {}
+        for alias, polled in self._characteristics.items():
+            if alias in self._busy or not any(c.next_due <= now for c in polled.values()):
+                continue
+            batches[alias] = [c for c in polled.values()
+                              if c.next_due - now <= PollingScheduler.COALESCE_FACTOR * c.current]
+            self._busy.add(alias)
+        return batches
+
+    def _read(self, alias, batch):
+        changed = []
+        error = None
+        results = {}
+        try:
+            if alias not in self.pairings:
+                raise AccessoryNotFoundError('Unknown alias "{a}"'.format(a=alias))
+            results = self.pairings[alias].get_characteristics([(c.aid, c.iid) for c in batch])
+        except Exception as e:
+            error = e
+        now = self.clock()
+        with self._condition:
+            for characteristic in batch:
+                result = results.get((characteristic.aid, characteristic.iid), {})
+                if 'value' in result and (not characteristic.has_value or result['value'] != characteristic.value):
+                    characteristic.value = result['value']
+                    characteristic.has_value = True
+                    characteristic.current = characteristic.interval
+                    changed.append(characteristic)
+                else:
+                    characteristic.current = min(characteristic.current * self.backoff, characteristic.max_interval)
+                characteristic.next_due = now + characteristic.current * (1 - random.uniform(0, self.jitter))
+            self._busy.discard(alias)
+            self._condition.notify()
+        try:
+            if error is not None:
+                logger.debug('polling %s failed: %s', alias, error)
+                if self.error_callback:
+                    self.error_callback(alias, error)
+            for characteristic in changed:
+                self.callback(alias, characteristic.aid, characteristic.iid, characteristic.value)
+        except Exception:
+            logger.exception('polling callback failed')
+
+    def poll(self):
+        """
+        Reads all characteristics that are due now, one request per pairing. This is done by the scheduler's thread
+        after start, but can also be called directly to drive the scheduler from an own loop.
+
+        :return: the number of pairings that were read
+        """
+        with self._condition:
+            batches = self._collect(self.clock())
+        for alias, batch in batches.items():
+            self._read(alias, batch)
+        return len(batches)
+
+    def start(self):
+        """
+        Starts polling in a background thread.
+        """
+        with self._condition:
+            if not self._stopped:
+                return
+            self._stopped = False
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            self._thread = threading.Thread(target=self._run, name='PollingScheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops polling. Reads that are running are finished.
+        """
+        with self._condition:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def _run(self):
+        with self._condition:
+            while not self._stopped:
+                for alias, batch in self._collect(self.clock()).items():
+                    self._executor.submit(self._read, alias, batch)
+                due = self._next_due()
+                self._condition.wait(None if due is None else max(0, due - self.clock()))
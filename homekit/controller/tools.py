@@ -19,6 +19,8 @@ import base64
 import binascii
 from distutils.util import strtobool
 
+from homekit.controller.accessory_cache import normalize_config_num
+from homekit.controller.accessory_index import AccessoryIndex
 from homekit.protocol.tlv import TLV, TlvParseException
 from homekit.exceptions import FormatError
 from homekit.model.characteristics import CharacteristicFormats
@@ -26,6 +28,15 @@ from homekit.model.characteristics import CharacteristicFormats
 
 class AbstractPairing(abc.ABC):
 
+    # the AccessoryCache consulted by list_accessories_and_characteristics, None to always ask the accessory
+    accessory_cache = None
+
+    # the configuration number (c# for IP, cn for BLE accessories) as reported by discovery, None if unknown
+    config_num = None
+
+    # the AccessoryIndex of the accessory database in the pairing data, see get_accessory_index
+    _accessory_index = None
+
     def _get_pairing_data(self):
         """
         This method returns the internal pairing data. DO NOT mess around with it.
@@ -34,6 +45,62 @@ class AbstractPairing(abc.ABC):
         """
         return self.pairing_data
 
+    def get_accessory_index(self):
+        """
+        Returns the lookup tables over the accessory database in the pairing data. They are built once per database,
+        i.e. again after list_accessories_and_characteristics read a new one.
+
+        :return: the AccessoryIndex or None if the pairing data contains no accessory database
+        """
+        accessories = self.pairing_data.get('accessories')
+        if accessories is None:
+            return None
+        index = self._accessory_index
+        if index is None or index.accessories is not accessories:
+            index = AccessoryIndex(accessories)
+            self._accessory_index = index
+        return index
+
+    def _get_cached_accessories(self):
+        """
+        :return: the accessory database from the accessory cache if it matches the configuration number, else None
+        """
+        pairing_id = self.pairing_data.get('AccessoryPairingID')
+        if self.accessory_cache is None or pairing_id is None:
+            return None
+        accessories = self.accessory_cache.get(pairing_id, self.config_num)
+        if accessories is not None:
+            self.pairing_data['accessories'] = accessories
+        return accessories
+
+    def _cache_accessories(self, accessories):
+        pairing_id = self.pairing_data.get('AccessoryPairingID')
+        if self.accessory_cache is not None and pairing_id is not None:
+            self.accessory_cache.put(pairing_id, self.config_num, accessories)
+
+    def set_config_num(self, config_num) -> bool:
+        """
+        Updates the configuration number of the accessory, e.g. from the results of Controller.discover. If it differs
+        from the number the known accessory database was read at, the database is dropped and read again from the
+        accessory on next use.
+
+        :param config_num: the configuration number as reported by discovery
+        :return: True if the known accessory database is outdated
+        """
+        config_num = normalize_config_num(config_num)
+        if config_num is None:
+            return False
+        outdated = self.config_num is not None and self.config_num != config_num
+        pairing_id = self.pairing_data.get('AccessoryPairingID')
+        if self.accessory_cache is not None and pairing_id is not None:
+            cached = self.accessory_cache.get(pairing_id)
+            if cached is not None and self.accessory_cache.get_config_num(pairing_id) != config_num:
+                outdated = True
+        self.config_num = config_num
+        if outdated:
+            self.pairing_data.pop('accessories', None)
+        return outdated
+
     @abc.abstractmethod
     def close(self):
         """
@@ -15,8 +15,13 @@
 #
 
 __all__ = [
-    'chacha20_aead_decrypt', 'chacha20_aead_encrypt', 'SrpClient', 'SrpServer'
+    'chacha20_aead_decrypt', 'chacha20_aead_encrypt', 'HapCipher', 'SrpClient', 'SrpServer', 'available_aead_backends',
+    'get_aead_backend', 'register_aead_backend', 'set_aead_backend'
 ]
 
-from homekit.crypto.chacha20poly1305 import chacha20_aead_decrypt, chacha20_aead_encrypt
+from homekit.crypto.chacha20poly1305 import chacha20_aead_decrypt, chacha20_aead_encrypt, available_aead_backends, \
+    get_aead_backend, register_aead_backend, set_aead_backend
+# registers the vectorized backend if numpy is available
+import homekit.crypto.chacha20_numpy  # noqa: F401
+from homekit.crypto.hap_cipher import HapCipher
 from homekit.crypto.srp import SrpClient, SrpServer
@@ -0,0 +1,147 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Implements the ChaCha20 key stream (RFC7539 chapter 2.4) with numpy. All blocks of a message are computed at once:
+the state is kept as a 16 x n matrix of uint32 so each step of the quarter rounds works on all n blocks together.
+The backend is always registered, but is_available reports whether numpy can be imported and it is only used if so.
+Poly1305 is taken from the reference implementation.
+"""
+import hmac
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from homekit.crypto.chacha20poly1305 import _chacha20_key_words, _poly1305_aead_tag, register_aead_backend
+
+
+_SHIFTS = {n: (numpy.uint32(n), numpy.uint32(32 - n)) for n in (16, 12, 8, 7)} if numpy is not None else {}
+
+
+def _add_xor_rotate(a, b, d, tmp, shift_bits: int):
+    # a += b; d ^= a; d <<<= shift_bits, all in place on rows of the state matrix
+    left, right = _SHIFTS[shift_bits]
+    numpy.add(a, b, out=a)
+    numpy.bitwise_xor(d, a, out=d)
+    numpy.left_shift(d, left, out=tmp)
+    numpy.right_shift(d, right, out=d)
+    numpy.bitwise_or(d, tmp, out=d)
+
+
+def _quarter_round(a, b, c, d, tmp):
+    _add_xor_rotate(a, b, d, tmp, 16)
+    _add_xor_rotate(c, d, b, tmp, 12)
+    _add_xor_rotate(a, b, d, tmp, 8)
+    _add_xor_rotate(c, d, b, tmp, 7)
+
+
+def chacha20_key_stream(key_words: list, nonce: bytes, counter: int, length: int) -> bytes:
+    """
+    Computes the key stream for length bytes starting with the block counter.
+
+    :param key_words: constants and key as returned by _chacha20_key_words
+    :param nonce: the 96 bit nonce as bytes
+    :param counter: the 32bit block counter of the first block
+    :param length: the number of key stream bytes required
+    :return: the key stream (a multiple of 64 bytes, at least length bytes)
+    """
+    blocks = (length + 63) // 64
+    state = numpy.empty((16, blocks), dtype=numpy.uint32)
+    state[0:12] = numpy.array(key_words, dtype=numpy.uint32)[:, None]
+    state[12] = (numpy.arange(blocks, dtype=numpy.uint64) + counter) & 0xffffffff
+    state[13:16] = numpy.array(struct.unpack('<3I', nonce), dtype=numpy.uint32)[:, None]
+
+    x = state.copy()
+    r = list(x)
+    tmp = numpy.empty(blocks, dtype=numpy.uint32)
+    for i in range(0, 10):
+        _quarter_round(r[0], r[4], r[8], r[12], tmp)
+        _quarter_round(r[1], r[5], r[9], r[13], tmp)
+        _quarter_round(r[2], r[6], r[10], r[14], tmp)
+        _quarter_round(r[3], r[7], r[11], r[15], tmp)
+        _quarter_round(r[0], r[5], r[10], r[15], tmp)
+        _quarter_round(r[1], r[6], r[11], r[12], tmp)
+        _quarter_round(r[2], r[7], r[8], r[13], tmp)
+        _quarter_round(r[3], r[4], r[9], r[14], tmp)
+    x += state
+    # serialize block by block, each word little endian
+    return x.T.astype('<u4').tobytes()
+
+
+def _otk_and_xor(key_words: list, nonce: bytes, data: bytes):
+    """
+    Computes the poly1305 one time key (block 0) and encrypts (or decrypts) data with the key stream starting at block
+    1. Both come from a single run over all blocks, the data is xored in one vectorized operation.
+
+    :return: tuple of the one time key as bytes and the encrypted data as bytearray
+    """
+    key_stream = chacha20_key_stream(key_words, nonce, 0, 64 + len(data))
+    if len(data) == 0:
+        return key_stream[:32], bytearray()
+    result = numpy.frombuffer(data, dtype=numpy.uint8) ^ \
+        numpy.frombuffer(key_stream, dtype=numpy.uint8, count=len(data), offset=64)
+    return key_stream[:32], bytearray(result.tobytes())
+
+
+class _NumpyAeadContext:
+
+    def __init__(self, key: bytes):
+        self.key_words = _chacha20_key_words(key)
+
+    def encrypt(self, aad: bytes, nonce: bytes, plaintext: bytes) -> bytearray:
+        otk, ciphertext = _otk_and_xor(self.key_words, nonce, plaintext)
+        ciphertext += _poly1305_aead_tag(aad, otk, ciphertext)
+        return ciphertext
+
+    def decrypt(self, aad: bytes, nonce: bytes, ciphertext: bytes):
+        digest = ciphertext[-16:]
+        ciphertext = memoryview(ciphertext)[:-16]
+        otk, plaintext = _otk_and_xor(self.key_words, nonce, ciphertext)
+        if not hmac.compare_digest(digest, _poly1305_aead_tag(aad, otk, ciphertext)):
+            return False
+        return plaintext
+
+
+class NumpyAeadBackend:
+    """
+    Vectorized chacha20 with the reference poly1305. It is preferred over the pure python backend but not over the
+    cryptography backend.
+    """
+    name = 'numpy'
+
+    @staticmethod
+    def is_available() -> bool:
+        return numpy is not None
+
+    @staticmethod
+    def context(key: bytes):
+        return _NumpyAeadContext(key)
+
+    @staticmethod
+    def encrypt(aad: bytes, key: bytes, nonce: bytes, plaintext: bytes):
+        data = _NumpyAeadContext(key).encrypt(aad, nonce, plaintext)
+        return data[:-16], bytes(data[-16:])
+
+    @staticmethod
+    def decrypt(aad: bytes, key: bytes, nonce: bytes, ciphertext: bytes):
+        return _NumpyAeadContext(key).decrypt(aad, nonce, ciphertext)
+
+
+# right after the cryptography backend
+register_aead_backend(NumpyAeadBackend, 1)
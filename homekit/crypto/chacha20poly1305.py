@@ -20,7 +20,15 @@
 Implements the ChaCha20 stream cipher and the Poly1350 authenticator. More information can be found on
 https://tools.ietf.org/html/rfc7539. See HomeKit spec page 51.
 """
-from math import ceil
+import hmac
+import os
+import struct
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+except ImportError:
+    ChaCha20Poly1305 = None
 
 
 def rotate_left(num: int, num_size: int, shift_bits: int) -> int:
@@ -172,6 +180,28 @@ def chacha20_encrypt(key: bytes, counter: int, nonce: int, plaintext: bytes) ->
     return encrypted
 
 
+def _chacha20_key_words(key: bytes) -> list:
+    """
+    Returns the first 12 words of the initial chacha20 state (constants and key). They only depend on the key and can
+    be reused for all blocks encrypted with that key.
+    """
+    return [0x61707865, 0x3320646e, 0x79622d32, 0x6b206574] + list(struct.unpack('<8I', key))
+
+
+def _chacha20_block_bytes(state: list) -> bytes:
+    """
+    Computes one chacha20 block like chacha20_block but from an already prepared initial state and without checking
+    key and nonce again.
+
+    :param state: the initial state as list of 16 ints
+    :return: the serialized block as 64 bytes
+    """
+    w_state = state.copy()
+    for i in range(0, 10):
+        chacha20_inner_block(w_state)
+    return struct.pack('<16I', *[(a + b) & 0xffffffff for (a, b) in zip(state, w_state)])
+
+
 def clamp(r: int) -> int:
     tmp = r.to_bytes(length=16, byteorder='little')
     msk = 0x0ffffffc0ffffffc0ffffffc0fffffff.to_bytes(length=16, byteorder='big')
@@ -195,24 +225,78 @@ def calc_s(k: bytes) -> int:
     return int.from_bytes(tmp, byteorder='little')
 
 
+class Poly1305:
+    """
+    Incremental Poly1305 authenticator as described in RFC7539 chapter 2.5. Data can be passed in arbitrary pieces
+    (bytes, bytearray or memoryview), only the last incomplete 16 byte block is buffered. So the mac over several
+    buffers can be computed without concatenating them first.
+    """
+    _P = (1 << 130) - 5
+
+    def __init__(self, key: bytes):
+        """
+        :param key: the 256 bit one time key as bytes
+        """
+        assert type(key) is bytes, 'key is no instance of bytes'
+        assert len(key) == 32
+        self._r = clamp(calc_r(key))
+        self._s = calc_s(key)
+        self._a = 0
+        self._buffer = bytearray()
+
+    def _blocks(self, data: memoryview):
+        # data must have a length that is a multiple of 16
+        a = self._a
+        r = self._r
+        p = self._P
+        for offset in range(0, len(data), 16):
+            a = ((a + int.from_bytes(data[offset:offset + 16], byteorder='little') + (1 << 128)) * r) % p
+        self._a = a
+
+    def update(self, data: bytes):
+        """
+        Adds data to the authenticated message.
+
+        :param data: any bytes-like object
+        """
+        data = memoryview(data).cast('B')
+        if self._buffer:
+            missing = 16 - len(self._buffer)
+            self._buffer += data[:missing]
+            data = data[missing:]
+            if len(self._buffer) < 16:
+                return
+            self._blocks(memoryview(self._buffer))
+            self._buffer = bytearray()
+        full = len(data) - len(data) % 16
+        self._blocks(data[:full])
+        if full < len(data):
+            self._buffer = bytearray(data[full:])
+
+    def pad(self):
+        """
+        Fills up the last incomplete block with zeros, this is the same as adding pad16 of all data added so far.
+        """
+        if self._buffer:
+            self.update(bytes(16 - len(self._buffer)))
+
+    def finalize(self) -> bytes:
+        """
+        :return: the 16 byte tag over all data added so far
+        """
+        a = self._a
+        if self._buffer:
+            n = int.from_bytes(self._buffer, byteorder='little') + (1 << (8 * len(self._buffer)))
+            a = ((a + n) * self._r) % self._P
+        a += self._s
+        a &= (2 ** (16 * 8) - 1)
+        return a.to_bytes(length=16, byteorder='little')
+
+
 def poly1305_mac(msg: bytes, key: bytes) -> bytes:
-    assert type(key) is bytes, 'key is no instance of bytes'
-    assert len(key) == 32
-    r = calc_r(key)
-    r = clamp(r)
-    s = calc_s(key)
-    a = 0
-    p = (1 << 130) - 5
-    for i in range(0, ceil(len(msg) / 16)):
-        block = bytearray(msg[i * 16:i * 16 + 16])
-        block.append(0x01)
-        n = int.from_bytes(block, byteorder='little')
-        a += n
-        a = (r * a)
-        a %= p
-    a += s
-    a &= (2 ** (16 * 8) - 1)
-    return a.to_bytes(length=16, byteorder='little')
+    mac = Poly1305(key)
+    mac.update(msg)
+    return mac.finalize()
 
 
 def poly1305_key_gen(key: bytes, nonce: bytes) -> bytes:
@@ -237,21 +321,253 @@ def pad16(x: bytes) -> bytes:
     return bytearray([0 for i in range(0, tmp)])
 
 
+def _poly1305_tag(aad: bytes, key: bytes, nonce: bytes, ciphertext: bytes) -> bytes:
+    """
+    Computes the poly1305 tag over the additional authenticated data and the cipher text as described in RFC7539
+    chapter 2.8.
+
+    :param aad: arbitrary length additional authenticated data
+    :param key: 256-bit (32-byte) key of type bytes
+    :param nonce: the 96 bit nonce as bytes
+    :param ciphertext: the cipher text without tag
+    :return: the 16 byte tag
+    """
+    return _poly1305_aead_tag(aad, poly1305_key_gen(key, nonce), ciphertext)
+
+
+def _poly1305_aead_mac(aad: bytes, otk: bytes) -> Poly1305:
+    # the mac_data of RFC7539 chapter 2.8 starts with the padded aad
+    mac = Poly1305(otk)
+    mac.update(aad)
+    mac.pad()
+    return mac
+
+
+def _poly1305_aead_finalize(mac: Poly1305, aad_length: int, ciphertext_length: int) -> bytes:
+    mac.pad()
+    mac.update(struct.pack('<QQ', aad_length, ciphertext_length))
+    return mac.finalize()
+
+
+def _poly1305_aead_tag(aad: bytes, otk: bytes, ciphertext: bytes) -> bytes:
+    """
+    Computes the tag over aad + pad16(aad) + ciphertext + pad16(ciphertext) + both lengths without building that
+    buffer.
+
+    :param aad: arbitrary length additional authenticated data
+    :param otk: the poly1305 one time key
+    :param ciphertext: the cipher text without tag as any bytes-like object
+    :return: the 16 byte tag
+    """
+    mac = _poly1305_aead_mac(aad, otk)
+    mac.update(ciphertext)
+    return _poly1305_aead_finalize(mac, len(aad), len(ciphertext))
+
+
+def _chacha20_poly1305(key_words: list, nonce: bytes, aad: bytes, data: bytes, encrypt: bool):
+    """
+    Encrypts or decrypts data and computes the tag over the cipher text in a single pass over the data. Each block of
+    64 bytes is authenticated and xored with the key stream before the next one is handled.
+
+    :param key_words: the result of _chacha20_key_words
+    :param nonce: the 96 bit nonce as bytes
+    :param aad: arbitrary length additional authenticated data
+    :param data: the plain text (if encrypt is True) or the cipher text without tag
+    :param encrypt: True to encrypt data, False to decrypt
+    :return: tuple of the result as bytearray and the tag
+    """
+    nonce_words = list(struct.unpack('<3I', nonce))
+    mac = _poly1305_aead_mac(aad, _chacha20_block_bytes(key_words + [0] + nonce_words)[:32])
+    data = memoryview(data).cast('B')
+    result = bytearray(len(data))
+    counter = 1
+    for offset in range(0, len(data), 64):
+        block = data[offset:offset + 64]
+        length = len(block)
+        if not encrypt:
+            mac.update(block)
+        key_stream = _chacha20_block_bytes(key_words + [counter & 0xffffffff] + nonce_words)
+        tmp = int.from_bytes(block, byteorder='little') ^ int.from_bytes(key_stream[:length], byteorder='little')
+        result[offset:offset + length] = tmp.to_bytes(length, byteorder='little')
+        if encrypt:
+            mac.update(memoryview(result)[offset:offset + length])
+        counter += 1
+    return result, _poly1305_aead_finalize(mac, len(aad), len(data))
+
+
 def chacha20_aead_verify_tag(aad: bytes, key: bytes, iv: bytes, constant: bytes, ciphertext: bytes):
     digest = ciphertext[-16:]
-    ciphertext = ciphertext[:-16]
+    ciphertext = memoryview(ciphertext)[:-16]
+    return hmac.compare_digest(digest, _poly1305_tag(aad, key, constant + iv, ciphertext))
+
+
+class _PythonAeadContext:
+    """
+    The key bound variant of the reference implementation. The key dependent part of the chacha20 state is computed
+    only once.
+    """
+
+    def __init__(self, key: bytes):
+        self.key_words = _chacha20_key_words(key)
+
+    def encrypt(self, aad: bytes, nonce: bytes, plaintext: bytes) -> bytearray:
+        ciphertext, tag = _chacha20_poly1305(self.key_words, nonce, aad, plaintext, True)
+        ciphertext += tag
+        return ciphertext
+
+    def decrypt(self, aad: bytes, nonce: bytes, ciphertext: bytes):
+        digest = ciphertext[-16:]
+        plaintext, tag = _chacha20_poly1305(self.key_words, nonce, aad, memoryview(ciphertext)[:-16], False)
+        if not hmac.compare_digest(digest, tag):
+            return False
+        return plaintext
+
+
+class PythonAeadBackend:
+    """
+    The reference implementation of the chacha20 aead construction in pure python. It is always available but slow, so
+    it is only used if no other backend can be used.
+    """
+    name = 'python'
+
+    @staticmethod
+    def is_available() -> bool:
+        return True
+
+    @staticmethod
+    def context(key: bytes):
+        return _PythonAeadContext(key)
+
+    @staticmethod
+    def encrypt(aad: bytes, key: bytes, nonce: bytes, plaintext: bytes):
+        ciphertext, tag = _chacha20_poly1305(_chacha20_key_words(key), nonce, aad, plaintext, True)
+        return ciphertext, tag
+
+    @staticmethod
+    def decrypt(aad: bytes, key: bytes, nonce: bytes, ciphertext: bytes):
+        digest = ciphertext[-16:]
+        plaintext, tag = _chacha20_poly1305(_chacha20_key_words(key), nonce, aad, memoryview(ciphertext)[:-16], False)
+        if not hmac.compare_digest(digest, tag):
+            return False
+        return plaintext
+
+
+class _CryptographyAeadContext:
+    """
+    Keeps the ChaCha20Poly1305 object for one key so it is not created again for each frame.
+    """
 
-    nonce = constant + iv
-    otk = poly1305_key_gen(key, nonce)
-    mac_data = aad + pad16(aad)
-    assert len(mac_data) % 16 == 0
-    mac_data += ciphertext + pad16(ciphertext)
-    assert len(mac_data) % 16 == 0
-    mac_data += len(aad).to_bytes(length=8, byteorder='little')
-    mac_data += len(ciphertext).to_bytes(length=8, byteorder='little')
-    tag = poly1305_mac(mac_data, otk)
+    def __init__(self, key: bytes):
+        self.aead = ChaCha20Poly1305(key)
 
-    return digest == tag
+    def encrypt(self, aad: bytes, nonce: bytes, plaintext: bytes) -> bytes:
+        return self.aead.encrypt(nonce, bytes(plaintext), bytes(aad))
+
+    def decrypt(self, aad: bytes, nonce: bytes, ciphertext: bytes):
+        try:
+            return self.aead.decrypt(nonce, bytes(ciphertext), bytes(aad))
+        except InvalidTag:
+            return False
+
+
+class CryptographyAeadBackend:
+    """
+    Uses ChaCha20Poly1305 from the cryptography package which is backed by OpenSSL. The results are converted to the
+    same types the reference implementation returns (cipher text and plain text as bytearray, tag as bytes).
+    """
+    name = 'cryptography'
+
+    @staticmethod
+    def is_available() -> bool:
+        if ChaCha20Poly1305 is None:
+            return False
+        try:
+            # OpenSSL might have been built without chacha20 support
+            ChaCha20Poly1305(bytes(32))
+        except Exception:
+            return False
+        return True
+
+    @staticmethod
+    def context(key: bytes):
+        return _CryptographyAeadContext(key)
+
+    @staticmethod
+    def encrypt(aad: bytes, key: bytes, nonce: bytes, plaintext: bytes):
+        data = ChaCha20Poly1305(key).encrypt(nonce, bytes(plaintext), bytes(aad))
+        return bytearray(data[:-16]), data[-16:]
+
+    @staticmethod
+    def decrypt(aad: bytes, key: bytes, nonce: bytes, ciphertext: bytes):
+        try:
+            return bytearray(ChaCha20Poly1305(key).decrypt(nonce, bytes(ciphertext), bytes(aad)))
+        except InvalidTag:
+            return False
+
+
+# the registered backends in the order of preference
+_aead_backends = [CryptographyAeadBackend, PythonAeadBackend]
+_aead_backend = None
+
+
+def register_aead_backend(backend, position: int = 0):
+    """
+    Registers an additional backend for the chacha20 aead construction. A backend is a class or an object offering
+    name, is_available(), encrypt(aad, key, nonce, plaintext), decrypt(aad, key, nonce, ciphertext) and context(key)
+    in the same way PythonAeadBackend does. The object returned by context(key) offers encrypt(aad, nonce, plaintext)
+    and decrypt(aad, nonce, ciphertext) working on cipher text and tag as one bytes-like object.
+
+    :param backend: the backend to register
+    :param position: the position in the list of preferred backends (0 is the most preferred)
+    """
+    global _aead_backend
+    _aead_backends.insert(position, backend)
+    _aead_backend = None
+
+
+def available_aead_backends() -> list:
+    """
+    :return: the names of all registered backends that can be used on this system in the order of preference
+    """
+    return [backend.name for backend in _aead_backends if backend.is_available()]
+
+
+def set_aead_backend(name=None):
+    """
+    Forces the backend used by chacha20_aead_encrypt and chacha20_aead_decrypt (mostly useful for tests). The
+    environment variable HOMEKIT_AEAD_BACKEND can be used for the same purpose.
+
+    :param name: the name of the backend, None to restore the automatic selection
+    :raises ValueError: if the backend is not registered or not available
+    """
+    global _aead_backend
+    if name is None:
+        _aead_backend = None
+        return
+    for backend in _aead_backends:
+        if backend.name == name:
+            if not backend.is_available():
+                raise ValueError('AEAD backend "{n}" is not available'.format(n=name))
+            _aead_backend = backend
+            return
+    raise ValueError('Unknown AEAD backend "{n}"'.format(n=name))
+
+
+def get_aead_backend():
+    """
+    Returns the backend used by chacha20_aead_encrypt and chacha20_aead_decrypt. If none was forced, the first
+    available backend is selected.
+
+    :return: the backend
+    """
+    global _aead_backend
+    if _aead_backend is None:
+        forced = os.environ.get('HOMEKIT_AEAD_BACKEND')
+        if forced:
+            set_aead_backend(forced)
+        else:
+            _aead_backend = next(backend for backend in _aead_backends if backend.is_available())
+    return _aead_backend
 
 
 def chacha20_aead_encrypt(aad: bytes, key: bytes, iv: bytes, constant: bytes, plaintext: bytes):
@@ -270,18 +586,7 @@ def chacha20_aead_encrypt(aad: bytes, key: bytes, iv: bytes, constant: bytes, pl
     assert type(key) is bytes, 'key is no instance of bytes'
     assert len(key) == 32
 
-    nonce = constant + iv
-    otk = poly1305_key_gen(key, nonce)
-    ciphertext = chacha20_encrypt(key, 1, nonce, plaintext)
-    assert len(plaintext) == len(ciphertext)
-    mac_data = aad + pad16(aad)
-    assert len(mac_data) % 16 == 0
-    mac_data += ciphertext + pad16(ciphertext)
-    assert len(mac_data) % 16 == 0
-    mac_data += len(aad).to_bytes(length=8, byteorder='little')
-    mac_data += len(ciphertext).to_bytes(length=8, byteorder='little')
-    tag = poly1305_mac(mac_data, otk)
-    return ciphertext, tag
+    return get_aead_backend().encrypt(aad, key, constant + iv, plaintext)
 
 
 def chacha20_aead_decrypt(aad: bytes, key: bytes, iv: bytes, constant: bytes, ciphertext: bytes):
@@ -300,13 +605,4 @@ def chacha20_aead_decrypt(aad: bytes, key: bytes, iv: bytes, constant: bytes, ci
     assert type(key) is bytes, 'key is no instance of bytes'
     assert len(key) == 32
 
-    # break up on difference
-    if not chacha20_aead_verify_tag(aad, key, iv, constant, ciphertext):
-        return False
-
-    # decrypt and return
-    ciphertext = ciphertext[:-16]
-    nonce = constant + iv
-    plaintext = chacha20_encrypt(key, 1, nonce, ciphertext)
-    assert len(plaintext) == len(ciphertext)
-    return plaintext
+    return get_aead_backend().decrypt(aad, key, constant + iv, ciphertext)
@@ -0,0 +1,125 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Implements the per direction encryption of a secured HAP session. See HomeKit spec chapter 5.5.2 page 70 for IP and
+chapter 7.4.7.2 page 108 for Bluetooth LE.
+"""
+import struct
+
+from homekit.crypto.chacha20poly1305 import get_aead_backend
+
+
+class HapCipher:
+    """
+    Encrypts or decrypts the messages of one direction (either controller to accessory or accessory to controller) of
+    a secured session. The nonce is formed from 4 zero bytes and the 64 bit little endian message counter, which is
+    increased after each successfully handled message.
+    """
+
+    # maximum length of the plain text within one frame of the IP transport (see page 71)
+    MAX_FRAME_LENGTH = 1024
+
+    def __init__(self, key: bytes, backend=None):
+        """
+        Creates the cipher for one direction of a session.
+
+        :param key: the 256 bit key of the direction as obtained from get_session_keys
+        :param backend: the aead backend to use, defaults to the one selected by get_aead_backend
+        """
+        self.counter = 0
+        self._key = key
+        self._backend = backend
+        self._context = None
+        self._nonce = bytearray(12)
+
+    def _get_context(self):
+        # the backend's context is created on first use, so creating a session that never sends anything stays cheap
+        if self._context is None:
+            assert type(self._key) is bytes, 'key is no instance of bytes'
+            assert len(self._key) == 32
+            backend = self._backend if self._backend is not None else get_aead_backend()
+            self._context = backend.context(self._key)
+        return self._context
+
+    def _next_nonce(self) -> bytes:
+        struct.pack_into('<Q', self._nonce, 4, self.counter)
+        return bytes(self._nonce)
+
+    def encrypt(self, plaintext: bytes, aad: bytes = b'') -> bytes:
+        """
+        Encrypts the next message of this direction.
+
+        :param plaintext: the data to encrypt
+        :param aad: additional authenticated data
+        :return: cipher text and auth tag as one bytes-like object
+        """
+        data = self._get_context().encrypt(aad, self._next_nonce(), plaintext)
+        self.counter += 1
+        return data
+
+    def decrypt(self, ciphertext: bytes, aad: bytes = b''):
+        """
+        Verifies and decrypts the next message of this direction. The counter is only increased if the auth tag was
+        valid.
+
+        :param ciphertext: cipher text and auth tag
+        :param aad: additional authenticated data
+        :return: the plain text as bytes-like object or False if the auth tag could not be verified
+        """
+        data = self._get_context().decrypt(aad, self._next_nonce(), ciphertext)
+        if data is not False:
+            self.counter += 1
+        return data
+
+    def encrypt_frame(self, block: bytes) -> bytes:
+        """
+        Encrypts one frame of the IP transport. The frame consists of the 2 byte little endian length of the block
+        (which is used as aad), the encrypted block and the auth tag.
+
+        :param block: the plain text of the frame, at most MAX_FRAME_LENGTH bytes
+        :return: the frame ready to be sent
+        """
+        len_bytes = len(block).to_bytes(2, byteorder='little')
+        return len_bytes + self.encrypt(block, len_bytes)
+
+    def encrypt_frames(self, data: bytes) -> list:
+        """
+        Encrypts a whole message of the IP transport. The message is split into frames of at most MAX_FRAME_LENGTH
+        bytes without copying the plain text. The result is meant to be sent with a single scatter / gather write (see
+        homekit.http_impl.frame_writer.send_buffers).
+
+        :param data: the plain text of the message
+        :return: list of buffers, for each frame the 2 byte length followed by the encrypted block and the auth tag
+        """
+        view = memoryview(data)
+        buffers = []
+        for offset in range(0, len(view), HapCipher.MAX_FRAME_LENGTH):
+            block = view[offset:offset + HapCipher.MAX_FRAME_LENGTH]
+            len_bytes = len(block).to_bytes(2, byteorder='little')
+            buffers.append(len_bytes)
+            buffers.append(self.encrypt(block, len_bytes))
+        return buffers
+
+    def decrypt_frame(self, length: int, block_and_tag: bytes):
+        """
+        Verifies and decrypts one frame of the IP transport.
+
+        :param length: the length of the encrypted block as read from the frame's first 2 bytes
+        :param block_and_tag: the encrypted block followed by the auth tag
+        :return: the plain text or False if the auth tag could not be verified
+        """
+        return self.decrypt(block_and_tag, length.to_bytes(2, byteorder='little'))
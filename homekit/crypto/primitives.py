@@ -0,0 +1,187 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Implements the key derivation (HKDF-SHA-512, RFC 5869) and the Ed25519 signatures used by pair setup and pair verify
+(see HomeKit spec page 35). Ed25519 uses the cryptography package (OpenSSL) if it supports it and falls back to the
+ed25519 package otherwise. Parsed long term keys are cached, so they are not created again on each pair verify.
+"""
+import functools
+import hashlib
+import hmac
+
+import ed25519
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+except ImportError:
+    Ed25519PrivateKey = None
+    InvalidSignature = ed25519.BadSignatureError
+
+
+def _native_ed25519_supported() -> bool:
+    if Ed25519PrivateKey is None:
+        return False
+    try:
+        # OpenSSL might have been built without ed25519 support
+        Ed25519PrivateKey.generate()
+    except Exception:
+        return False
+    return True
+
+
+NATIVE_ED25519_SUPPORTED = _native_ed25519_supported()
+
+
+def hkdf_sha512_expand(salt: bytes, ikm: bytes, infos: list, length: int = 32) -> list:
+    """
+    Derives one key per info from the same input key material. The extract step is done only once for all of them.
+
+    :param salt: the salt as bytes
+    :param ikm: the input key material (e.g. a shared secret)
+    :param infos: list of the info values as bytes
+    :param length: the length of each derived key in bytes
+    :return: list of the derived keys in the order of infos
+    """
+    prk = hmac.new(bytes(salt), bytes(ikm), hashlib.sha512).digest()
+    keys = []
+    for info in infos:
+        okm = b''
+        block = b''
+        counter = 1
+        while len(okm) < length:
+            block = hmac.new(prk, block + bytes(info) + bytes([counter]), hashlib.sha512).digest()
+            okm += block
+            counter += 1
+        keys.append(okm[:length])
+    return keys
+
+
+def hkdf_sha512(salt: bytes, ikm: bytes, info: bytes, length: int = 32) -> bytes:
+    """
+    Derives a key with HKDF-SHA-512.
+
+    :param salt: the salt as bytes
+    :param ikm: the input key material (e.g. a shared secret)
+    :param info: the info as bytes
+    :param length: the length of the derived key in bytes
+    :return: the derived key
+    """
+    return hkdf_sha512_expand(salt, ikm, [info], length)[0]
+
+
+class Ed25519SigningKey:
+    """
+    An Ed25519 private key created from its 32 byte seed.
+    """
+
+    def __init__(self, seed: bytes):
+        """
+        :param seed: the 32 byte seed (longer values like seed and public key are cut to 32 bytes)
+        """
+        seed = bytes(seed[:32])
+        if NATIVE_ED25519_SUPPORTED:
+            self._key = Ed25519PrivateKey.from_private_bytes(seed)
+            self.public_key = self._key.public_key().public_bytes(encoding=serialization.Encoding.Raw,
+                                                                  format=serialization.PublicFormat.Raw)
+        else:
+            self._key = ed25519.SigningKey(seed)
+            self.public_key = self._key.get_verifying_key().to_bytes()
+        self.seed = seed
+
+    def sign(self, data: bytes) -> bytes:
+        """
+        :param data: the data to sign
+        :return: the 64 byte signature
+        """
+        return self._key.sign(bytes(data))
+
+
+class Ed25519VerifyingKey:
+    """
+    An Ed25519 public key.
+    """
+
+    def __init__(self, public_key: bytes):
+        """
+        :param public_key: the 32 byte public key
+        """
+        self.public_key = bytes(public_key)
+        if NATIVE_ED25519_SUPPORTED:
+            self._key = Ed25519PublicKey.from_public_bytes(self.public_key)
+        else:
+            self._key = ed25519.VerifyingKey(self.public_key)
+
+    def verify(self, signature: bytes, data: bytes) -> bool:
+        """
+        :param signature: the 64 byte signature
+        :param data: the signed data
+        :return: True if the signature is valid, False otherwise
+        """
+        try:
+            self._key.verify(bytes(signature), bytes(data))
+        except (InvalidSignature, ed25519.BadSignatureError, ValueError):
+            # ValueError e.g. for signatures of the wrong length
+            return False
+        return True
+
+
+@functools.lru_cache(maxsize=32)
+def _signing_key(seed: bytes) -> Ed25519SigningKey:
+    return Ed25519SigningKey(seed)
+
+
+@functools.lru_cache(maxsize=64)
+def _verifying_key(public_key: bytes) -> Ed25519VerifyingKey:
+    return Ed25519VerifyingKey(public_key)
+
+
+def get_signing_key(seed: bytes) -> Ed25519SigningKey:
+    """
+    Returns the signing key for a long term secret key. The parsed key is cached.
+
+    :param seed: the 32 byte seed of the key (e.g. iOSDeviceLTSK of the pairing data)
+    :return: the Ed25519SigningKey
+    """
+    return _signing_key(bytes(seed[:32]))
+
+
+def get_verifying_key(public_key: bytes) -> Ed25519VerifyingKey:
+    """
+    Returns the verifying key for a long term public key. The parsed key is cached.
+
+    :param public_key: the 32 byte public key (e.g. AccessoryLTPK of the pairing data)
+    :return: the Ed25519VerifyingKey
+    """
+    return _verifying_key(bytes(public_key))
+
+
+def create_ed25519_keypair():
+    """
+    Creates a new Ed25519 key pair.
+
+    :return: tuple of the 32 byte seed and the 32 byte public key
+    """
+    if NATIVE_ED25519_SUPPORTED:
+        seed = Ed25519PrivateKey.generate().private_bytes(encoding=serialization.Encoding.Raw,
+                                                          format=serialization.PrivateFormat.Raw,
+                                                          encryption_algorithm=serialization.NoEncryption())
+    else:
+        seed = ed25519.create_keypair()[0].to_seed()
+    key = Ed25519SigningKey(seed)
+    return key.seed, key.public_key
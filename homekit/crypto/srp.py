@@ -23,14 +23,17 @@ https://tools.ietf.org/html/rfc5054. See HomeKit spec page 36 for adjustments im
 import crypt
 import math
 import hashlib
+import threading
 
 
-class Srp:
-    def __init__(self):
-        # generator as defined by 3072bit group of RFC 5054
-        self.g = int(b'5', 16)
-        # modulus as defined by 3072bit group of RFC 5054
-        self.n = int(b'''\
+def _to_byte_array(num: int) -> bytearray:
+    return bytearray(num.to_bytes(int(math.ceil(num.bit_length() / 8)), "big"))
+
+
+# generator as defined by 3072bit group of RFC 5054
+_G = int(b'5', 16)
+# modulus as defined by 3072bit group of RFC 5054
+_N = int(b'''\
 FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E08\
 8A67CC74020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B\
 302B0A6DF25F14374FE1356D6D51C245E485B576625E7EC6F44C42E9\
@@ -45,6 +48,68 @@ B3970F85A6E1E4C7ABF5AE8CDB0933D71E8C94E04A25619DCEE3D226\
 1AD2EE6BF12FFA06D98A0864D87602733EC86A64521F2B18177B200C\
 BBE117577A615D6C770988C0BAD946E208E24FA074E5AB3143DB5BFC\
 E0FD108E4B82D120A93AD2CAFFFFFFFFFFFFFFFF''', 16)
+# k = H(N | PAD(g)) (see https://tools.ietf.org/html/rfc5054#section-2.5.3), HomeKit requires SHA-512 (See page 36)
+_K = int.from_bytes(hashlib.sha512(_to_byte_array(_N) + bytearray.fromhex(383 * '00' + '05')).digest(), "big")
+# H(N) xor H(g) as used in the proof of the client
+_HN_XOR_HG = bytes(a ^ b for (a, b) in zip(hashlib.sha512(_to_byte_array(_N)).digest(),
+                                           hashlib.sha512(_to_byte_array(_G)).digest()))
+
+
+class _FixedBaseExp:
+    """
+    Computes base^x mod modulus for a fixed base with a precomputed table of base^(j * 2^(window * i)). An
+    exponentiation then only needs one multiplication per window of the exponent and no squarings. The table is
+    built on first use and covers exponents of up to max_bits bits, larger exponents fall back to pow.
+    """
+
+    def __init__(self, base: int, modulus: int, max_bits: int = 512, window: int = 4):
+        self.base = base
+        self.modulus = modulus
+        self.max_bits = max_bits
+        self.window = window
+        self._table = None
+        self._lock = threading.Lock()
+
+    def _build_table(self) -> list:
+        with self._lock:
+            if self._table is None:
+                table = []
+                b = self.base
+                for i in range(0, (self.max_bits + self.window - 1) // self.window):
+                    row = [1, b]
+                    for j in range(2, 1 << self.window):
+                        row.append(row[-1] * b % self.modulus)
+                    table.append(row)
+                    b = row[-1] * b % self.modulus
+                self._table = table
+            return self._table
+
+    def pow(self, x: int) -> int:
+        if x < 0 or x.bit_length() > self.max_bits:
+            return pow(self.base, x, self.modulus)
+        table = self._table if self._table is not None else self._build_table()
+        mask = (1 << self.window) - 1
+        result = 1
+        i = 0
+        while x:
+            digit = x & mask
+            if digit:
+                result = result * table[i][digit] % self.modulus
+            x >>= self.window
+            i += 1
+        return result
+
+
+# all of g^a, g^b and g^x have the generator as base
+_G_EXP = _FixedBaseExp(_G, _N)
+
+
+class Srp:
+    def __init__(self):
+        # generator as defined by 3072bit group of RFC 5054
+        self.g = _G
+        # modulus as defined by 3072bit group of RFC 5054
+        self.n = _N
         # HomeKit requires SHA-512 (See page 36)
         self.h = hashlib.sha512
         self.A = None
@@ -52,6 +117,14 @@ E0FD108E4B82D120A93AD2CAFFFFFFFFFFFFFFFF''', 16)
         self.salt = None
         self.username = None
         self.password = None
+        self._reset_exchange()
+
+    def _reset_exchange(self):
+        # shared secret, session key and the client's proof only depend on the values of the current exchange so they
+        # are computed once and forgotten as soon as one of the public values or the salt changes
+        self._shared_secret = None
+        self._session_key = None
+        self._client_proof = None
 
     @staticmethod
     def generate_private_key():
@@ -64,14 +137,8 @@ E0FD108E4B82D120A93AD2CAFFFFFFFFFFFFFFFF''', 16)
         return int.from_bytes(private_key, "big")
 
     def _calculate_k(self) -> int:
-        # calculate k (see https://tools.ietf.org/html/rfc5054#section-2.5.3)
-        hash_instance = self.h()
-        n = Srp.to_byte_array(self.n)
-        g = bytearray.fromhex((383 * '00' + '05'))  # 383 * b'0' + '5'.encode()
-        hash_instance.update(n)
-        hash_instance.update(g)
-        k = int.from_bytes(hash_instance.digest(), "big")
-        return k
+        # k is a constant of the group (see https://tools.ietf.org/html/rfc5054#section-2.5.3)
+        return _K
 
     def _calculate_u(self) -> int:
         if self.A is None:
@@ -87,14 +154,15 @@ E0FD108E4B82D120A93AD2CAFFFFFFFFFFFFFFFF''', 16)
         return u
 
     def get_session_key(self) -> int:
-        hash_instance = self.h()
-        hash_instance.update(Srp.to_byte_array(self.get_shared_secret()))
-        hash_value = int.from_bytes(hash_instance.digest(), "big")
-        return hash_value
+        if self._session_key is None:
+            hash_instance = self.h()
+            hash_instance.update(Srp.to_byte_array(self.get_shared_secret()))
+            self._session_key = int.from_bytes(hash_instance.digest(), "big")
+        return self._session_key
 
     @staticmethod
     def to_byte_array(num: int) -> bytearray:
-        return bytearray(num.to_bytes(int(math.ceil(num.bit_length() / 8)), "big"))
+        return _to_byte_array(num)
 
     def _calculate_x(self) -> int:
         i = (self.username + ':' + self.password).encode()
@@ -109,8 +177,38 @@ E0FD108E4B82D120A93AD2CAFFFFFFFFFFFFFFFF''', 16)
         return int.from_bytes(hash_instance.digest(), "big")
 
     def get_shared_secret(self):
+        if self._shared_secret is None:
+            self._shared_secret = self._calculate_shared_secret()
+        return self._shared_secret
+
+    def _calculate_shared_secret(self) -> int:
         raise NotImplementedError()
 
+    def _calculate_client_proof(self) -> int:
+        # M1 = H(H(N) xor H(g), H(I), s, A, B, K) (see page 36)
+        if self._client_proof is None:
+            hash_instance = self.h()
+            hash_instance.update(self.username.encode())
+            hu = hash_instance.digest()
+
+            hash_instance = self.h()
+            hash_instance.update(_HN_XOR_HG)
+            hash_instance.update(hu)
+            hash_instance.update(Srp.to_byte_array(self.salt))
+            hash_instance.update(Srp.to_byte_array(self.A))
+            hash_instance.update(Srp.to_byte_array(self.B))
+            hash_instance.update(Srp.to_byte_array(self.get_session_key()))
+            self._client_proof = int.from_bytes(hash_instance.digest(), "big")
+        return self._client_proof
+
+    def _calculate_server_proof(self, m: int) -> int:
+        # M2 = H(A, M1, K)
+        hash_instance = self.h()
+        hash_instance.update(Srp.to_byte_array(self.A))
+        hash_instance.update(Srp.to_byte_array(m))
+        hash_instance.update(Srp.to_byte_array(self.get_session_key()))
+        return int.from_bytes(hash_instance.digest(), "big")
+
 
 class SrpClient(Srp):
     """
@@ -122,7 +220,7 @@ class SrpClient(Srp):
         self.password = password
         self.salt = None
         self.a = self.generate_private_key()
-        self.A = pow(self.g, self.a, self.n)
+        self.A = _G_EXP.pow(self.a)
         self.B = None
 
     def set_salt(self, salt):
@@ -130,23 +228,24 @@ class SrpClient(Srp):
             self.salt = int.from_bytes(salt, "big")
         else:
             self.salt = salt
+        self._reset_exchange()
 
     def get_public_key(self):
-        return pow(self.g, self.a, self.n)
+        return self.A
 
     def set_server_public_key(self, B):
         if isinstance(B, bytearray):
             self.B = int.from_bytes(B, "big")
         else:
             self.B = B
+        self._reset_exchange()
 
-    def get_shared_secret(self):
+    def _calculate_shared_secret(self):
         if self.B is None:
             raise RuntimeError('Server\'s public key is missing')
         u = self._calculate_u()
         x = self._calculate_x()
-        k = self._calculate_k()
-        tmp1 = (self.B - (k * pow(self.g, x, self.n)))
+        tmp1 = (self.B - (_K * _G_EXP.pow(x)))
         tmp2 = (self.a + (u * x))  # % self.n
         S = pow(tmp1, tmp2, self.n)
         return S
@@ -154,43 +253,14 @@ class SrpClient(Srp):
     def get_proof(self):
         if self.B is None:
             raise RuntimeError('Server\'s public key is missing')
-
-        hash_instance = self.h()
-        hash_instance.update(Srp.to_byte_array(self.n))
-        hN = bytearray(hash_instance.digest())
-
-        hash_instance = self.h()
-        hash_instance.update(Srp.to_byte_array(self.g))
-        hg = bytearray(hash_instance.digest())
-
-        for index in range(0, len(hN)):
-            hN[index] ^= hg[index]
-
-        u = self.username.encode()
-        hash_instance = self.h()
-        hash_instance.update(u)
-        hu = hash_instance.digest()
-        K = Srp.to_byte_array(self.get_session_key())
-
-        hash_instance = self.h()
-        hash_instance.update(hN)
-        hash_instance.update(hu)
-        hash_instance.update(Srp.to_byte_array(self.salt))
-        hash_instance.update(Srp.to_byte_array(self.A))
-        hash_instance.update(Srp.to_byte_array(self.B))
-        hash_instance.update(K)
-        return int.from_bytes(hash_instance.digest(), "big")
+        return self._calculate_client_proof()
 
     def verify_servers_proof(self, M):
         if isinstance(M, bytearray):
             tmp = int.from_bytes(M, "big")
         else:
             tmp = M
-        hash_instance = self.h()
-        hash_instance.update(Srp.to_byte_array(self.A))
-        hash_instance.update(Srp.to_byte_array(self.get_proof()))
-        hash_instance.update(Srp.to_byte_array(self.get_session_key()))
-        return tmp == int.from_bytes(hash_instance.digest(), "big")
+        return tmp == self._calculate_server_proof(self.get_proof())
 
 
 class SrpServer(Srp):
@@ -204,9 +274,7 @@ class SrpServer(Srp):
         self.password = password
         self.verifier = self._get_verifier()
         self.b = self.generate_private_key()
-        k = self._calculate_k()
-        g_b = pow(self.g, self.b, self.n)
-        self.B = (k * self.verifier + g_b) % self.n
+        self.B = (_K * self.verifier + _G_EXP.pow(self.b)) % self.n
         self.A = None
 
     @staticmethod
@@ -219,20 +287,20 @@ class SrpServer(Srp):
 
     def _get_verifier(self) -> int:
         hash_value = self._calculate_x()
-        v = pow(self.g, hash_value, self.n)
+        v = _G_EXP.pow(hash_value)
         return v
 
     def set_client_public_key(self, A):
         self.A = A
+        self._reset_exchange()
 
     def get_salt(self):
         return self.salt
 
     def get_public_key(self):
-        k = self._calculate_k()
-        return (k * self.verifier + pow(self.g, self.b, self.n)) % self.n
+        return self.B
 
-    def get_shared_secret(self):
+    def _calculate_shared_secret(self):
         if self.A is None:
             raise RuntimeError('Client\'s public key is missing')
 
@@ -242,36 +310,7 @@ class SrpServer(Srp):
     def verify_clients_proof(self, m) -> bool:
         if self.B is None:
             raise RuntimeError('Server\'s public key is missing')
-
-        hash_instance = self.h()
-        hash_instance.update(Srp.to_byte_array(self.n))
-        hN = bytearray(hash_instance.digest())
-
-        hash_instance = self.h()
-        hash_instance.update(Srp.to_byte_array(self.g))
-        hg = bytearray(hash_instance.digest())
-
-        for index in range(0, len(hN)):
-            hN[index] ^= hg[index]
-
-        u = self.username.encode()
-        hash_instance = self.h()
-        hash_instance.update(u)
-        hu = hash_instance.digest()
-        K = Srp.to_byte_array(self.get_session_key())
-
-        hash_instance = self.h()
-        hash_instance.update(hN)
-        hash_instance.update(hu)
-        hash_instance.update(Srp.to_byte_array(self.salt))
-        hash_instance.update(Srp.to_byte_array(self.A))
-        hash_instance.update(Srp.to_byte_array(self.B))
-        hash_instance.update(K)
-        return m == int.from_bytes(hash_instance.digest(), "big")
+        return m == self._calculate_client_proof()
 
     def get_proof(self, m) -> int:
-        hash_instance = self.h()
-        hash_instance.update(Srp.to_byte_array(self.A))
-        hash_instance.update(Srp.to_byte_array(m))
-        hash_instance.update(Srp.to_byte_array(self.get_session_key()))
-        return int.from_bytes(hash_instance.digest(), "big")
+        return self._calculate_server_proof(m)
@@ -198,6 +198,15 @@ class AccessoryDisconnectedError(HomeKitException):
         Exception.__init__(self, message)
 
 
+class AccessoryTimeoutError(HomeKitException):
+    """
+    Used if an accessory did not answer within the given time. The request may still complete later.
+    """
+
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+
 class ConfigLoadingError(HomeKitException):
     """
     Used on problems loading some config. This includes but may not be limited to:
@@ -0,0 +1,257 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+The asyncio variant of SecureHttp. It works on asyncio streams, so no thread is held per session.
+"""
+import asyncio
+import logging
+from collections import deque
+
+from homekit import exceptions
+from homekit.crypto.hap_cipher import HapCipher
+from homekit.http_impl import HttpContentTypes
+from homekit.http_impl.request import RequestBuilder
+from homekit.http_impl.response import HttpResponse
+
+logger = logging.getLogger('homekit.http_impl.async_secure_http')
+
+
+async def plain_request(reader, writer, host: str, port: int, target: str, body: bytes,
+                        content_type=HttpContentTypes.TLV) -> HttpResponse:
+    """
+    Sends an unencrypted POST request and reads its response, as used for pair setup and pair verify.
+
+    :param reader: the asyncio StreamReader of the connection
+    :param writer: the asyncio StreamWriter of the connection
+    :param host: the host of the accessory
+    :param port: the port of the accessory
+    :param target: the target, e.g. /pair-verify
+    :param body: the body
+    :param content_type: the content type of the body
+    :return: the HttpResponse
+    :raises AccessoryDisconnectedError: if the connection was closed before the response was complete
+    """
+    writer.write(RequestBuilder(host, port).build('POST', target, body, content_type))
+    await writer.drain()
+    response = HttpResponse()
+    while not response.is_read_completely():
+        data = await reader.read(65536)
+        if not data:
+            raise exceptions.AccessoryDisconnectedError('Connection closed by the peer')
+        response.parse(data)
+    return response
+
+
+class EventStream:
+    """
+    Asynchronous iterator over the EVENT messages of an AsyncSecureHttp session. The iteration ends when the session
+    is closed and raises AccessoryDisconnectedError or EncryptionError if the connection broke.
+    """
+
+    def __init__(self, http, maxsize: int = 100):
+        """
+        :param http: the AsyncSecureHttp session
+        :param maxsize: how many unconsumed events are kept, older ones are dropped
+        """
+        self._http = http
+        self._queue = asyncio.Queue(maxsize)
+
+    def _put(self, response):
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(response)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> HttpResponse:
+        response = await self._queue.get()
+        if response is None:
+            # keep the marker for later calls
+            self._queue.put_nowait(None)
+            if self._http._error is None:
+                raise StopAsyncIteration
+            raise self._http._error
+        return response
+
+    def close(self):
+        """
+        Stops receiving events with this stream.
+        """
+        self._http._remove_stream(self)
+        self._put(None)
+
+
+class AsyncSecureHttp:
+    """
+    Sends HTTP requests over a secured HAP session (see chapter 5.5 page 70ff of the HAP specification) using asyncio
+    streams. Like SecureHttp, requests are pipelined: a reader task assigns the responses to the requests in the order
+    the requests were sent and hands EVENT messages to the EventStreams of the session.
+    """
+
+    def __init__(self, reader, writer, c2a_key: bytes, a2c_key: bytes, host: str, port: int, timeout=10):
+        """
+        Must be created while the event loop is running.
+
+        :param reader: the asyncio StreamReader of the connection
+        :param writer: the asyncio StreamWriter of the connection
+        :param c2a_key: the key used for the communication between controller and accessory
+        :param a2c_key: the key used for the communication between accessory and controller
+        :param host: the host of the accessory (for the Host header)
+        :param port: the port of the accessory (for the Host header)
+        :param timeout: the number of seconds to wait for a response
+        """
+        self.reader = reader
+        self.writer = writer
+        self.requests = RequestBuilder(host, port)
+        self.timeout = timeout
+        self.c2a_cipher = HapCipher(c2a_key)
+        self.a2c_cipher = HapCipher(a2c_key)
+        self._pending = deque()
+        self._streams = []
+        self._error = None
+        self._closed = False
+        self._reader_task = asyncio.ensure_future(self._read_loop())
+
+    def is_connected(self) -> bool:
+        """
+        :return: False if the session was closed or the connection broke
+        """
+        return self._error is None and not self._closed
+
+    async def get(self, target):
+        return await self.request('GET', target)
+
+    async def put(self, target, body, content_type=HttpContentTypes.JSON):
+        return await self.request('PUT', target, body, content_type)
+
+    async def post(self, target, body, content_type=HttpContentTypes.TLV):
+        return await self.request('POST', target, body, content_type)
+
+    async def request(self, method, target, body=None, content_type=HttpContentTypes.JSON) -> HttpResponse:
+        """
+        Sends a request and waits for its response.
+
+        :param method: the HTTP method, e.g. GET
+        :param target: the target, e.g. /accessories
+        :param body: the body as str or bytes-like object, None if the request has no body
+        :param content_type: the content type of the body
+        :return: the HttpResponse, an empty HttpResponse (code is None) if it did not arrive within the timeout
+        :raises AccessoryDisconnectedError: if the connection is broken
+        :raises EncryptionError: if a frame could not be decrypted
+        """
+        if not self.is_connected():
+            raise exceptions.AccessoryDisconnectedError(str(self._error) if self._error else 'Session closed')
+        data = self.requests.build(method, target, body, content_type)
+        logger.debug('sending %s %s (%d bytes)', method, target, len(data))
+        future = asyncio.get_event_loop().create_future()
+        # writing is not interrupted by other tasks, so the order of the pending futures is the order on the wire
+        self._pending.append(future)
+        self.writer.write(b''.join(self.c2a_cipher.encrypt_frames(data)))
+        try:
+            await self.writer.drain()
+        except OSError as e:
+            self._fail(exceptions.AccessoryDisconnectedError(str(e)))
+        try:
+            # a future that timed out is cancelled, its response is dropped when it arrives
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            return HttpResponse()
+
+    def events(self, maxsize: int = 100) -> EventStream:
+        """
+        Creates a stream of the EVENT messages received from now on.
+
+        :param maxsize: how many unconsumed events are kept, older ones are dropped
+        :return: the EventStream
+        """
+        stream = EventStream(self, maxsize)
+        if self.is_connected():
+            self._streams.append(stream)
+        else:
+            stream._put(None)
+        return stream
+
+    def _remove_stream(self, stream):
+        if stream in self._streams:
+            self._streams.remove(stream)
+
+    def close(self):
+        """
+        Closes the connection. Pending requests fail, event streams end.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._reader_task.cancel()
+        self.writer.close()
+        self._finish(exceptions.AccessoryDisconnectedError('Session closed'))
+
+    async def _read_response(self) -> HttpResponse:
+        # the frames are read as described on page 71: 2 bytes little endian length of the encrypted data (max 1024
+        # bytes), the encrypted data and the 16 byte auth tag. The StreamReader buffers, so this does not cause a
+        # system call per read.
+        response = HttpResponse()
+        while not response.is_read_completely():
+            length = int.from_bytes(await self.reader.readexactly(2), byteorder='little')
+            if length > HapCipher.MAX_FRAME_LENGTH:
+                raise exceptions.EncryptionError('Frame length {} is out of range'.format(length))
+            block_and_tag = await self.reader.readexactly(length + 16)
+            decrypted = self.a2c_cipher.decrypt_frame(length, block_and_tag)
+            if decrypted is False:
+                raise exceptions.EncryptionError('Error during transmission.')
+            response.parse(decrypted)
+        return response
+
+    async def _read_loop(self):
+        try:
+            while True:
+                self._dispatch(await self._read_response())
+        except exceptions.EncryptionError as e:
+            self.writer.close()
+            self._fail(e)
+        except asyncio.IncompleteReadError:
+            self._fail(exceptions.AccessoryDisconnectedError('Connection closed by the peer'))
+        except (OSError, exceptions.HttpException) as e:
+            self._fail(exceptions.AccessoryDisconnectedError(str(e)))
+
+    def _dispatch(self, response):
+        logger.debug('received %s message with status %s', response.get_http_name(), response.code)
+        if response.get_http_name() == 'EVENT':
+            for stream in self._streams:
+                stream._put(response)
+            return
+        if not self._pending:
+            logger.debug('dropping unexpected response with status %s', response.code)
+            return
+        future = self._pending.popleft()
+        if not future.done():
+            future.set_result(response)
+
+    def _fail(self, error):
+        if self._error is None and not self._closed:
+            self._error = error
+        self._finish(error)
+
+    def _finish(self, error):
+        pending, self._pending = self._pending, deque()
+        for future in pending:
+            if not future.done():
+                future.set_exception(error)
+        streams, self._streams = self._streams, []
+        for stream in streams:
+            stream._put(None)
@@ -0,0 +1,112 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Reads encrypted HAP messages from sockets. The socket is read into one preallocated buffer with as much data per
+recv_into call as is available, so frames that arrived together are decrypted without further system calls.
+"""
+import select
+
+from homekit.crypto.hap_cipher import HapCipher
+from homekit.exceptions import AccessoryDisconnectedError, EncryptionError
+
+# 2 bytes length, the block and the 16 bytes auth tag (see HomeKit spec chapter 5.5.2 page 71)
+MAX_FRAME_SIZE = 2 + HapCipher.MAX_FRAME_LENGTH + 16
+
+
+class FrameReader:
+    """
+    Reads and decrypts the frames of the IP transport from a socket. The socket is switched to non blocking mode, data
+    that was already received is used first and the reader only waits if no complete frame is buffered. Bytes that were
+    received beyond the returned frame are kept for the next call, so messages following each other (e.g. a response
+    and an event) are not mixed up.
+    """
+
+    def __init__(self, sock, cipher, buffer_size: int = 64 * 1024):
+        """
+        :param sock: the socket to read from
+        :param cipher: the HapCipher of the receiving direction
+        :param buffer_size: the size of the receive buffer, at least MAX_FRAME_SIZE
+        """
+        assert buffer_size >= MAX_FRAME_SIZE
+        self.sock = sock
+        self.cipher = cipher
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        # the unread data is self._buffer[self._start:self._end]
+        self._start = 0
+        self._end = 0
+        sock.setblocking(False)
+
+    def buffered(self) -> int:
+        """
+        :return: the number of received bytes that were not returned as frames yet
+        """
+        return self._end - self._start
+
+    def _frame_size(self) -> int:
+        # the size of the first buffered frame or 0 if not even its length was received completely
+        if self._end - self._start < 2:
+            return 0
+        return self._buffer[self._start] + (self._buffer[self._start + 1] << 8) + 18
+
+    def _fill(self, timeout: float) -> bool:
+        if len(self._buffer) - self._end < MAX_FRAME_SIZE:
+            # not enough space for a whole frame at the end, so the unread part is moved to the front
+            length = self._end - self._start
+            self._view[:length] = self._view[self._start:self._end]
+            self._start = 0
+            self._end = length
+        while True:
+            try:
+                received = self.sock.recv_into(self._view[self._end:])
+                break
+            except (BlockingIOError, InterruptedError):
+                if not select.select([self.sock], [], [], timeout)[0]:
+                    return False
+        if received == 0:
+            raise AccessoryDisconnectedError('Connection closed by the peer')
+        self._end += received
+        return True
+
+    def read_frame(self, timeout: float):
+        """
+        Returns the plain text of the next frame. Buffered data is used first, the socket is only read if the buffer
+        does not contain a complete frame.
+
+        :param timeout: the number of seconds to wait for more data
+        :return: the plain text as bytes-like object or None if no complete frame arrived within the timeout
+        :raises AccessoryDisconnectedError: if the connection was closed
+        :raises EncryptionError: if the frame could not be decrypted
+        :raises OSError: if reading the socket failed
+        """
+        while True:
+            size = self._frame_size()
+            if size > MAX_FRAME_SIZE:
+                raise EncryptionError('Frame length {} is out of range'.format(size - 18))
+            if 0 < size <= self._end - self._start:
+                break
+            if not self._fill(timeout):
+                return None
+
+        start = self._start
+        self._start += size
+        if self._start == self._end:
+            self._start = self._end = 0
+        plaintext = self.cipher.decrypt_frame(size - 18, self._view[start + 2:start + size])
+        if plaintext is False:
+            raise EncryptionError('Error during transmission.')
+        return plaintext
@@ -0,0 +1,78 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Writes encrypted HAP messages to sockets. All frames of a message are handed to the kernel with as few sendmsg calls
+as possible instead of one send per frame.
+"""
+import os
+import select
+import socket
+
+try:
+    _IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 1024
+if _IOV_MAX <= 0:
+    _IOV_MAX = 1024
+
+# how long to wait for a non blocking socket to become writable again
+WRITE_TIMEOUT = 10
+
+
+def send_buffers(sock, buffers: list):
+    """
+    Sends all buffers in order over the socket. Partial writes are continued and if the socket is non blocking, this
+    waits until it is writable again.
+
+    :param sock: the socket
+    :param buffers: list of bytes-like objects
+    :raises OSError: if sending fails, socket.timeout if the socket did not become writable within WRITE_TIMEOUT
+    """
+    buffers = [memoryview(b) for b in buffers if len(b) > 0]
+    if not hasattr(sock, 'sendmsg'):
+        # e.g. on windows
+        sock.sendall(b''.join(buffers))
+        return
+
+    index = 0
+    while index < len(buffers):
+        try:
+            sent = sock.sendmsg(buffers[index:index + _IOV_MAX])
+        except (BlockingIOError, InterruptedError):
+            if not select.select([], [sock], [], WRITE_TIMEOUT)[1]:
+                raise socket.timeout('socket not writable')
+            continue
+        # skip the buffers that were sent completely and keep the rest of a partially sent one
+        while sent > 0:
+            length = len(buffers[index])
+            if sent < length:
+                buffers[index] = buffers[index][sent:]
+                break
+            sent -= length
+            index += 1
+
+
+def write_frames(sock, cipher, data: bytes):
+    """
+    Encrypts a message as frames of the IP transport (see HomeKit spec chapter 5.5.2 page 71) and sends all of them at
+    once.
+
+    :param sock: the socket
+    :param cipher: the HapCipher of the sending direction
+    :param data: the plain text of the message
+    """
+    send_buffers(sock, cipher.encrypt_frames(data))
@@ -0,0 +1,61 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Builds the HTTP requests sent to HomeKit accessories as bytes. Bodies are copied into the request as they are, so
+binary TLV bodies are not altered.
+"""
+
+
+class RequestBuilder:
+    """
+    Builds requests for one accessory. The header lines that are the same for all requests (Host and the
+    Content-Type lines) are encoded once and reused.
+    """
+
+    def __init__(self, host: str, port: int):
+        """
+        :param host: the host of the accessory
+        :param port: the port of the accessory
+        """
+        # the Host header is required by some accessories, e.g. the tado internet bridge
+        self._host_line = 'Host: {h}:{p}\r\n'.format(h=host, p=port).encode()
+        self._content_type_lines = {}
+
+    def _content_type_line(self, content_type: str) -> bytes:
+        line = self._content_type_lines.get(content_type)
+        if line is None:
+            line = 'Content-Type: {ct}\r\n'.format(ct=content_type).encode()
+            self._content_type_lines[content_type] = line
+        return line
+
+    def build(self, method: str, target: str, body=None, content_type=None) -> bytes:
+        """
+        Creates a request.
+
+        :param method: the HTTP method, e.g. GET
+        :param target: the target, e.g. /accessories
+        :param body: the body as bytes-like object or str (which is encoded as UTF-8), None if the request has no body
+        :param content_type: the content type of the body
+        :return: the request as bytes
+        """
+        request_line = '{m} {t} HTTP/1.1\r\n'.format(m=method, t=target).encode()
+        if body is None:
+            return b''.join((request_line, self._host_line, b'\r\n'))
+        if isinstance(body, str):
+            body = body.encode()
+        return b''.join((request_line, self._host_line, self._content_type_line(content_type),
+                         'Content-Length: {len}\r\n\r\n'.format(len=len(body)).encode(), body))
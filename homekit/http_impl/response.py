@@ -18,17 +18,31 @@ from homekit.exceptions import HttpException
 
 
 class HttpResponse(object):
+    """
+    Incremental parser for HTTP responses (and EVENT messages) as received from accessories. The received data is kept
+    in one buffer with a read offset, so each byte is looked at only once even if a response arrives in many small
+    parts (e.g. large chunked responses from esp-homekit based devices).
+    """
     STATE_PRE_STATUS = 0
     STATE_HEADERS = 1
     STATE_BODY = 2
     STATE_DONE = 3
 
+    # the consumed part of the buffer is only dropped if it is at least this large and more than half of the buffer
+    COMPACT_THRESHOLD = 4096
+
     def __init__(self):
         self._state = HttpResponse.STATE_PRE_STATUS
-        self._raw_response = bytearray()
+        self._buffer = bytearray()
+        # offset of the first byte that was not consumed yet
+        self._pos = 0
+        # offset where the next search for a line end starts
+        self._search_from = 0
         self._is_ready = False
         self._is_chunked = False
         self._had_empty_chunk = False
+        # remaining bytes of the current chunk (including its trailing CRLF) or -1 if a chunk size line is expected
+        self._chunk_remaining = -1
         self._content_length = -1
         self.version = None
         self.code = None
@@ -37,62 +51,145 @@ class HttpResponse(object):
         self.body = bytearray()
 
     def parse(self, part):
-        self._raw_response += part
-        pos = self._raw_response.find(b'\r\n')
-        while pos != -1:
-            line = self._raw_response[:pos]
-            self._raw_response = self._raw_response[pos + 2:]
-            if self._state == HttpResponse.STATE_PRE_STATUS:
-                # parse status line
-                line = line.split(b' ', 2)
-                if len(line) != 3:
-                    raise HttpException('Malformed status line.')
-                self.version = line[0].decode()
-                self.code = int(line[1])
-                self.reason = line[2].decode()
-                self._state = HttpResponse.STATE_HEADERS
-
-            elif self._state == HttpResponse.STATE_HEADERS and line == b'':
-                # this is the empty line after the headers
-                self._state = HttpResponse.STATE_BODY
-
-            elif self._state == HttpResponse.STATE_HEADERS:
-                # parse a header line
-                line = line.split(b':', 1)
-                name = line[0].decode()
-                value = line[1].decode().strip()
-                if name == 'Transfer-Encoding':
-                    if value == 'chunked':
-                        self._is_chunked = True
-                elif name == 'Content-Length':
-                    self._content_length = int(value)
-                self.headers.append((name, value))
-
-            elif self._state == HttpResponse.STATE_BODY:
+        """
+        Feeds the next part of the received data into the parser.
+
+        :param part: the received bytes
+        :raises HttpException: if the data is no valid HTTP response
+        """
+        self._buffer += part
+        while self._pos < len(self._buffer) and self._state != HttpResponse.STATE_DONE:
+            if self._state == HttpResponse.STATE_BODY:
                 if self._is_chunked:
-                    length = int(line, 16)
-                    if length + 2 > len(self._raw_response):
-                        self._raw_response = line + b'\r\n' + self._raw_response
-                        # the remaining bytes in raw response are not sufficient. bail out and wait for an other call.
-                        break
-                    if length == 0:
-                        self._had_empty_chunk = True
-                        self._state = HttpResponse.STATE_DONE
-                        self._raw_response = self._raw_response[length + 2:]
-                    else:
-                        line = self._raw_response[:length]
-                        self.body += line
-                        self._raw_response = self._raw_response[length + 2:]
-                if self._content_length > -1:
-                    self.body += self._raw_response
-                    self._raw_response = bytearray()
-            else:
-                raise HttpException('Unknown parser state')
+                    self._parse_chunks()
+                else:
+                    self._parse_body()
+                break
+            line = self._read_line()
+            if line is None:
+                break
+            self._parse_line(line)
+        self._compact()
+
+    def _read_line(self):
+        end = self._buffer.find(b'\r\n', self._search_from)
+        if end == -1:
+            # the CR of a line end might be the last byte so far
+            self._search_from = max(self._pos, len(self._buffer) - 1)
+            return None
+        line = bytes(self._buffer[self._pos:end])
+        self._pos = end + 2
+        self._search_from = self._pos
+        return line
+
+    def _compact(self):
+        if self._pos == len(self._buffer):
+            self._buffer.clear()
+        elif self._pos < HttpResponse.COMPACT_THRESHOLD or 2 * self._pos < len(self._buffer):
+            return
+        else:
+            del self._buffer[:self._pos]
+        self._search_from -= self._pos
+        self._pos = 0
+
+    def _parse_line(self, line: bytes):
+        if self._state == HttpResponse.STATE_PRE_STATUS:
+            # parse status line
+            line = line.split(b' ', 2)
+            if len(line) != 3:
+                raise HttpException('Malformed status line.')
+            self.version = line[0].decode()
+            self.code = int(line[1])
+            self.reason = line[2].decode()
+            self._state = HttpResponse.STATE_HEADERS
 
-            pos = self._raw_response.find(b'\r\n')
+        elif self._state == HttpResponse.STATE_HEADERS and line == b'':
+            # this is the empty line after the headers
+            self._state = HttpResponse.STATE_BODY
 
-        if self._state == HttpResponse.STATE_BODY and self._content_length > 0:
-            self.body = self._raw_response
+        elif self._state == HttpResponse.STATE_HEADERS:
+            # parse a header line
+            line = line.split(b':', 1)
+            if len(line) != 2:
+                raise HttpException('Malformed header line.')
+            name = line[0].decode()
+            value = line[1].decode().strip()
+            if name == 'Transfer-Encoding':
+                if value == 'chunked':
+                    self._is_chunked = True
+            elif name == 'Content-Length':
+                self._content_length = int(value)
+            self.headers.append((name, value))
+        else:
+            raise HttpException('Unknown parser state')
+
+    def _parse_body(self):
+        # body with known or unknown length, everything that belongs to it is moved over at once
+        length = len(self._buffer) - self._pos
+        if self._content_length > -1:
+            length = min(length, self._content_length - len(self.body))
+        self.body += self._buffer[self._pos:self._pos + length]
+        self._pos += length
+        self._search_from = self._pos
+        if len(self.body) == self._content_length:
+            self._state = HttpResponse.STATE_DONE
+
+    def _parse_chunks(self):
+        # this is the hot path for large chunked responses, so the state is kept in local variables
+        buffer = self._buffer
+        body = self.body
+        pos = self._pos
+        search_from = self._search_from
+        remaining = self._chunk_remaining
+        size = len(buffer)
+        while pos < size:
+            if remaining > 0:
+                if remaining > 2:
+                    # data of the current chunk
+                    length = min(size - pos, remaining - 2)
+                    body += buffer[pos:pos + length]
+                    pos += length
+                    remaining -= length
+                    if remaining > 2:
+                        break
+                # the CRLF after the chunk's data
+                if size - pos < 2:
+                    break
+                if buffer[pos:pos + 2] != b'\r\n':
+                    raise HttpException('Malformed chunk.')
+                pos += 2
+                search_from = pos
+                remaining = -1
+                continue
+
+            end = buffer.find(b'\r\n', search_from)
+            if end == -1:
+                # the CR of a line end might be the last byte so far
+                search_from = max(pos, size - 1)
+                break
+            line = buffer[pos:end]
+            pos = search_from = end + 2
+            if self._had_empty_chunk:
+                # trailer after the last chunk, the response ends with an empty line
+                if line == b'':
+                    self._state = HttpResponse.STATE_DONE
+                    break
+                continue
+            # chunk size line, chunk extensions are ignored
+            try:
+                length = int(line, 16)
+            except ValueError:
+                try:
+                    length = int(line.split(b';', 1)[0], 16)
+                except ValueError:
+                    raise HttpException('Malformed chunk size line.')
+            if length == 0:
+                self._had_empty_chunk = True
+            else:
+                remaining = length + 2
+        self._pos = pos
+        self._search_from = search_from
+        self._chunk_remaining = remaining
 
     def read(self):
         """
@@ -102,9 +199,18 @@ class HttpResponse(object):
         """
         return self.body
 
+    def body_view(self) -> memoryview:
+        """
+        Returns the body of the response without copying it. The view must be released (or dropped) before further
+        data is parsed, since the body can not grow while it is exported.
+
+        :return: memoryview of the body read so far
+        """
+        return memoryview(self.body)
+
     def is_read_completely(self):
         if self._is_chunked:
-            return self._had_empty_chunk
+            return self._state == HttpResponse.STATE_DONE
         if self.code == 204:
             return True
         if self._content_length != -1:
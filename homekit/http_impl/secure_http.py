@@ -14,161 +14,331 @@
 # limitations under the License.
 #
 
+import logging
+import queue
+import socket
 import threading
-import select
+from collections import deque
 
 from homekit.http_impl.response import HttpResponse
-from homekit.crypto.chacha20poly1305 import chacha20_aead_encrypt, chacha20_aead_decrypt
+from homekit.crypto.hap_cipher import HapCipher
 from homekit.http_impl import HttpContentTypes
+from homekit.http_impl.frame_reader import FrameReader
+from homekit.http_impl.frame_writer import write_frames
+from homekit.http_impl.request import RequestBuilder
 from homekit import exceptions
+from homekit.log_support import DIAGNOSTICS
+
+logger = logging.getLogger('homekit.http_impl.secure_http')
+
+
+class PendingResponse:
+    """
+    The response to a request that was sent on a SecureHttp session. It is filled in by the session's reader thread.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._response = None
+        self._error = None
+        self.abandoned = False
+
+    def _set(self, response=None, error=None):
+        self._response = response
+        self._error = error
+        self._done.set()
+
+    def done(self) -> bool:
+        """
+        :return: True if the response was received or the request failed
+        """
+        return self._done.is_set()
+
+    def result(self, timeout=None) -> HttpResponse:
+        """
+        Waits for the response.
+
+        :param timeout: the number of seconds to wait, None to wait forever
+        :return: the HttpResponse, an empty HttpResponse (code is None) if it did not arrive within the timeout
+        :raises AccessoryDisconnectedError: if the connection broke before the response arrived
+        :raises EncryptionError: if a frame could not be decrypted
+        """
+        if not self._done.wait(timeout):
+            # the response will still arrive at some point and must be consumed to keep the order, but nobody is
+            # interested in it any more
+            self.abandoned = True
+            return HttpResponse()
+        if self._error is not None:
+            raise self._error
+        return self._response
 
 
 class SecureHttp:
     """
     Class to help in the handling of HTTP requests and responses that are performed following chapter 5.5 page 70ff of
     the HAP specification.
+
+    Requests may be sent from several threads at once. They are written to the connection without waiting for the
+    responses of earlier requests. A reader thread assigns the responses to the requests in the order the requests
+    were sent (as in HTTP/1.1 pipelining) and hands EVENT messages to the event listeners and to
+    handle_event_response.
+
+    If external_reader is set before the first request, no reader thread is started. The socket is then watched by
+    someone else (e.g. the selector loop of an EventHub) who calls read_available once it is readable.
     """
 
+    # how many unconsumed events are kept for handle_event_response, older ones are dropped
+    EVENT_QUEUE_SIZE = 100
+
+    # how long the reader thread waits for data before checking whether the session was closed
+    IDLE_TIMEOUT = 1
+
     def __init__(self, session, timeout=10):
         """
         Initializes the secure HTTP class. The required keys can be obtained with get_session_keys
 
-        :param sock: the socket over which the communication takes place
-        :param a2c_key: the key used for the communication between accessory and controller
-        :param c2a_key: the key used for the communication between controller and accessory
+        :param session: the session with the socket over which the communication takes place (sock), the keys for
+                        both directions (a2c_key, c2a_key) and the pairing data
+        :param timeout: the number of seconds to wait for a response
         """
         self.sock = session.sock
         self.host = session.pairing_data['AccessoryIP']
         self.port = session.pairing_data['AccessoryPort']
-        self.a2c_key = session.a2c_key
-        self.c2a_key = session.c2a_key
-        self.c2a_counter = 0
-        self.a2c_counter = 0
+        self.requests = RequestBuilder(self.host, self.port)
+        self.c2a_cipher = HapCipher(session.c2a_key)
+        self.a2c_cipher = HapCipher(session.a2c_key)
+        self.reader = FrameReader(self.sock, self.a2c_cipher)
         self.timeout = timeout
+        # protects sending and the order of the pending responses
         self.lock = threading.Lock()
+        self._pending = deque()
+        self._events = queue.Queue(SecureHttp.EVENT_QUEUE_SIZE)
+        self._event_listeners = []
+        self._disconnect_listeners = []
+        self._error = None
+        self._closed = False
+        self._reader_thread = None
+        # the partly received message while reading with read_available
+        self._partial = None
+        self.external_reader = False
 
     def get(self, target):
-        data = 'GET {tgt} HTTP/1.1\nHost: {host}:{port}\n\n'.format(tgt=target, host=self.host, port=self.port)
-        return self._handle_request(data)
+        return self._handle_request(self.requests.build('GET', target))
 
     def put(self, target, body, content_type=HttpContentTypes.JSON):
-        headers = 'Host: {host}:{port}\n'.format(host=self.host, port=self.port) + \
-                  'Content-Type: {ct}\n'.format(ct=content_type) + \
-                  'Content-Length: {len}\n'.format(len=len(body))
-        data = 'PUT {tgt} HTTP/1.1\n{hdr}\n{body}'.format(tgt=target, hdr=headers, body=body)
-        return self._handle_request(data)
+        return self._handle_request(self.requests.build('PUT', target, body, content_type))
 
     def post(self, target, body, content_type=HttpContentTypes.TLV):
-        headers = 'Host: {host}:{port}\n'.format(host=self.host, port=self.port) + \
-                  'Content-Type: {ct}\n'.format(ct=content_type) + \
-                  'Content-Length: {len}\n'.format(len=len(body))
-        data = 'POST {tgt} HTTP/1.1\n{hdr}\n{body}'.format(tgt=target, hdr=headers, body=body)
-
-        return self._handle_request(data)
+        return self._handle_request(self.requests.build('POST', target, body, content_type))
 
     def _handle_request(self, data):
-        with self.lock:
-            data = data.replace("\n", "\r\n")
-            while len(data) > 0:
-                # split the data to max 1024 bytes (see page 71)
-                len_data = min(len(data), 1024)
-                tmp_data = data[:len_data]
-                data = data[len_data:]
-                len_bytes = len_data.to_bytes(2, byteorder='little')
-                cnt_bytes = self.c2a_counter.to_bytes(8, byteorder='little')
-                self.c2a_counter += 1
-                ciper_and_mac = chacha20_aead_encrypt(len_bytes, self.c2a_key, cnt_bytes, bytes([0, 0, 0, 0]),
-                                                      tmp_data.encode())
+        return self.send(data).result(self.timeout)
 
-                try:
-                    self.sock.send(len_bytes + ciper_and_mac[0] + ciper_and_mac[1])
-                except OSError as e:
-                    raise exceptions.AccessoryDisconnectedError(str(e))
+    def send(self, data) -> PendingResponse:
+        """
+        Sends a request without waiting for its response.
 
-            return self._read_response(self.timeout)
+        :param data: the complete request as bytes (see RequestBuilder)
+        :return: the PendingResponse to wait for the response
+        :raises AccessoryDisconnectedError: if the connection is broken
+        """
+        pending = PendingResponse()
+        with self.lock:
+            if self._error is not None:
+                raise exceptions.AccessoryDisconnectedError(str(self._error))
+            if self._reader_thread is None and not self.external_reader:
+                self._reader_thread = threading.Thread(target=self._read_loop, name='SecureHttp reader', daemon=True)
+                self._reader_thread.start()
+            if DIAGNOSTICS and logger.isEnabledFor(logging.DEBUG):
+                logger.debug('sending %s (%d bytes)', data.split(b'\r\n', 1)[0].decode(), len(data))
+            # the response might arrive before write_frames returns
+            self._pending.append(pending)
+            # the message is split to frames of max 1024 bytes (see page 71) which are sent all at once
+            try:
+                write_frames(self.sock, self.c2a_cipher, data)
+                return pending
+            except OSError as e:
+                self._pending.remove(pending)
+                error = exceptions.AccessoryDisconnectedError(str(e))
+        # the connection can not be used any more, even if the reader did not notice yet
+        self._fail(error)
+        raise error
 
-    def _read_response(self, timeout=10):
-        # following the information from page 71 about HTTP Message splitting:
-        # The blocks start with 2 byte little endian defining the length of the encrypted data (max 1024 bytes)
-        # followed by 16 byte authTag
-        tmp = bytearray()
-        exp_len = 1024
-        response = HttpResponse()
-        while not response.is_read_completely():
-            # make sure we read all blocks but without blocking to long. Was introduced to support chunked transfer mode
-            # from https://github.com/maximkulkin/esp-homekit
-            self.sock.setblocking(0)
+    def add_event_listener(self, listener):
+        """
+        Registers a function that is called with the HttpResponse of each EVENT message. It is called from the
+        reader thread and should return quickly.
 
-            no_data_remaining = (len(tmp) == 0)
+        :param listener: the function
+        """
+        self._event_listeners.append(listener)
 
-            # if there is no data use the long timeout so we don't miss anything, else since there is still data go on
-            # much quicker.
-            if no_data_remaining:
-                used_timeout = timeout
-            else:
-                used_timeout = 0.01
-            data_ready = select.select([self.sock], [], [], used_timeout)[0]
+    def remove_event_listener(self, listener):
+        """
+        :param listener: a function registered with add_event_listener
+        """
+        self._event_listeners.remove(listener)
 
-            # check if there is anything more to do
-            if not data_ready and no_data_remaining:
-                break
+    def add_disconnect_listener(self, listener):
+        """
+        Registers a function that is called without parameters once the connection broke. It is called from the
+        reader thread.
 
-            self.sock.settimeout(0.1)
+        :param listener: the function
+        """
+        self._disconnect_listeners.append(listener)
 
-            if len(tmp) == 0:
-                data = self.sock.recv(2)
-                tmp += data
-                continue
+    def is_connected(self) -> bool:
+        """
+        :return: False if the session was closed or the connection broke
+        """
+        return self._error is None and not self._closed
 
-            exp_len = int.from_bytes(tmp[0:2], 'little') - len(tmp) + 18
-            data = self.sock.recv(exp_len)
+    def close(self):
+        """
+        Stops the reader thread. The socket is shut down but not closed.
+        """
+        self._closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except (OSError, ValueError):
+            pass
+        if self.external_reader:
+            # nobody reads the socket any more to notice the shutdown
+            self._fail(exceptions.AccessoryDisconnectedError('Session closed'))
 
-            # ready but no data => continue
-            if not data and no_data_remaining:
-                continue
+    def read_available(self):
+        """
+        Reads the frames that were received so far without waiting and dispatches the complete messages like the
+        reader thread does. A message that was received partly is completed by later calls.
 
-            tmp += data
-            length = int.from_bytes(tmp[0:2], 'little')
-            if length + 18 > len(tmp):
-                # if the the amount of data in tmp is not length + 2 bytes for length + 16 bytes for the tag, the block
-                # is not complete yet
-                continue
-            tmp = tmp[2:]
+        :raises AccessoryDisconnectedError: if the connection broke, pending requests fail with the same error
+        :raises EncryptionError: if a frame could not be decrypted
+        """
+        try:
+            while True:
+                decrypted = self.reader.read_frame(0)
+                if decrypted is None:
+                    return
+                if self._partial is None:
+                    self._partial = HttpResponse()
+                self._partial.parse(decrypted)
+                if self._partial.is_read_completely():
+                    response, self._partial = self._partial, None
+                    logger.debug('received %s message with status %s', response.get_http_name(), response.code)
+                    self._dispatch(response)
+        except (OSError, ValueError, exceptions.HomeKitException, exceptions.HttpException) as e:
+            self._read_failed(e)
+            raise self._error
 
-            block = tmp[0:length]
-            tmp = tmp[length:]
+    def _read_loop(self):
+        try:
+            while not self._closed:
+                response = self._read_response(SecureHttp.IDLE_TIMEOUT)
+                if response is not None:
+                    self._dispatch(response)
+        except (OSError, ValueError, exceptions.HomeKitException, exceptions.HttpException) as e:
+            self._read_failed(e)
 
-            tag = tmp[0:16]
-            tmp = tmp[16:]
+    def _read_failed(self, error):
+        if isinstance(error, exceptions.EncryptionError):
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        elif not isinstance(error, exceptions.AccessoryDisconnectedError):
+            # ValueError if the socket was closed
+            error = exceptions.AccessoryDisconnectedError(str(error))
+        self._fail(error)
 
-            decrypted = self.decrypt_block(length, block, tag)
-            if decrypted is not False:
-                response.parse(decrypted)
-            else:
+    def _dispatch(self, response):
+        if response.get_http_name() == 'EVENT':
+            if self._events.full():
                 try:
-                    self.sock.close()
-                except OSError:
+                    self._events.get_nowait()
+                except queue.Empty:
                     pass
-                raise exceptions.EncryptionError('Error during transmission.')
+            self._events.put_nowait(response)
+            for listener in list(self._event_listeners):
+                try:
+                    listener(response)
+                except Exception:
+                    logger.exception('event listener failed')
+            return
+        with self.lock:
+            pending = self._pending.popleft() if self._pending else None
+        if pending is None:
+            logger.debug('dropping unexpected response with status %s', response.code)
+        elif not pending.abandoned:
+            pending._set(response)
+
+    def _fail(self, error):
+        with self.lock:
+            first = self._error is None
+            if first:
+                self._error = error
+            pending, self._pending = self._pending, deque()
+        for p in pending:
+            p._set(error=error)
+        if not first:
+            return
+        for listener in list(self._disconnect_listeners):
+            try:
+                listener()
+            except Exception:
+                logger.exception('disconnect listener failed')
+        # wake up handle_event_response
+        try:
+            self._events.put_nowait(None)
+        except queue.Full:
+            pass
 
+    def _read_response(self, timeout=10):
+        # following the information from page 71 about HTTP Message splitting:
+        # The blocks start with 2 byte little endian defining the length of the encrypted data (max 1024 bytes)
+        # followed by 16 byte authTag. The reader only waits for data if no complete block was received yet, this
+        # supports the chunked transfer mode from https://github.com/maximkulkin/esp-homekit without polling.
+        response = HttpResponse()
+        # the status line might be split over several frames, so the response code is no sign of a started message
+        received = False
+        while not response.is_read_completely():
+            decrypted = self.reader.read_frame(timeout)
+            if decrypted is None:
+                if not received:
+                    return None
+                # the rest of a started message is waited for until the session is closed
+                if self._closed:
+                    return None
+                continue
+            received = True
+            response.parse(decrypted)
+
+        logger.debug('received %s message with status %s', response.get_http_name(), response.code)
         return response
 
     def decrypt_block(self, length, block, tag):
-        tmp = chacha20_aead_decrypt(length.to_bytes(2, byteorder='little'),
-                                    self.a2c_key,
-                                    self.a2c_counter.to_bytes(8, byteorder='little'),
-                                    bytes([0, 0, 0, 0]), block + tag)
-        if tmp is not False:
-            self.a2c_counter += 1
-
-        return tmp
+        return self.a2c_cipher.decrypt_frame(length, block + tag)
 
     def handle_event_response(self):
         """
-        This reads the enciphered response from an accessory after registering for events.
-        :return: the event data as string (not as json object)
+        This returns the next EVENT message received from an accessory after registering for events. It waits at most
+        one second.
+
+        :return: the event as HttpResponse, an empty HttpResponse if no event arrived
+        :raises AccessoryDisconnectedError: if the connection is broken
         """
         try:
-            return self._read_response(1)
-        except OSError as e:
-            raise exceptions.AccessoryDisconnectedError(str(e))
+            response = self._events.get(timeout=1)
+        except queue.Empty:
+            response = None if self._error is not None else HttpResponse()
+        if response is None:
+            # keep the marker for later calls
+            try:
+                self._events.put_nowait(None)
+            except queue.Full:
+                pass
+            error = self._error
+            if isinstance(error, exceptions.EncryptionError):
+                raise error
+            raise exceptions.AccessoryDisconnectedError(str(error))
+        return response
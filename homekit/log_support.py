@@ -15,6 +15,12 @@
 #
 
 import logging
+import os
+
+# Diagnostics are the debug messages of the protocol hot paths that need expensive formatting (e.g. decoding a TLV
+# only to log it). If this is False, they are skipped before even checking the log level. It is False if python runs
+# with -O or the environment variable HOMEKIT_DIAGNOSTICS is set to 0 when homekit is imported.
+DIAGNOSTICS = __debug__ and os.environ.get('HOMEKIT_DIAGNOSTICS', '1') != '0'
 
 
 def setup_logging(level):
@@ -38,3 +44,35 @@ def add_log_arguments(parser):
     :param parser: The argparse.ArgumentParser object to add to.
     """
     parser.add_argument('--log', action='store', dest='loglevel')
+
+
+class LazyFormat:
+    """
+    Defers computing a log message argument until the record is actually formatted. Use it for arguments of debug
+    messages that are expensive to convert, e.g.
+        logger.debug('data: %s', LazyFormat(TLV.to_string, data))
+    """
+    __slots__ = ('function', 'args')
+
+    def __init__(self, function, *args):
+        """
+        :param function: called with args to get the value to log
+        :param args: the arguments for the function
+        """
+        self.function = function
+        self.args = args
+
+    def __str__(self):
+        return str(self.function(*self.args))
+
+
+def _to_hex(data) -> str:
+    return bytes([int(b) for b in data]).hex() if isinstance(data, list) else bytes(data).hex()
+
+
+def lazy_hex(data) -> LazyFormat:
+    """
+    :param data: bytes-like object or list of ints (e.g. as returned by dbus)
+    :return: a log message argument that is formatted as hex string only if the message is emitted
+    """
+    return LazyFormat(_to_hex, data)
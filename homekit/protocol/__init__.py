@@ -14,21 +14,21 @@
 # limitations under the License.
 #
 
-import hashlib
-import ed25519
-import hkdf
 from binascii import hexlify
 import logging
 
 from cryptography.hazmat.primitives.asymmetric import x25519
 from cryptography.hazmat.primitives import serialization
 
-from homekit.protocol.tlv import TLV
+from homekit.protocol.tlv import TLV, TlvMessage
 from homekit.exceptions import IncorrectPairingIdError, InvalidAuthTagError, InvalidSignatureError, UnavailableError, \
     AuthenticationError, InvalidError, BusyError, MaxTriesError, MaxPeersError, BackoffError
 
 import homekit.exceptions
+from homekit.log_support import DIAGNOSTICS, LazyFormat
 from homekit.crypto import chacha20_aead_decrypt, chacha20_aead_encrypt, SrpClient
+from homekit.crypto.primitives import hkdf_sha512, hkdf_sha512_expand, get_signing_key, get_verifying_key, \
+    create_ed25519_keypair
 
 
 def error_handler(error, stage):
@@ -57,14 +57,15 @@ def error_handler(error, stage):
 
 def create_ip_pair_setup_write(connection):
     def write_http(request, expected):
-        logging.debug('write message: %s', TLV.to_string(TLV.decode_bytes(request)))
+        if DIAGNOSTICS and logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug('write message: %s', TLV.to_string(TLV.decode_bytes(request)))
         connection.putrequest('POST', '/pair-setup', skip_accept_encoding=True)
         connection.putheader('Content-Type', 'application/pairing+tlv8')
         connection.putheader('Content-Length', len(request))
         connection.endheaders(request)
         resp = connection.getresponse()
-        response_tlv = TLV.decode_bytes(resp.read(), expected)
-        logging.debug('response: %s', TLV.to_string(response_tlv))
+        response_tlv = TlvMessage(resp.read(), expected)
+        logging.debug('response: %s', LazyFormat(TLV.to_string, response_tlv))
         return response_tlv
 
     return write_http
@@ -72,14 +73,15 @@ def create_ip_pair_setup_write(connection):
 
 def create_ip_pair_verify_write(connection):
     def write_http(request, expected):
-        logging.debug('write message: %s', TLV.to_string(TLV.decode_bytes(request)))
+        if DIAGNOSTICS and logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug('write message: %s', TLV.to_string(TLV.decode_bytes(request)))
         connection.putrequest('POST', '/pair-verify', skip_accept_encoding=True)
         connection.putheader('Content-Type', 'application/pairing+tlv8')
         connection.putheader('Content-Length', len(request))
         connection.endheaders(request)
         resp = connection.getresponse()
-        response_tlv = TLV.decode_bytes(resp.read(), expected)
-        logging.debug('response: %s', TLV.to_string(response_tlv))
+        response_tlv = TlvMessage(resp.read(), expected)
+        logging.debug('response: %s', LazyFormat(TLV.to_string, response_tlv))
         return response_tlv
 
     return write_http
@@ -90,7 +92,7 @@ def perform_pair_setup_part1(write_fun):
     Performs a pair setup operation as described in chapter 4.7 page 39 ff.
 
     :param write_fun: a function that takes a bytes representation of a TLV, the expected keys as list and returns
-        decoded TLV as list
+        decoded TLV as TlvMessage or as list
     :return: a tuple of salt and server's public key
     :raises UnavailableError: if the device is already paired
     :raises MaxTriesError: if the device received more than 100 unsuccessful pairing attempts
@@ -110,25 +112,24 @@ def perform_pair_setup_part1(write_fun):
     ])
 
     step2_expectations = [TLV.kTLVType_State, TLV.kTLVType_Error, TLV.kTLVType_PublicKey, TLV.kTLVType_Salt]
-    response_tlv = write_fun(request_tlv, step2_expectations)
+    response_tlv = TlvMessage.of(write_fun(request_tlv, step2_expectations))
 
     #
     # Step #3 ios --> accessory (send SRP verify request) (see page 41)
     #
     logging.debug('#3 ios -> accessory: send SRP verify request')
-    response_tlv = TLV.reorder(response_tlv, step2_expectations)
-    assert response_tlv[0][0] == TLV.kTLVType_State and response_tlv[0][1] == TLV.M2, 'perform_pair_setup: State not M2'
+    assert response_tlv.get(TLV.kTLVType_State) == TLV.M2, 'perform_pair_setup: State not M2'
 
     # the errors here can be:
     #  * kTLVError_Unavailable: Device is paired
     #  * kTLVError_MaxTries: More than 100 unsuccessful attempts
     #  * kTLVError_Busy: There is already a pairing going on
-    if response_tlv[1][0] == TLV.kTLVType_Error:
-        error_handler(response_tlv[1][1], 'step 3')
+    if TLV.kTLVType_Error in response_tlv:
+        error_handler(response_tlv[TLV.kTLVType_Error], 'step 3')
 
-    assert response_tlv[1][0] == TLV.kTLVType_PublicKey, 'perform_pair_setup: Not a public key'
-    assert response_tlv[2][0] == TLV.kTLVType_Salt, 'perform_pair_setup: Not a salt'
-    return response_tlv[2][1], response_tlv[1][1]
+    assert TLV.kTLVType_PublicKey in response_tlv, 'perform_pair_setup: Not a public key'
+    assert TLV.kTLVType_Salt in response_tlv, 'perform_pair_setup: Not a salt'
+    return response_tlv[TLV.kTLVType_Salt], response_tlv[TLV.kTLVType_PublicKey]
 
 
 def perform_pair_setup_part2(pin, ios_pairing_id, write_fun, salt, server_public_key):
@@ -138,7 +139,7 @@ def perform_pair_setup_part2(pin, ios_pairing_id, write_fun, salt, server_public
     :param pin: the setup code from the accessory
     :param ios_pairing_id: the id of the simulated ios device
     :param write_fun: a function that takes a bytes representation of a TLV, the expected keys as list and returns
-        decoded TLV as list
+        decoded TLV as TlvMessage or as list
     :return: a dict with the ios device's part of the pairing information
     :raises UnavailableError: if the device is already paired
     :raises MaxTriesError: if the device received more than 100 unsuccessful pairing attempts
@@ -161,7 +162,7 @@ def perform_pair_setup_part2(pin, ios_pairing_id, write_fun, salt, server_public
     ])
 
     step4_expectations = [TLV.kTLVType_State, TLV.kTLVType_Error, TLV.kTLVType_Proof]
-    response_tlv = write_fun(response_tlv, step4_expectations)
+    response_tlv = TlvMessage.of(write_fun(response_tlv, step4_expectations))
 
     #
     # Step #5 ios --> accessory (Exchange Request) (see page 43)
@@ -169,40 +170,36 @@ def perform_pair_setup_part2(pin, ios_pairing_id, write_fun, salt, server_public
     logging.debug('#5 ios -> accessory: send SRP exchange request')
 
     # M4 Verification (page 43)
-    response_tlv = TLV.reorder(response_tlv, step4_expectations)
-    assert response_tlv[0][0] == TLV.kTLVType_State and response_tlv[0][1] == TLV.M4, \
-        'perform_pair_setup: State not M4'
-    if response_tlv[1][0] == TLV.kTLVType_Error:
-        error_handler(response_tlv[1][1], 'step 5')
-
-    assert response_tlv[1][0] == TLV.kTLVType_Proof, 'perform_pair_setup: Not a proof'
-    if not srp_client.verify_servers_proof(response_tlv[1][1]):
+    assert response_tlv.get(TLV.kTLVType_State) == TLV.M4, 'perform_pair_setup: State not M4'
+    if TLV.kTLVType_Error in response_tlv:
+        error_handler(response_tlv[TLV.kTLVType_Error], 'step 5')
+
+    assert TLV.kTLVType_Proof in response_tlv, 'perform_pair_setup: Not a proof'
+    if not srp_client.verify_servers_proof(response_tlv[TLV.kTLVType_Proof]):
         raise AuthenticationError('Step #5: wrong proof!')
 
     # M5 Request generation (page 44)
     session_key = srp_client.get_session_key()
 
-    ios_device_ltsk, ios_device_ltpk = ed25519.create_keypair()
+    ios_device_ltsk, ios_device_ltpk = create_ed25519_keypair()
 
     # reversed:
     #   Pair-Setup-Encrypt-Salt instead of Pair-Setup-Controller-Sign-Salt
     #   Pair-Setup-Encrypt-Info instead of Pair-Setup-Controller-Sign-Info
-    hkdf_inst = hkdf.Hkdf('Pair-Setup-Controller-Sign-Salt'.encode(), SrpClient.to_byte_array(session_key),
-                          hash=hashlib.sha512)
-    ios_device_x = hkdf_inst.expand('Pair-Setup-Controller-Sign-Info'.encode(), 32)
+    ios_device_x = hkdf_sha512('Pair-Setup-Controller-Sign-Salt'.encode(), SrpClient.to_byte_array(session_key),
+                               'Pair-Setup-Controller-Sign-Info'.encode())
 
-    hkdf_inst = hkdf.Hkdf('Pair-Setup-Encrypt-Salt'.encode(), SrpClient.to_byte_array(session_key),
-                          hash=hashlib.sha512)
-    session_key = hkdf_inst.expand('Pair-Setup-Encrypt-Info'.encode(), 32)
+    session_key = hkdf_sha512('Pair-Setup-Encrypt-Salt'.encode(), SrpClient.to_byte_array(session_key),
+                              'Pair-Setup-Encrypt-Info'.encode())
 
     ios_device_pairing_id = ios_pairing_id.encode()
-    ios_device_info = ios_device_x + ios_device_pairing_id + ios_device_ltpk.to_bytes()
+    ios_device_info = ios_device_x + ios_device_pairing_id + ios_device_ltpk
 
-    ios_device_signature = ios_device_ltsk.sign(ios_device_info)
+    ios_device_signature = get_signing_key(ios_device_ltsk).sign(ios_device_info)
 
     sub_tlv = [
         (TLV.kTLVType_Identifier, ios_device_pairing_id),
-        (TLV.kTLVType_PublicKey, ios_device_ltpk.to_bytes()),
+        (TLV.kTLVType_PublicKey, ios_device_ltpk),
         (TLV.kTLVType_Signature, ios_device_signature)
     ]
     sub_tlv_b = TLV.encode_list(sub_tlv)
@@ -222,64 +219,104 @@ def perform_pair_setup_part2(pin, ios_pairing_id, write_fun, salt, server_public
     body = TLV.encode_list(response_tlv)
 
     step6_expectations = [TLV.kTLVType_State, TLV.kTLVType_Error, TLV.kTLVType_EncryptedData]
-    response_tlv = write_fun(body, step6_expectations)
+    response_tlv = TlvMessage.of(write_fun(body, step6_expectations))
 
     #
     # Step #7 ios (Verification) (page 47)
     #
-    response_tlv = TLV.reorder(response_tlv, step6_expectations)
-    assert response_tlv[0][0] == TLV.kTLVType_State and response_tlv[0][1] == TLV.M6, 'perform_pair_setup: State not M6'
-    if response_tlv[1][0] == TLV.kTLVType_Error:
-        error_handler(response_tlv[1][1], 'step 7')
+    assert response_tlv.get(TLV.kTLVType_State) == TLV.M6, 'perform_pair_setup: State not M6'
+    if TLV.kTLVType_Error in response_tlv:
+        error_handler(response_tlv[TLV.kTLVType_Error], 'step 7')
 
-    assert response_tlv[1][0] == TLV.kTLVType_EncryptedData, 'perform_pair_setup: No encrypted data'
+    assert TLV.kTLVType_EncryptedData in response_tlv, 'perform_pair_setup: No encrypted data'
     decrypted_data = chacha20_aead_decrypt(bytes(), session_key, 'PS-Msg06'.encode(), bytes([0, 0, 0, 0]),
-                                           response_tlv[1][1])
+                                           response_tlv[TLV.kTLVType_EncryptedData])
     if decrypted_data is False:
         raise homekit.exception.IllegalData('step 7')
 
-    response_tlv = TLV.decode_bytearray(decrypted_data)
-    response_tlv = TLV.reorder(response_tlv, [TLV.kTLVType_Identifier, TLV.kTLVType_PublicKey, TLV.kTLVType_Signature])
+    response_tlv = TlvMessage(decrypted_data)
 
-    assert response_tlv[2][0] == TLV.kTLVType_Signature, 'perform_pair_setup: No signature'
-    accessory_sig = response_tlv[2][1]
+    assert TLV.kTLVType_Signature in response_tlv, 'perform_pair_setup: No signature'
+    accessory_sig = response_tlv[TLV.kTLVType_Signature]
 
-    assert response_tlv[0][0] == TLV.kTLVType_Identifier, 'perform_pair_setup: No identifier'
-    accessory_pairing_id = response_tlv[0][1]
+    assert TLV.kTLVType_Identifier in response_tlv, 'perform_pair_setup: No identifier'
+    accessory_pairing_id = response_tlv[TLV.kTLVType_Identifier]
 
-    assert response_tlv[1][0] == TLV.kTLVType_PublicKey, 'perform_pair_setup: No public key'
-    accessory_ltpk = response_tlv[1][1]
+    assert TLV.kTLVType_PublicKey in response_tlv, 'perform_pair_setup: No public key'
+    accessory_ltpk = response_tlv[TLV.kTLVType_PublicKey]
 
-    hkdf_inst = hkdf.Hkdf('Pair-Setup-Accessory-Sign-Salt'.encode(),
-                          SrpClient.to_byte_array(srp_client.get_session_key()),
-                          hash=hashlib.sha512)
-    accessory_x = hkdf_inst.expand('Pair-Setup-Accessory-Sign-Info'.encode(), 32)
+    accessory_x = hkdf_sha512('Pair-Setup-Accessory-Sign-Salt'.encode(),
+                              SrpClient.to_byte_array(srp_client.get_session_key()),
+                              'Pair-Setup-Accessory-Sign-Info'.encode())
 
     accessory_info = accessory_x + accessory_pairing_id + accessory_ltpk
 
-    e25519s = ed25519.VerifyingKey(bytes(response_tlv[1][1]))
-    try:
-        e25519s.verify(bytes(accessory_sig), bytes(accessory_info))
-    except AssertionError:
+    if not get_verifying_key(accessory_ltpk).verify(accessory_sig, accessory_info):
         raise InvalidSignatureError('step #7')
 
     return {
-        'AccessoryPairingID': response_tlv[0][1].decode(),
-        'AccessoryLTPK': hexlify(response_tlv[1][1]).decode(),
+        'AccessoryPairingID': accessory_pairing_id.decode(),
+        'AccessoryLTPK': hexlify(accessory_ltpk).decode(),
         'iOSPairingId': ios_pairing_id,
-        'iOSDeviceLTSK': ios_device_ltsk.to_ascii(encoding='hex').decode()[:64],
-        'iOSDeviceLTPK': hexlify(ios_device_ltpk.to_bytes()).decode()
+        'iOSDeviceLTSK': hexlify(ios_device_ltsk).decode(),
+        'iOSDeviceLTPK': hexlify(ios_device_ltpk).decode()
     }
 
 
-def get_session_keys(conn, pairing_data, write_fun):
+def get_control_keys(shared_secret: bytes):
+    """
+    Derives the keys to secure the session from the shared secret of a pair verify (see page 51).
+
+    :param shared_secret: the shared secret of pair verify or pair resume
+    :return: tuple of the session keys (controller_to_accessory_key and accessory_to_controller_key)
+    """
+    controller_to_accessory_key, accessory_to_controller_key = hkdf_sha512_expand(
+        'Control-Salt'.encode(), shared_secret,
+        ['Control-Write-Encryption-Key'.encode(), 'Control-Read-Encryption-Key'.encode()])
+    return controller_to_accessory_key, accessory_to_controller_key
+
+
+def get_resume_session_id(shared_secret: bytes) -> bytes:
+    """
+    Derives the 8 byte id under which both sides store a session after a successful pair verify, so it can be resumed
+    later on.
+
+    :param shared_secret: the shared secret of pair verify or pair resume
+    :return: the session id
+    """
+    return hkdf_sha512('Pair-Verify-ResumeSessionID-Salt'.encode(), shared_secret,
+                       'Pair-Verify-ResumeSessionID-Info'.encode(), 8)
+
+
+def get_resume_key(shared_secret: bytes, ios_key_pub: bytes, session_id: bytes, info: str) -> bytes:
+    """
+    Derives the keys used during pair resume from the shared secret of the resumed session. The controller's new
+    curve25519 public key and the session id are used as salt.
+
+    :param shared_secret: the shared secret of the resumed session
+    :param ios_key_pub: the controller's curve25519 public key sent with the resume request
+    :param session_id: the session id (the resumed one for the request, the new one for the response)
+    :param info: one of 'Pair-Resume-Request-Info', 'Pair-Resume-Response-Info' and 'Pair-Resume-Shared-Secret-Info'
+    :return: the 32 byte key
+    """
+    return hkdf_sha512(bytes(ios_key_pub) + bytes(session_id), shared_secret, info.encode())
+
+
+def get_session_keys(conn, pairing_data, write_fun, session_cache=None):
     """
     HomeKit Controller side call to perform a pair verify operation as described in chapter 4.8 page 47 ff.
 
+    If a session cache is given and it contains a session with the accessory, the session is resumed: the request
+    contains the session id and the keys are derived from the cached shared secret after one round trip. If the
+    accessory does not know the session anymore, it answers like to a normal pair verify request and the full pair
+    verify is done. If it rejects the resume with an error instead, a normal pair verify is started on the same
+    connection. In all cases the new session is added to the cache.
+
     :param conn: the http_impl connection to the target accessory
     :param pairing_data: the paring data as returned by perform_pair_setup
     :param write_fun: a function that takes a bytes representation of a TLV, the expected keys as list and returns
-        decoded TLV as list
+        decoded TLV as TlvMessage or as list
+    :param session_cache: a SessionCache to resume sessions from and store the established session in (optional)
     :return: tuple of the session keys (controller_to_accessory_key and  accessory_to_controller_key)
     :raises InvalidAuthTagError: if the auth tag could not be verified,
     :raises IncorrectPairingIdError: if the accessory's LTPK could not be found
@@ -299,71 +336,111 @@ def get_session_keys(conn, pairing_data, write_fun):
         format=serialization.PublicFormat.Raw
     )
 
-    request_tlv = TLV.encode_list([
+    verify_request_tlv = TLV.encode_list([
         (TLV.kTLVType_State, TLV.M1),
         (TLV.kTLVType_PublicKey, ios_key_pub)
     ])
+    step2_expectations = [TLV.kTLVType_State, TLV.kTLVType_PublicKey, TLV.kTLVType_EncryptedData,
+                          TLV.kTLVType_Error]
+
+    resumable = None
+    if session_cache is not None:
+        resumable = session_cache.pop_by_pairing_id(pairing_data['AccessoryPairingID'])
+
+    if resumable is None:
+        request_tlv = verify_request_tlv
+    else:
+        # the request of pair resume is authenticated with the shared secret of the resumed session
+        session_id, resumed_secret = resumable
+        request_key = get_resume_key(resumed_secret, ios_key_pub, session_id, 'Pair-Resume-Request-Info')
+        encrypted_data_with_auth_tag = chacha20_aead_encrypt(bytes(), request_key, 'PR-Msg01'.encode(),
+                                                             bytes([0, 0, 0, 0]), bytes())
+        request_tlv = TLV.encode_list([
+            (TLV.kTLVType_State, TLV.M1),
+            (TLV.kTLVType_Method, bytearray([TLV.kTLVMethod_Resume])),
+            (TLV.kTLVType_PublicKey, ios_key_pub),
+            (TLV.kTLVType_SessionID, session_id),
+            (TLV.kTLVType_EncryptedData, encrypted_data_with_auth_tag[0] + encrypted_data_with_auth_tag[1])
+        ])
 
     # conn.request('POST', '/pair-verify', request_tlv, headers)
     # resp = conn.getresponse()
     # response_tlv = TLV.decode_bytes(resp.read())
-    step2_expectations = [TLV.kTLVType_State, TLV.kTLVType_PublicKey, TLV.kTLVType_EncryptedData]
-    response_tlv = write_fun(request_tlv, step2_expectations)
+    if resumable is None:
+        response_tlv = TlvMessage.of(write_fun(request_tlv, step2_expectations))
+    else:
+        response_tlv = TlvMessage.of(write_fun(request_tlv, step2_expectations + [TLV.kTLVType_SessionID]))
+        if TLV.kTLVType_Error in response_tlv:
+            # the accessory rejected the resume instead of falling back itself, so start a normal pair verify
+            logging.debug('pair resume rejected with error %s, doing a pair verify',
+                          bytes(response_tlv[TLV.kTLVType_Error]).hex())
+            resumable = None
+            response_tlv = TlvMessage.of(write_fun(verify_request_tlv, step2_expectations))
+
+    if resumable is not None and TLV.kTLVType_SessionID in response_tlv:
+        #
+        # Step #2 of pair resume: the accessory knew the session and sent a new session id
+        #
+        assert response_tlv.get(TLV.kTLVType_State) == TLV.M2, 'get_session_keys: not M2'
+        assert TLV.kTLVType_EncryptedData in response_tlv, 'get_session_keys: no encrypted data'
+        new_session_id = bytes(response_tlv[TLV.kTLVType_SessionID])
+        response_key = get_resume_key(resumed_secret, ios_key_pub, new_session_id, 'Pair-Resume-Response-Info')
+        decrypted = chacha20_aead_decrypt(bytes(), response_key, 'PR-Msg02'.encode(), bytes([0, 0, 0, 0]),
+                                          response_tlv[TLV.kTLVType_EncryptedData])
+        if decrypted is False:
+            raise InvalidAuthTagError('step 2')
+        shared_secret = get_resume_key(resumed_secret, ios_key_pub, new_session_id, 'Pair-Resume-Shared-Secret-Info')
+        session_cache.add(get_resume_session_id(shared_secret), pairing_data['AccessoryPairingID'], shared_secret)
+        return get_control_keys(shared_secret)
 
     #
     # Step #3 ios --> accessory (send SRP verify request)  (page 49)
     #
-    response_tlv = TLV.reorder(response_tlv, step2_expectations)
-    assert response_tlv[0][0] == TLV.kTLVType_State and response_tlv[0][1] == TLV.M2, 'get_session_keys: not M2'
-    assert response_tlv[1][0] == TLV.kTLVType_PublicKey, 'get_session_keys: no public key'
-    assert response_tlv[2][0] == TLV.kTLVType_EncryptedData, 'get_session_keys: no encrypted data'
+    if TLV.kTLVType_Error in response_tlv:
+        error_handler(response_tlv[TLV.kTLVType_Error], 'step 3')
+    assert response_tlv.get(TLV.kTLVType_State) == TLV.M2, 'get_session_keys: not M2'
+    assert TLV.kTLVType_PublicKey in response_tlv, 'get_session_keys: no public key'
+    assert TLV.kTLVType_EncryptedData in response_tlv, 'get_session_keys: no encrypted data'
 
     # 1) generate shared secret
-    accessorys_session_pub_key_bytes = bytes(response_tlv[1][1])
+    accessorys_session_pub_key_bytes = bytes(response_tlv[TLV.kTLVType_PublicKey])
     accessorys_session_pub_key = x25519.X25519PublicKey.from_public_bytes(
         accessorys_session_pub_key_bytes
     )
     shared_secret = ios_key.exchange(accessorys_session_pub_key)
 
     # 2) derive session key
-    hkdf_inst = hkdf.Hkdf('Pair-Verify-Encrypt-Salt'.encode(), shared_secret, hash=hashlib.sha512)
-    session_key = hkdf_inst.expand('Pair-Verify-Encrypt-Info'.encode(), 32)
+    session_key = hkdf_sha512('Pair-Verify-Encrypt-Salt'.encode(), shared_secret, 'Pair-Verify-Encrypt-Info'.encode())
 
     # 3) verify auth tag on encrypted data and 4) decrypt
-    encrypted = response_tlv[2][1]
+    encrypted = response_tlv[TLV.kTLVType_EncryptedData]
     decrypted = chacha20_aead_decrypt(bytes(), session_key, 'PV-Msg02'.encode(), bytes([0, 0, 0, 0]),
                                       encrypted)
     if type(decrypted) == bool and not decrypted:
         raise InvalidAuthTagError('step 3')
-    d1 = TLV.decode_bytes(decrypted)
-    d1 = TLV.reorder(d1, [TLV.kTLVType_Identifier, TLV.kTLVType_Signature])
-    assert d1[0][0] == TLV.kTLVType_Identifier, 'get_session_keys: no identifier'
-    assert d1[1][0] == TLV.kTLVType_Signature, 'get_session_keys: no signature'
+    d1 = TlvMessage(decrypted)
+    assert TLV.kTLVType_Identifier in d1, 'get_session_keys: no identifier'
+    assert TLV.kTLVType_Signature in d1, 'get_session_keys: no signature'
 
     # 5) look up pairing by accessory name
-    accessory_name = d1[0][1].decode()
+    accessory_name = d1[TLV.kTLVType_Identifier].decode()
 
     if pairing_data['AccessoryPairingID'] != accessory_name:
         raise IncorrectPairingIdError('step 3')
 
-    accessory_ltpk = ed25519.VerifyingKey(bytes.fromhex(pairing_data['AccessoryLTPK']))
+    accessory_ltpk = get_verifying_key(bytes.fromhex(pairing_data['AccessoryLTPK']))
 
     # 6) verify accessory's signature
-    accessory_sig = d1[1][1]
-    accessory_session_pub_key_bytes = response_tlv[1][1]
-    accessory_info = accessory_session_pub_key_bytes + accessory_name.encode() + ios_key_pub
-    try:
-        accessory_ltpk.verify(bytes(accessory_sig), bytes(accessory_info))
-    except ed25519.BadSignatureError:
+    accessory_sig = d1[TLV.kTLVType_Signature]
+    accessory_info = accessorys_session_pub_key_bytes + accessory_name.encode() + ios_key_pub
+    if not accessory_ltpk.verify(accessory_sig, accessory_info):
         raise InvalidSignatureError('step 3')
 
     # 7) create iOSDeviceInfo
     ios_device_info = ios_key_pub + pairing_data['iOSPairingId'].encode() + accessorys_session_pub_key_bytes
 
     # 8) sign iOSDeviceInfo with long term secret key
-    ios_device_ltsk_h = pairing_data['iOSDeviceLTSK']
-    ios_device_ltpk_h = pairing_data['iOSDeviceLTPK']
-    ios_device_ltsk = ed25519.SigningKey(bytes.fromhex(ios_device_ltsk_h) + bytes.fromhex(ios_device_ltpk_h))
+    ios_device_ltsk = get_signing_key(bytes.fromhex(pairing_data['iOSDeviceLTSK']))
     ios_device_signature = ios_device_ltsk.sign(ios_device_info)
 
     # 9) construct sub tlv
@@ -389,21 +466,17 @@ def get_session_keys(conn, pairing_data, write_fun):
     # resp = conn.getresponse()
     # response_tlv = TLV.decode_bytes(resp.read())
     step3_expectations = [TLV.kTLVType_State, TLV.kTLVType_Error]
-    response_tlv = write_fun(request_tlv, step3_expectations)
+    response_tlv = TlvMessage.of(write_fun(request_tlv, step3_expectations))
 
     #
     #   Post Step #4 verification (page 51)
     #
-    response_tlv = TLV.reorder(response_tlv, step3_expectations)
-    assert response_tlv[0][0] == TLV.kTLVType_State and response_tlv[0][1] == TLV.M4, 'get_session_keys: not M4'
-    if len(response_tlv) == 2 and response_tlv[1][0] == TLV.kTLVType_Error:
-        error_handler(response_tlv[1][1], 'verification')
-
-    # calculate session keys
-    hkdf_inst = hkdf.Hkdf('Control-Salt'.encode(), shared_secret, hash=hashlib.sha512)
-    controller_to_accessory_key = hkdf_inst.expand('Control-Write-Encryption-Key'.encode(), 32)
+    assert response_tlv.get(TLV.kTLVType_State) == TLV.M4, 'get_session_keys: not M4'
+    if TLV.kTLVType_Error in response_tlv:
+        error_handler(response_tlv[TLV.kTLVType_Error], 'verification')
 
-    hkdf_inst = hkdf.Hkdf('Control-Salt'.encode(), shared_secret, hash=hashlib.sha512)
-    accessory_to_controller_key = hkdf_inst.expand('Control-Read-Encryption-Key'.encode(), 32)
+    if session_cache is not None:
+        session_cache.add(get_resume_session_id(shared_secret), pairing_data['AccessoryPairingID'], shared_secret)
 
-    return controller_to_accessory_key, accessory_to_controller_key
+    # calculate session keys
+    return get_control_keys(shared_secret)
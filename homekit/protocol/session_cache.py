@@ -0,0 +1,101 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class SessionCache(object):
+    """
+    Keeps the shared secrets of finished pair verify operations, so a later pair verify can resume the session instead
+    of doing the full key exchange again. Entries are keyed by the session id, expire after a lifetime and the oldest
+    entries are dropped if more than max_sessions are stored. Each session id can be used for one resume only.
+    """
+
+    def __init__(self, max_sessions: int = 32, lifetime: float = 3600):
+        """
+        :param max_sessions: the maximum number of sessions that are kept
+        :param lifetime: the number of seconds a session can be resumed after it was added
+        """
+        self.max_sessions = max_sessions
+        self.lifetime = lifetime
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            self._expire()
+            return len(self._sessions)
+
+    def _expire(self):
+        now = time.monotonic()
+        for session_id in [s for s, e in self._sessions.items() if e[2] <= now]:
+            del self._sessions[session_id]
+
+    def add(self, session_id: bytes, pairing_id, shared_secret: bytes):
+        """
+        Stores a resumable session.
+
+        :param session_id: the 8 byte session id
+        :param pairing_id: the pairing id of the peer (the accessory for controllers, the controller for accessories)
+        :param shared_secret: the shared secret the session keys were derived from
+        """
+        with self._lock:
+            self._expire()
+            self._sessions.pop(bytes(session_id), None)
+            self._sessions[bytes(session_id)] = (pairing_id, shared_secret, time.monotonic() + self.lifetime)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def pop(self, session_id: bytes):
+        """
+        Removes a session to resume it.
+
+        :param session_id: the session id as sent by the controller
+        :return: tuple of pairing id and shared secret or None if the session is unknown or expired
+        """
+        with self._lock:
+            self._expire()
+            entry = self._sessions.pop(bytes(session_id), None)
+        if entry is None:
+            return None
+        return entry[0], entry[1]
+
+    def pop_by_pairing_id(self, pairing_id):
+        """
+        Removes the most recent session with the given peer to resume it.
+
+        :param pairing_id: the pairing id of the peer
+        :return: tuple of session id and shared secret or None if there is no session with the peer
+        """
+        with self._lock:
+            self._expire()
+            for session_id in reversed(self._sessions):
+                if self._sessions[session_id][0] == pairing_id:
+                    entry = self._sessions.pop(session_id)
+                    return session_id, entry[1]
+        return None
+
+    def remove_pairing(self, pairing_id):
+        """
+        Forgets all sessions with the given peer, e.g. after the pairing was removed.
+
+        :param pairing_id: the pairing id of the peer
+        """
+        with self._lock:
+            for session_id in [s for s, e in self._sessions.items() if e[0] == pairing_id]:
+                del self._sessions[session_id]
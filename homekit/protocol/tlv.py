@@ -15,6 +15,8 @@
 #
 import logging
 
+from homekit.log_support import DIAGNOSTICS
+
 logger = logging.getLogger('homekit.protocol.tlv')
 
 
@@ -91,30 +93,54 @@ class TLV:
     kTLVHAPParamHAPValidValuesDescriptor = 0x11
     kTLVHAPParamHAPValidValuesRangeDescriptor = 0x12
 
+    @staticmethod
+    def _scan(data, expected=None):
+        # yields key, start and end offset of each raw item (fragments are not merged here)
+        end = len(data)
+        offset = 0
+        while offset < end:
+            key = data[offset]
+            if expected and key not in expected:
+                break
+            if offset + 1 == end:
+                raise TlvParseException('No length for key {}'.format(key))
+            length = data[offset + 1]
+            start = offset + 2
+            offset = start + length
+            if offset > end:
+                raise TlvParseException('Not enough data for length {}'.format(length))
+            yield key, start, offset
+
     @staticmethod
     def decode_bytes(bs, expected=None) -> list:
-        return TLV.decode_bytearray(bytearray(bs), expected)
+        return TLV.decode_bytearray(bs, expected)
 
     @staticmethod
     def decode_bytearray(ba: bytearray, expected=None) -> list:
-        result = []
-        # do not influence caller!
-        tail = ba.copy()
-        while len(tail) > 0:
-            key = tail.pop(0)
-            if expected and key not in expected:
-                break
-            length = tail.pop(0)
-            value = tail[:length]
-            if length != len(value):
-                raise TlvParseException('Not enough data for length {}'.format(length))
-            tail = tail[length:]
+        """
+        Decodes a TLV byte sequence. Fragmented items (consecutive items with the same key) are merged into one item.
 
-            if len(result) > 0 and result[-1][0] == key:
-                result[-1][1] += value
-            else:
-                result.append([key, value])
-        logger.debug('receiving %s', TLV.to_string(result))
+        :param ba: the data, any bytes-like object or a list of ints (the data is not modified)
+        :param expected: if given, decoding stops at the first key that is not in this list
+        :return: a list of [key, value] pairs with the values as bytearray
+        :raises TlvParseException: if the data ends within an item
+        """
+        try:
+            data = memoryview(ba)
+        except TypeError:
+            # e.g. lists of ints as returned by dbus
+            data = memoryview(bytearray(ba))
+        result = []
+        with data:
+            if data.format != 'B' or data.ndim != 1:
+                data = data.cast('B')
+            for key, start, end in TLV._scan(data, expected):
+                if len(result) > 0 and result[-1][0] == key:
+                    result[-1][1] += data[start:end]
+                else:
+                    result.append([key, bytearray(data[start:end])])
+        if DIAGNOSTICS and logger.isEnabledFor(logging.DEBUG):
+            logger.debug('receiving %s', TLV.to_string(result))
         return result
 
     @staticmethod
@@ -130,36 +156,75 @@ class TLV:
         return valid
 
     @staticmethod
-    def encode_list(d: list) -> bytearray:
-        logger.debug('sending %s', TLV.to_string(d))
-        result = bytearray()
-        for p in d:
-            (key, value) = p
+    def _check_item(key, value) -> int:
+        # returns the number of bytes the item needs when encoded
+        if type(key) is not int or key < 0 or key > 255:
             if not TLV.validate_key(key):
                 raise ValueError('Invalid key')
+        length = len(value)
+        if key == TLV.kTLVType_Separator:
+            if length != 0:
+                raise ValueError('Separator must not have data')
+            return 2
+        # each fragment of at most 255 bytes gets its own key and length, empty values are left out
+        return length + 2 * ((length + 254) // 255)
+
+    @staticmethod
+    def encoded_length(d: list) -> int:
+        """
+        Computes the exact number of bytes of the encoded list.
+
+        :param d: list of (key, value) pairs as accepted by encode_list
+        :return: the length in bytes
+        :raises ValueError: if a key is invalid or a separator has data
+        """
+        return sum(TLV._check_item(key, value) for key, value in d)
+
+    @staticmethod
+    def encode_into(d: list, buffer, offset: int = 0) -> int:
+        """
+        Encodes a list of key value pairs into an existing buffer. Values longer than 255 bytes are split into
+        fragments.
 
-            # handle separators properly
+        :param d: list of (key, value) pairs as accepted by encode_list
+        :param buffer: a writable bytes-like object (e.g. bytearray) with at least encoded_length(d) bytes after offset
+        :param offset: the position in buffer to start writing at
+        :return: the position in buffer after the last written byte
+        :raises ValueError: if a key is invalid, a separator has data or the buffer is too small
+        """
+        if offset + TLV.encoded_length(d) > len(buffer):
+            raise ValueError('Buffer too small')
+        return TLV._encode_items(d, buffer, offset)
+
+    @staticmethod
+    def _encode_items(d: list, buffer, offset: int) -> int:
+        # the items must have been checked by encoded_length before
+        for key, value in d:
+            if not isinstance(value, (bytes, bytearray, memoryview)):
+                value = bytes(value)
             if key == TLV.kTLVType_Separator:
-                if len(value) == 0:
-                    result.append(key)
-                    result.append(0)
-                else:
-                    raise ValueError('Separator must not have data')
-
-            while len(value) > 0:
-                result.append(key)
-                if len(value) > 255:
-                    length = 255
-                    result.append(length)
-                    for b in value[:length]:
-                        result.append(b)
-                    value = value[length:]
-                else:
-                    length = len(value)
-                    result.append(length)
-                    for b in value[:length]:
-                        result.append(b)
-                    value = value[length:]
+                buffer[offset] = key
+                buffer[offset + 1] = 0
+                offset += 2
+                continue
+            view = memoryview(value)
+            if view.format != 'B' or view.ndim != 1:
+                view = view.cast('B')
+            for start in range(0, len(view), 255):
+                fragment = view[start:start + 255]
+                length = len(fragment)
+                buffer[offset] = key
+                buffer[offset + 1] = length
+                buffer[offset + 2:offset + 2 + length] = fragment
+                offset += 2 + length
+        return offset
+
+    @staticmethod
+    def encode_list(d: list) -> bytearray:
+        if DIAGNOSTICS and logger.isEnabledFor(logging.DEBUG):
+            logger.debug('sending %s', TLV.to_string(d))
+        result = bytearray(TLV.encoded_length(d))
+        TLV._encode_items(d, result, 0)
         return result
 
     @staticmethod
@@ -202,6 +267,255 @@ class TLV:
         return tmp
 
 
+class TlvMessage:
+    """
+    A decoded TLV message that allows to look up items by their type instead of reordering the decoded list and
+    checking positions. The data is scanned once on creation, the values are only copied out of it (and merged if they
+    were fragmented) when they are accessed. Keys may appear more than once, e.g. in list pairings responses where the
+    entries are divided by separators.
+
+    Iterating over a message gives (key, value) pairs in the order of the data.
+    """
+
+    def __init__(self, data=b'', expected=None):
+        """
+        :param data: the encoded TLV, a bytes-like object or a list of ints
+        :param expected: if given, decoding stops at the first key that is not in this list (see TLV.decode_bytes)
+        :raises TlvParseException: if the data ends within an item
+        """
+        if not isinstance(data, bytes):
+            # keep an immutable copy, so changes of the caller's buffer do not change the values
+            data = bytes(data)
+        self._data = data
+        self._keys = []
+        # per item the list of (start, end) of its fragments or None if the value was given directly
+        self._spans = []
+        self._values = []
+        self._index = {}
+        with memoryview(data) as view:
+            for key, start, end in TLV._scan(view, expected):
+                if len(self._keys) > 0 and self._keys[-1] == key:
+                    self._spans[-1].append((start, end))
+                else:
+                    self._append(key, [(start, end)], None)
+
+    def _append(self, key, spans, value):
+        self._index.setdefault(key, []).append(len(self._keys))
+        self._keys.append(key)
+        self._spans.append(spans)
+        self._values.append(value)
+
+    @staticmethod
+    def from_list(items) -> 'TlvMessage':
+        """
+        Creates a message from already decoded items.
+
+        :param items: list of (key, value) pairs like returned by TLV.decode_bytes
+        :return: the TlvMessage
+        """
+        message = TlvMessage()
+        for key, value in items:
+            message._append(key, None, value)
+        return message
+
+    @staticmethod
+    def of(message) -> 'TlvMessage':
+        """
+        :param message: a TlvMessage or a list of decoded (key, value) pairs
+        :return: the TlvMessage for it (the message itself if it already is one)
+        """
+        if isinstance(message, TlvMessage):
+            return message
+        return TlvMessage.from_list(message)
+
+    def _value(self, position: int):
+        value = self._values[position]
+        if value is None:
+            value = bytearray()
+            with memoryview(self._data) as view:
+                for start, end in self._spans[position]:
+                    value += view[start:end]
+            self._values[position] = value
+        return value
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        for position, key in enumerate(self._keys):
+            yield key, self._value(position)
+
+    def __getitem__(self, key):
+        """
+        :param key: the type of the item
+        :return: the value of the first item with the key
+        :raises KeyError: if there is no such item
+        """
+        positions = self._index.get(key)
+        if positions is None:
+            raise KeyError(key)
+        return self._value(positions[0])
+
+    def get(self, key, default=None):
+        """
+        :param key: the type of the item
+        :param default: returned if there is no such item
+        :return: the value of the first item with the key
+        """
+        positions = self._index.get(key)
+        if positions is None:
+            return default
+        return self._value(positions[0])
+
+    def get_all(self, key) -> list:
+        """
+        :param key: the type of the items
+        :return: the values of all items with the key in the order of the message
+        """
+        return [self._value(position) for position in self._index.get(key, [])]
+
+    def keys(self) -> list:
+        """
+        :return: the keys of all items in the order of the message
+        """
+        return list(self._keys)
+
+    def split(self, separator: int = TLV.kTLVType_Separator, start: int = None) -> list:
+        """
+        Splits the message at the separator items, e.g. into the entries of a list pairings response.
+
+        :param separator: the type of the separator items
+        :param start: if given, a new part is also started at an item of this type if the current part already has
+                      one, so entries are divided even if the separators are missing
+        :return: list of TlvMessage, one for each part (the separators are left out)
+        """
+        parts = [TlvMessage()]
+        for position, key in enumerate(self._keys):
+            if key == separator:
+                parts.append(TlvMessage())
+                continue
+            if key == start and key in parts[-1]:
+                parts.append(TlvMessage())
+            parts[-1]._append(key, None, self._value(position))
+        return parts
+
+    def to_list(self) -> list:
+        """
+        :return: the message as list of [key, value] pairs like returned by TLV.decode_bytes
+        """
+        return [[key, value] for key, value in self]
+
+
+class TlvParser:
+    """
+    Push style TLV parser for data that arrives in pieces, e.g. from consecutive reads of a BLE characteristic. The
+    items are returned as soon as they are complete, that is when a fragment shorter than 255 bytes was read (longer
+    values are split into 255 byte fragments) or when an item with another key follows.
+
+    The values of the stream keys (by default kTLVType_FragmentData and kTLVType_FragmentLast, see HomeKit spec
+    chapter 4.3.2 page 32) are not returned as items. They form a TLV of their own that is passed to an inner parser
+    and whose items are returned instead. A fragment of type kTLVType_FragmentLast ends that inner TLV.
+    """
+
+    def __init__(self, expected=None, stream_keys=(TLV.kTLVType_FragmentData, TLV.kTLVType_FragmentLast),
+                 inner=None):
+        """
+        :param expected: if given, parsing stops at the first key that is neither in this list nor a stream key (see
+            TLV.decode_bytes). It is passed on to the inner parser.
+        :param stream_keys: keys whose values are parsed as a TLV of their own
+        :param inner: the TlvParser for the values of the stream keys, by default a new one is created for each
+            sequence of fragments
+        """
+        self.expected = expected
+        self.stream_keys = stream_keys
+        self.stopped = False
+        self._inner = inner
+        self._new_inner = inner is None
+        self._buffer = bytearray()
+        self._current = None
+
+    def _get_inner(self):
+        if self._inner is None:
+            self._inner = TlvParser(self.expected, ())
+        return self._inner
+
+    def _finish_current(self, items: list):
+        if self._current is not None:
+            items.append(self._current)
+            self._current = None
+
+    def _handle_fragment(self, key: int, fragment: bytearray, items: list):
+        if key in self.stream_keys:
+            self._finish_current(items)
+            items.extend(self._get_inner().feed(fragment))
+            if key == TLV.kTLVType_FragmentLast and len(fragment) < 255 and self._new_inner:
+                items.extend(self._inner.close())
+                self._inner = None
+            return
+        if self._current is not None and self._current[0] == key:
+            self._current[1] += fragment
+        else:
+            self._finish_current(items)
+            self._current = [key, fragment]
+        if len(fragment) < 255:
+            self._finish_current(items)
+
+    def feed(self, data) -> list:
+        """
+        Adds the next piece of data.
+
+        :param data: bytes-like object or list of ints
+        :return: list of [key, value] pairs of the items that were completed by this data
+        """
+        items = []
+        if self.stopped:
+            return items
+        self._buffer += bytes(data) if isinstance(data, list) else data
+        buffer = self._buffer
+        end = len(buffer)
+        offset = 0
+        while offset < end:
+            key = buffer[offset]
+            if self.expected and key not in self.expected and key not in self.stream_keys:
+                self.stopped = True
+                break
+            if offset + 2 > end:
+                break
+            length = buffer[offset + 1]
+            if offset + 2 + length > end:
+                break
+            self._handle_fragment(key, buffer[offset + 2:offset + 2 + length], items)
+            offset += 2 + length
+        if self.stopped:
+            self._buffer = bytearray()
+            self._finish_current(items)
+        else:
+            del buffer[:offset]
+        return items
+
+    def close(self) -> list:
+        """
+        Ends the data.
+
+        :return: list of [key, value] pairs of the items that were not returned yet
+        :raises TlvParseException: if the data ended within an item
+        """
+        if len(self._buffer) == 1:
+            raise TlvParseException('No length for key {}'.format(self._buffer[0]))
+        if len(self._buffer) > 1:
+            raise TlvParseException('Not enough data for length {}'.format(self._buffer[1]))
+        items = []
+        self._finish_current(items)
+        if self._inner is not None:
+            items.extend(self._inner.close())
+            if self._new_inner:
+                self._inner = None
+        return items
+
+
 class TlvParseException(Exception):
     """Raised upon parse error with some TLV"""
     pass
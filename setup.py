@@ -37,7 +37,6 @@ setuptools.setup(
         'Intended Audience :: End Users/Desktop'
     ],
     install_requires=[
-        'hkdf',
         'ed25519',
         'cryptography>=2.5',
     ],
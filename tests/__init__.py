@@ -18,9 +18,20 @@ __all__ = [
     'TestServerData', 'BleCharacteristicFormatsTest', 'BleCharacteristicUnitsTest', 'CharacteristicTypesTest',
     'TestBLEController', 'TestChacha20poly1305', 'TestCharacteristicsTypes', 'TestController', 'TestControllerIpPaired',
     'TestControllerIpUnpaired', 'TestHttpResponse', 'TestHttpStatusCodes', 'TestMfrData', 'TestSrp', 'TestTLV',
-    'TestZeroconf', 'TestBLEPairing', 'TestServiceTypes', 'TestSecureHttp', 'TestHTTPPairing', 'TestSecureSession'
+    'TestZeroconf', 'TestBLEPairing', 'TestServiceTypes', 'TestSecureHttp', 'TestHTTPPairing', 'TestSecureSession',
+    'TestHapCipher', 'TestSessionCache', 'TestPrimitives', 'TestBenchmark',
+    'TestFrameWriter', 'TestTlvMessage', 'TestTlvParser', 'TestLogSupport', 'TestFrameReader',
+    'TestSessionPool', 'TestAsyncSecureHttp', 'TestAsyncControllerIpPaired',
+    'TestRequestBuilder', 'TestFanOut', 'TestAsyncFanOut',
+    'TestAccessoryCache', 'TestAccessoryCachePairing', 'TestAccessoryCacheBlePairing', 'TestAccessoryIndex',
+    'TestAccessoryIndexPairing',
+    'TestPollingScheduler', 'TestPollingSchedulerThread', 'TestEventHub'
 ]
 
+from tests.accessory_cache_test import TestAccessoryCache, TestAccessoryCachePairing, TestAccessoryCacheBlePairing
+from tests.accessory_index_test import TestAccessoryIndex, TestAccessoryIndexPairing
+from tests.async_ip_test import TestAsyncSecureHttp, TestAsyncControllerIpPaired
+from tests.benchmark_test import TestBenchmark
 from tests.bleCharacteristicFormats_test import BleCharacteristicFormatsTest
 from tests.bleCharacteristicUnits_test import BleCharacteristicUnitsTest
 from tests.ble_controller_test import TestBLEController, TestMfrData
@@ -29,12 +40,23 @@ from tests.chacha20poly1305_test import TestChacha20poly1305
 from tests.characteristicTypes_test import CharacteristicTypesTest
 from tests.characteristicsTypes_test import TestCharacteristicsTypes
 from tests.controller_test import TestControllerIpPaired, TestControllerIpUnpaired, TestController
+from tests.event_hub_test import TestEventHub
+from tests.fan_out_test import TestFanOut, TestAsyncFanOut
+from tests.frame_reader_test import TestFrameReader
+from tests.frame_writer_test import TestFrameWriter
+from tests.hap_cipher_test import TestHapCipher
 from tests.httpStatusCodes_test import TestHttpStatusCodes
 from tests.http_response_test import TestHttpResponse
+from tests.log_support_test import TestLogSupport
+from tests.polling_test import TestPollingScheduler, TestPollingSchedulerThread
+from tests.primitives_test import TestPrimitives
 from tests.regression_test import TestHTTPPairing, TestSecureSession
+from tests.request_test import TestRequestBuilder
 from tests.secure_http_test import TestSecureHttp
 from tests.serverdata_test import TestServerData
 from tests.serviceTypes_test import TestServiceTypes
+from tests.session_cache_test import TestSessionCache
+from tests.session_pool_test import TestSessionPool
 from tests.srp_test import TestSrp
-from tests.tlv_test import TestTLV
+from tests.tlv_test import TestTLV, TestTlvMessage, TestTlvParser
 from tests.zeroconf_test import TestZeroconf
@@ -0,0 +1,232 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from homekit import Controller
+from homekit.controller.accessory_cache import AccessoryCache
+from homekit.tools import BLE_TRANSPORT_SUPPORTED, IP_TRANSPORT_SUPPORTED
+
+if IP_TRANSPORT_SUPPORTED:
+    from homekit.controller.ip_implementation import IpPairing
+if BLE_TRANSPORT_SUPPORTED:
+    from homekit.controller.ble_impl import BlePairing
+
+ACCESSORIES = [{'aid': 1, 'services': [{'iid': 1, 'type': '3E', 'characteristics': [
+    {'iid': 2, 'type': '23', 'format': 'string', 'perms': ['pr'], 'value': 'Light'}]}]}]
+
+
+class TestAccessoryCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.directory.name, 'cache')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_empty(self):
+        cache = AccessoryCache(self.cache_dir)
+        self.assertIsNone(cache.get('12:34:56:00:01:0A'))
+        self.assertIsNone(cache.get_config_num('12:34:56:00:01:0A'))
+
+    def test_entries_survive_restarts(self):
+        AccessoryCache(self.cache_dir).put('12:34:56:00:01:0A', '3', ACCESSORIES)
+        cache = AccessoryCache(self.cache_dir)
+        self.assertEqual(ACCESSORIES, cache.get('12:34:56:00:01:0A'))
+        self.assertEqual(3, cache.get_config_num('12:34:56:00:01:0A'))
+        self.assertIsNone(cache.get('12:34:56:00:01:0B'))
+
+    def test_config_num(self):
+        cache = AccessoryCache(self.cache_dir)
+        cache.put('12:34:56:00:01:0A', 3, ACCESSORIES)
+        # c# from Bonjour is a string, cn from BLE an int
+        self.assertEqual(ACCESSORIES, cache.get('12:34:56:00:01:0A', '3'))
+        self.assertEqual(ACCESSORIES, cache.get('12:34:56:00:01:0A', 3))
+        self.assertIsNone(cache.get('12:34:56:00:01:0A', 4))
+
+    def test_remove(self):
+        AccessoryCache(self.cache_dir).put('12:34:56:00:01:0A', 3, ACCESSORIES)
+        cache = AccessoryCache(self.cache_dir)
+        cache.remove('12:34:56:00:01:0A')
+        cache.remove('12:34:56:00:01:0B')
+        self.assertIsNone(cache.get('12:34:56:00:01:0A'))
+        self.assertIsNone(AccessoryCache(self.cache_dir).get('12:34:56:00:01:0A'))
+
+    def test_unreadable_entry_is_ignored(self):
+        cache = AccessoryCache(self.cache_dir)
+        cache.put('12:34:56:00:01:0A', 3, ACCESSORIES)
+        files = os.listdir(self.cache_dir)
+        self.assertEqual(1, len(files))
+        with open(os.path.join(self.cache_dir, files[0]), 'w') as fp:
+            fp.write('{"pairing_id": ')
+        self.assertIsNone(AccessoryCache(self.cache_dir).get('12:34:56:00:01:0A'))
+
+    def test_unwritable_directory(self):
+        path = os.path.join(self.directory.name, 'file')
+        open(path, 'w').close()
+        cache = AccessoryCache(path)
+        # the entry is still available in memory
+        cache.put('12:34:56:00:01:0A', 3, ACCESSORIES)
+        self.assertEqual(ACCESSORIES, cache.get('12:34:56:00:01:0A'))
+
+
+class FakeSessionPool:
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url):
+        self.requests.append(url)
+        response = mock.Mock()
+        response.read.return_value = json.dumps({'accessories': ACCESSORIES}).encode()
+        return response
+
+    def close(self):
+        pass
+
+
+@unittest.skipIf(not IP_TRANSPORT_SUPPORTED, 'IP transport not supported')
+class TestAccessoryCachePairing(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _pairing(self):
+        pool = FakeSessionPool()
+        pairing = IpPairing({'AccessoryPairingID': '12:34:56:00:01:0A'}, session_pool=pool,
+                            accessory_cache=AccessoryCache(self.directory.name))
+        return pairing, pool
+
+    def test_served_from_cache_after_restart(self):
+        pairing, pool = self._pairing()
+        pairing.list_accessories_and_characteristics()
+        self.assertEqual(['/accessories'], pool.requests)
+
+        pairing, pool = self._pairing()
+        accessories = pairing.list_accessories_and_characteristics()
+        self.assertEqual([], pool.requests)
+        self.assertEqual('00000023-0000-1000-8000-0026BB765291', accessories[0]['services'][0]['characteristics'][0]
+                         ['type'])
+        self.assertEqual(accessories, pairing.pairing_data['accessories'])
+
+    def test_refetched_on_config_change(self):
+        pairing, pool = self._pairing()
+        self.assertFalse(pairing.set_config_num('2'))
+        pairing.list_accessories_and_characteristics()
+
+        pairing, pool = self._pairing()
+        self.assertFalse(pairing.set_config_num('2'))
+        pairing.list_accessories_and_characteristics()
+        self.assertEqual([], pool.requests)
+
+        self.assertTrue(pairing.set_config_num('3'))
+        self.assertNotIn('accessories', pairing.pairing_data)
+        pairing.list_accessories_and_characteristics()
+        self.assertEqual(['/accessories'], pool.requests)
+        self.assertEqual(3, pairing.accessory_cache.get_config_num('12:34:56:00:01:0A'))
+
+    def test_controller(self):
+        cache = AccessoryCache(self.directory.name)
+        controller = Controller(accessory_cache=cache)
+        pairing_data = {'Connection': 'IP', 'AccessoryPairingID': '12:34:56:00:01:0A', 'accessories': ACCESSORIES}
+        controller.pairings['alias'] = controller._create_ip_pairing(pairing_data)
+        cache.put('12:34:56:00:01:0A', 1, ACCESSORIES)
+
+        self.assertEqual([], controller.update_config_numbers([{'id': '12:34:56:00:01:0A', 'c#': '1'},
+                                                               {'id': '12:34:56:00:01:0B', 'c#': '7'}]))
+        self.assertEqual(['alias'], controller.update_config_numbers([{'id': '12:34:56:00:01:0A', 'c#': '2'}]))
+        self.assertNotIn('accessories', pairing_data)
+
+        pairing_data['accessories'] = ACCESSORIES
+        with tempfile.NamedTemporaryFile() as controller_file:
+            controller.save_data(controller_file.name)
+            with open(controller_file.name) as fp:
+                saved = json.load(fp)
+        self.assertNotIn('accessories', saved['alias'])
+        self.assertIn('accessories', pairing_data)
+        controller.shutdown()
+
+
+@unittest.skipIf(not BLE_TRANSPORT_SUPPORTED, 'BLE no supported')
+class TestAccessoryCacheBlePairing(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _reload(self, controller_file):
+        controller = Controller(accessory_cache=AccessoryCache(self.directory.name))
+        controller.load_data(controller_file)
+        return controller.get_pairings()['alias']
+
+    def test_database_after_save_and_reload(self):
+        controller = Controller(accessory_cache=AccessoryCache(self.directory.name))
+        pairing_data = {'Connection': 'BLE', 'AccessoryPairingID': '12:34:56:00:01:0A',
+                        'AccessoryMAC': '00:11:22:33:44:55', 'accessories': ACCESSORIES}
+        controller.pairings['alias'] = BlePairing(pairing_data, accessory_cache=controller.accessory_cache)
+        controller.accessory_cache.put('12:34:56:00:01:0A', 2, ACCESSORIES)
+
+        with tempfile.NamedTemporaryFile() as controller_file:
+            controller.save_data(controller_file.name)
+            pairing = self._reload(controller_file.name)
+            self.assertNotIn('accessories', pairing.pairing_data)
+            with mock.patch('homekit.controller.ble_impl.BleSession') as session:
+                pairing.get_characteristics([])
+                # the session was created with the database from the cache
+                self.assertEqual(ACCESSORIES, session.call_args[0][0]['accessories'])
+            self.assertEqual(ACCESSORIES, pairing.pairing_data['accessories'])
+
+            # same after the database was dropped because of a new configuration number, the device is read again
+            pairing = self._reload(controller_file.name)
+            pairing.set_config_num(3)
+            with mock.patch('homekit.controller.ble_impl.BleSession') as session, \
+                    mock.patch('homekit.controller.ble_impl.DeviceManager'), \
+                    mock.patch('homekit.controller.ble_impl.read_characteristics') as read:
+                read.return_value = {'data': ACCESSORIES}
+                pairing.put_characteristics([])
+                self.assertEqual(ACCESSORIES, session.call_args[0][0]['accessories'])
+            self.assertEqual(1, read.call_count)
+
+    def test_config_num_changed_with_open_session(self):
+        pairing = BlePairing({'Connection': 'BLE', 'AccessoryPairingID': '12:34:56:00:01:0A',
+                              'AccessoryMAC': '00:11:22:33:44:55', 'accessories': ACCESSORIES})
+        session = mock.Mock()
+        session.find_characteristic_by_iid.return_value = (mock.Mock(), {'iid': 2})
+        session.request.return_value = {1: b'Light'}
+        pairing.session = session
+        self.assertFalse(pairing.set_config_num(1))
+        self.assertTrue(pairing.set_config_num(2))
+        self.assertNotIn('accessories', pairing.pairing_data)
+        # the session's mapping was built from the old database
+        session.close.assert_called_once_with()
+        self.assertIsNone(pairing.session)
+
+        with mock.patch('homekit.controller.ble_impl.BleSession', return_value=session), \
+                mock.patch('homekit.controller.ble_impl.DeviceManager'), \
+                mock.patch('homekit.controller.ble_impl.read_characteristics') as read:
+            read.return_value = {'data': ACCESSORIES}
+            self.assertTrue(pairing.identify())
+            self.assertEqual(ACCESSORIES, pairing.pairing_data['accessories'])
+            self.assertEqual({(1, 2): {'value': 'Light'}}, pairing.get_characteristics([(1, 2)]))
+            self.assertEqual({}, pairing.put_characteristics([(1, 2, 'Lamp')]))
+        self.assertEqual(1, read.call_count)
+        self.assertIs(session, pairing.session)
@@ -0,0 +1,101 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import unittest
+from unittest import mock
+
+from homekit.controller.accessory_index import AccessoryIndex
+from homekit.exceptions import FormatError
+from homekit.tools import IP_TRANSPORT_SUPPORTED
+
+if IP_TRANSPORT_SUPPORTED:
+    from homekit.controller.ip_implementation import IpPairing, characteristics_write_body
+
+
+def create_bridge(count):
+    accessories = []
+    for aid in range(1, count + 1):
+        accessories.append({'aid': aid, 'services': [
+            {'iid': 1, 'type': '0000003E-0000-1000-8000-0026BB765291', 'characteristics': [
+                {'iid': 2, 'type': '00000014-0000-1000-8000-0026BB765291', 'format': 'bool', 'perms': ['pw']},
+                {'iid': 3, 'type': '00000023-0000-1000-8000-0026BB765291', 'format': 'string', 'perms': ['pr']}]},
+            {'iid': 10, 'type': '00000043-0000-1000-8000-0026BB765291', 'characteristics': [
+                {'iid': 11, 'type': '00000025-0000-1000-8000-0026BB765291', 'format': 'bool', 'perms': ['pr', 'pw']},
+                {'iid': 12, 'type': '00000008-0000-1000-8000-0026BB765291', 'format': 'int', 'perms': ['pr', 'pw']},
+                {'iid': 13, 'type': '12345678-1234-1234-1234-1234567890ab', 'format': 'uint8', 'perms': ['pr']}]}]})
+    return accessories
+
+
+class TestAccessoryIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = AccessoryIndex(create_bridge(3))
+
+    def test_get(self):
+        self.assertEqual(15, len(self.index))
+        self.assertEqual(12, self.index.get(2, 12)['iid'])
+        self.assertEqual('int', self.index.get_format(2, 12))
+        self.assertEqual(10, self.index.get_service(2, 12)['iid'])
+        self.assertIsNone(self.index.get(4, 12))
+        self.assertIsNone(self.index.get_format(1, 99))
+        self.assertIsNone(self.index.get_service(1, 99))
+
+    def test_find_characteristics(self):
+        expected = [(1, 2), (2, 2), (3, 2)]
+        self.assertEqual(expected, self.index.find_characteristics('14'))
+        self.assertEqual(expected, self.index.find_characteristics('00000014-0000-1000-8000-0026BB765291'))
+        self.assertEqual(expected, self.index.find_characteristics('public.hap.characteristic.identify'))
+        self.assertEqual([(1, 13), (2, 13), (3, 13)],
+                         self.index.find_characteristics('12345678-1234-1234-1234-1234567890AB'))
+        self.assertEqual([], self.index.find_characteristics('public.hap.characteristic.position.current'))
+
+    def test_find_services(self):
+        self.assertEqual([(1, 10), (2, 10), (3, 10)], self.index.find_services('43'))
+        self.assertEqual([(1, 1), (2, 1), (3, 1)], self.index.find_services('public.hap.service.accessory-information'))
+
+
+@unittest.skipIf(not IP_TRANSPORT_SUPPORTED, 'IP transport not supported')
+class TestAccessoryIndexPairing(unittest.TestCase):
+    def test_index_follows_the_database(self):
+        pairing = IpPairing({'accessories': create_bridge(1)})
+        index = pairing.get_accessory_index()
+        self.assertIs(index, pairing.get_accessory_index())
+        pairing.pairing_data['accessories'] = create_bridge(2)
+        self.assertIsNot(index, pairing.get_accessory_index())
+        self.assertEqual(10, len(pairing.get_accessory_index()))
+        del pairing.pairing_data['accessories']
+        self.assertIsNone(pairing.get_accessory_index())
+
+    def test_write_body_conversion(self):
+        index = AccessoryIndex(create_bridge(2))
+        body = json.loads(characteristics_write_body([(2, 11, 'on'), (2, 12, '7'), (1, 3, 'x')], index, True))
+        self.assertEqual([{'aid': 2, 'iid': 11, 'value': True}, {'aid': 2, 'iid': 12, 'value': 7},
+                          {'aid': 1, 'iid': 3, 'value': 'x'}], body['characteristics'])
+        self.assertRaises(FormatError, characteristics_write_body, [(2, 12, 'seven')], index, True)
+        # without conversion the index is not needed
+        body = json.loads(characteristics_write_body([(2, 12, '7')], None))
+        self.assertEqual('7', body['characteristics'][0]['value'])
+
+    def test_identify(self):
+        session = mock.Mock()
+        session.put.return_value.code = 204
+        pairing = IpPairing({'accessories': create_bridge(2)}, session_pool=session)
+        self.assertTrue(pairing.identify())
+        self.assertEqual({'characteristics': [{'aid': 1, 'iid': 2, 'value': True}]},
+                         json.loads(session.put.call_args[0][1]))
+
+        pairing = IpPairing({'accessories': [{'aid': 1, 'services': []}]}, session_pool=session)
+        self.assertFalse(pairing.identify())
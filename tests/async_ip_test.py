@@ -0,0 +1,235 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import asyncio
+import socket
+import tempfile
+import time
+import unittest
+
+from homekit import AccessoryServer
+from homekit.exceptions import AccessoryDisconnectedError
+from homekit.http_impl.async_secure_http import AsyncSecureHttp
+from homekit.model import Accessory
+from homekit.model import mixin as model_mixin
+from homekit.model.services import LightBulbService
+from homekit.tools import IP_TRANSPORT_SUPPORTED
+from tests.controller_test import T
+from tests.secure_http_test import PipelineAccessory
+
+if IP_TRANSPORT_SUPPORTED:
+    from homekit.controller.async_ip_implementation import AsyncController, AsyncIpPairing
+
+
+class TestAsyncSecureHttp(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.controller_socket, self.accessory_socket = socket.socketpair()
+
+    def tearDown(self):
+        self.loop.close()
+        self.controller_socket.close()
+        self.accessory_socket.close()
+
+    async def _session(self):
+        reader, writer = await asyncio.open_connection(sock=self.controller_socket)
+        return AsyncSecureHttp(reader, writer, b'\x01' * 32, b'\x02' * 32, '10.0.0.2', 3000)
+
+    def test_pipelined_requests(self):
+        accessory = PipelineAccessory(self.accessory_socket, b'\x01' * 32, b'\x02' * 32, 3)
+        accessory.start()
+
+        async def run():
+            http = await self._session()
+            events = http.events()
+            responses = await asyncio.gather(*[http.get('/{}'.format(i)) for i in range(3)])
+            event = await events.__anext__()
+            http.close()
+            return responses, event
+
+        responses, event = self.loop.run_until_complete(run())
+        accessory.join()
+        self.assertEqual([b'/0', b'/1', b'/2'], [r.body for r in responses])
+        self.assertEqual('EVENT', event.get_http_name())
+        self.assertEqual(b'{}', event.body)
+
+    def test_pending_requests_fail_on_disconnect(self):
+        async def run():
+            http = await self._session()
+            events = http.events()
+            request = asyncio.ensure_future(http.get('/'))
+            await asyncio.sleep(0.1)
+            self.accessory_socket.close()
+            with self.assertRaises(AccessoryDisconnectedError):
+                await request
+            with self.assertRaises(AccessoryDisconnectedError):
+                await events.__anext__()
+            self.assertFalse(http.is_connected())
+            with self.assertRaises(AccessoryDisconnectedError):
+                await http.get('/')
+            http.close()
+
+        self.loop.run_until_complete(run())
+
+    def test_close_ends_events(self):
+        async def run():
+            http = await self._session()
+            events = http.events()
+            http.close()
+            received = []
+            async for event in events:
+                received.append(event)
+            return received
+
+        self.assertEqual([], self.loop.run_until_complete(run()))
+
+
+@unittest.skipIf(not IP_TRANSPORT_SUPPORTED, 'IP transport not supported')
+class TestAsyncControllerIpPaired(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.config_file = tempfile.NamedTemporaryFile()
+        cls.config_file.write("""{
+            "accessory_ltpk": "7986cf939de8986f428744e36ed72d86189bea46b4dcdc8d9d79a3e4fceb92b9",
+            "accessory_ltsk": "3d99f3e959a1f93af4056966f858074b2a1fdec1c5fd84a51ea96f9fa004156a",
+            "accessory_pairing_id": "12:34:56:00:01:0D",
+            "accessory_pin": "031-45-154",
+            "c#": 1,
+            "category": "Lightbulb",
+            "host_ip": "127.0.0.1",
+            "host_port": 51843,
+            "name": "unittestAsyncLight",
+            "peers": {
+                "decc6fa3-de3e-41c9-adba-ef7409821bfc": {
+                    "admin": true,
+                    "key": "d708df2fbf4a8779669f0ccd43f4962d6d49e4274f88b1292f822edc3bcf8ed8"
+                }
+            },
+            "unsuccessful_tries": 0
+        }""".encode())
+        cls.config_file.flush()
+
+        # Make sure get_id() numbers are stable between tests
+        model_mixin.id_counter = 0
+
+        cls.httpd = AccessoryServer(cls.config_file.name, None)
+        accessory = Accessory('Testlicht', 'lusiardi.de', 'Demoserver', '0001', '0.1')
+        accessory.services.append(LightBulbService())
+        cls.httpd.add_accessory(accessory)
+        t = T(cls.httpd)
+        t.start()
+        time.sleep(5)
+        cls.controller_file = tempfile.NamedTemporaryFile()
+        cls.controller_file.write("""{
+            "alias": {
+                "Connection": "IP",
+                "iOSDeviceLTPK": "d708df2fbf4a8779669f0ccd43f4962d6d49e4274f88b1292f822edc3bcf8ed8",
+                "iOSPairingId": "decc6fa3-de3e-41c9-adba-ef7409821bfc",
+                "AccessoryLTPK": "7986cf939de8986f428744e36ed72d86189bea46b4dcdc8d9d79a3e4fceb92b9",
+                "AccessoryPairingID": "12:34:56:00:01:0D",
+                "AccessoryPort": 51843,
+                "AccessoryIP": "127.0.0.1",
+                "iOSDeviceLTSK": "fa45f082ef87efc6c8c8d043d74084a3ea923a2253e323a7eb9917b4090c2fcc"
+            }
+        }""".encode())
+        cls.controller_file.flush()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.unpublish_device()
+        cls.httpd.shutdown()
+        cls.config_file.close()
+        cls.controller_file.close()
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.controller = AsyncController()
+        self.controller.load_data(self.controller_file.name)
+        self.pairing = self.controller.get_pairings()['alias']
+
+    def tearDown(self):
+        self.controller.shutdown()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_01_pairing_type(self):
+        self.assertIsInstance(self.pairing, AsyncIpPairing)
+
+    def test_02_get_accessories(self):
+        result = self.loop.run_until_complete(self.pairing.list_accessories_and_characteristics())
+        self.assertEqual(1, len(result))
+        self.assertIn('services', result[0])
+
+    def test_03_get_characteristics(self):
+        result = self.loop.run_until_complete(self.pairing.get_characteristics([(1, 4), (1, 10)]))
+        self.assertEqual('lusiardi.de', result[(1, 4)]['value'])
+        self.assertIn('value', result[(1, 10)])
+
+    def test_04_put_characteristics(self):
+        async def run():
+            result = await self.pairing.put_characteristics([(1, 10, True)])
+            values = await self.pairing.get_characteristics([(1, 10)])
+            return result, values
+
+        result, values = self.loop.run_until_complete(run())
+        self.assertEqual({}, result)
+        self.assertTrue(values[(1, 10)]['value'])
+
+    def test_04_1_list_pairings(self):
+        result = self.loop.run_until_complete(self.pairing.list_pairings())
+        self.assertEqual(1, len(result))
+        self.assertEqual('decc6fa3-de3e-41c9-adba-ef7409821bfc', result[0]['pairingId'])
+        self.assertEqual('admin', result[0]['controllerType'])
+        self.assertEqual(1, result[0]['permissions'])
+        self.assertIn('publicKey', result[0])
+
+    def test_05_requests_share_session(self):
+        async def run():
+            await self.pairing.get_characteristics([(1, 4)])
+            first = self.pairing.session
+            await self.pairing.get_characteristics([(1, 4)])
+            return first, self.pairing.session
+
+        first, second = self.loop.run_until_complete(run())
+        self.assertIs(first, second)
+        self.assertTrue(second.is_alive())
+
+    def test_06_get_events(self):
+        async def run():
+            events = await self.pairing.get_events([(1, 10)])
+            events.close()
+            received = []
+            async for event in events:
+                received.append(event)
+            return events.errors, received
+
+        errors, received = self.loop.run_until_complete(run())
+        self.assertEqual({}, errors)
+        self.assertEqual([], received)
+
+    def test_07_reconnect_after_close(self):
+        async def run():
+            await self.pairing.get_characteristics([(1, 4)])
+            first = self.pairing.session
+            first.close()
+            await self.pairing.get_characteristics([(1, 4)])
+            return first, self.pairing.session
+
+        first, second = self.loop.run_until_complete(run())
+        self.assertIsNot(first, second)
+        self.assertTrue(second.is_alive())
@@ -0,0 +1,54 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+
+from homekit.benchmark import PairVerifyStandIn, compare_with_baseline, run_benchmarks
+from homekit.crypto import get_aead_backend
+from homekit.protocol import get_session_keys
+from homekit.protocol.session_cache import SessionCache
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_run_benchmarks(self):
+        backend = get_aead_backend().name
+        results = run_benchmarks([backend], min_time=0, repeats=1)
+        self.assertIn('aead_encrypt[{b}][1024]'.format(b=backend), results['results'])
+        self.assertIn('srp_exchange', results['results'])
+        self.assertIn('get_session_keys_resume', results['results'])
+        for seconds in results['results'].values():
+            self.assertGreater(seconds, 0)
+        self.assertEqual(backend, get_aead_backend().name)
+
+    def test_run_benchmarks_filter(self):
+        results = run_benchmarks([], 'hkdf', min_time=0, repeats=1)
+        self.assertEqual(['hkdf_sha512'], list(results['results']))
+
+    def test_stand_in_session_keys(self):
+        stand_in = PairVerifyStandIn()
+        session_cache = SessionCache()
+        full = get_session_keys(None, stand_in.pairing_data, stand_in.write, session_cache)
+        resumed = get_session_keys(None, stand_in.pairing_data, stand_in.write, session_cache)
+        self.assertEqual(2, len(full))
+        self.assertNotEqual(full, resumed)
+        self.assertEqual(1, len(session_cache))
+
+    def test_compare_with_baseline(self):
+        baseline = {'results': {'a': 1.0, 'b': 1.0, 'c': 1.0}}
+        results = {'results': {'a': 1.2, 'b': 1.3, 'd': 5.0}}
+        self.assertEqual([('b', 1.0, 1.3)], compare_with_baseline(results, baseline, 0.25))
+        self.assertEqual([], compare_with_baseline(results, baseline, 0.5))
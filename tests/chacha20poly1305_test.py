@@ -14,15 +14,26 @@
 # limitations under the License.
 #
 
+import os
 import unittest
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from homekit.crypto.chacha20poly1305 import pad16, chacha20_quarter_round, chacha20_create_initial_state, \
     chacha20_aead_decrypt, chacha20_aead_verify_tag, chacha20_aead_encrypt, chacha20_block, chacha20_encrypt, calc_s, \
-    calc_r, clamp, poly1305_key_gen, poly1305_mac
+    calc_r, clamp, poly1305_key_gen, poly1305_mac, available_aead_backends, get_aead_backend, set_aead_backend, \
+    _chacha20_key_words, Poly1305
+from homekit.crypto.chacha20_numpy import chacha20_key_stream
 
 
 class TestChacha20poly1305(unittest.TestCase):
 
+    def tearDown(self):
+        set_aead_backend(None)
+
     def test_pad16_does_not_pad_multiples_of_16(self):
         input_data = b'1234567890ABCDEF'
         pad = pad16(input_data)
@@ -110,6 +121,29 @@ class TestChacha20poly1305(unittest.TestCase):
         r_ = bytearray(r_)
         self.assertEqual(r, r_)
 
+    def test_poly1305_incremental(self):
+        key = 0x85d6be7857556d337f4452fe42d506a80103808afb0db2fd4abff6af4149f51b.to_bytes(length=32, byteorder='big')
+        text = 'Cryptographic Forum Research Group'.encode()
+        for split in [(1, 2), (5, 20), (16, 32), (15, 33), (0, 34)]:
+            mac = Poly1305(key)
+            mac.update(text[:split[0]])
+            mac.update(memoryview(text)[split[0]:split[1]])
+            mac.update(bytearray(text[split[1]:]))
+            self.assertEqual(mac.finalize(), poly1305_mac(text, key), split)
+
+    def test_poly1305_pad(self):
+        key = bytes(range(32))
+        aad = bytes(range(12))
+        cipher_text = bytes(range(70))
+        mac = Poly1305(key)
+        mac.update(aad)
+        mac.pad()
+        mac.update(cipher_text[:30])
+        mac.update(cipher_text[30:])
+        mac.pad()
+        mac_data = aad + pad16(aad) + cipher_text + pad16(cipher_text)
+        self.assertEqual(mac.finalize(), poly1305_mac(mac_data, key))
+
     def test_example2_6_2(self):
         # Test aus 2.6.2
         key = 0x808182838485868788898a8b8c8d8e8f909192939495969798999a9b9c9d9e9f.to_bytes(length=32, byteorder='big')
@@ -152,3 +186,66 @@ class TestChacha20poly1305(unittest.TestCase):
         self.assertEqual(plain_text, plain_text_)
 
         self.assertFalse(chacha20_aead_decrypt(aad, key, iv, fixed, r[0] + r[1] + bytes([0, 1, 2, 3])))
+
+    def test_example2_8_2_all_backends(self):
+        plain_text = "Ladies and Gentlemen of the class of '99: If I could offer you only one tip for the future, " \
+                     "sunscreen would be it.".encode()
+        aad = 0x50515253c0c1c2c3c4c5c6c7.to_bytes(length=12, byteorder='big')
+        key = 0x808182838485868788898a8b8c8d8e8f909192939495969798999a9b9c9d9e9f.to_bytes(length=32, byteorder='big')
+        iv = 0x4041424344454647.to_bytes(length=8, byteorder='big')
+        fixed = 0x07000000.to_bytes(length=4, byteorder='big')
+        tag = bytes([0x1a, 0xe1, 0x0b, 0x59, 0x4f, 0x09, 0xe2, 0x6a, 0x7e, 0x90, 0x2e, 0xcb, 0xd0, 0x60, 0x06, 0x91])
+
+        for backend in available_aead_backends():
+            set_aead_backend(backend)
+            r = chacha20_aead_encrypt(aad, key, iv, fixed, plain_text)
+            self.assertIsInstance(r[0], bytearray, backend)
+            self.assertEqual(r[1], tag, backend)
+            self.assertEqual(chacha20_aead_decrypt(aad, key, iv, fixed, r[0] + r[1]), plain_text, backend)
+            self.assertFalse(chacha20_aead_decrypt(aad, key, iv, fixed, r[0] + r[1] + bytes([0, 1, 2, 3])), backend)
+
+    def test_backends_are_byte_identical(self):
+        key = bytes(range(32))
+        iv = (42).to_bytes(8, byteorder='little')
+        for length in [0, 1, 15, 16, 17, 63, 64, 65, 1024]:
+            plain_text = bytes([i % 251 for i in range(length)])
+            aad = length.to_bytes(2, byteorder='little')
+            results = set()
+            for backend in available_aead_backends():
+                set_aead_backend(backend)
+                cipher_text, tag = chacha20_aead_encrypt(aad, key, iv, bytes([0, 0, 0, 0]), plain_text)
+                results.add(bytes(cipher_text + tag))
+                self.assertEqual(chacha20_aead_decrypt(aad, key, iv, bytes([0, 0, 0, 0]), cipher_text + tag),
+                                 plain_text, backend)
+            self.assertEqual(len(results), 1, 'length {l}'.format(l=length))
+
+    def test_python_backend_always_available(self):
+        self.assertIn('python', available_aead_backends())
+        set_aead_backend('python')
+        self.assertEqual(get_aead_backend().name, 'python')
+
+    def test_set_unknown_backend(self):
+        self.assertRaises(ValueError, set_aead_backend, 'does-not-exist')
+
+    def test_backend_from_environment(self):
+        os.environ['HOMEKIT_AEAD_BACKEND'] = 'python'
+        try:
+            set_aead_backend(None)
+            self.assertEqual(get_aead_backend().name, 'python')
+        finally:
+            del os.environ['HOMEKIT_AEAD_BACKEND']
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_numpy_key_stream_matches_chacha20_block(self):
+        key = bytes(range(32))
+        nonce = bytes([0, 0, 0, 9, 0, 0, 0, 0x4a, 0, 0, 0, 0])
+        key_words = _chacha20_key_words(key)
+        # the last block wraps the 32 bit counter around
+        key_stream = chacha20_key_stream(key_words, nonce, 0xfffffffe, 3 * 64)
+        for i, counter in enumerate([0xfffffffe, 0xffffffff, 0]):
+            self.assertEqual(key_stream[i * 64:(i + 1) * 64], chacha20_block(key, nonce, counter).to_bytes(64, 'big'))
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_numpy_backend_preferred_over_python(self):
+        backends = available_aead_backends()
+        self.assertLess(backends.index('numpy'), backends.index('python'))
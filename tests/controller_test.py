@@ -15,6 +15,7 @@
 #
 
 import unittest
+from unittest import mock
 import tempfile
 import threading
 import time
@@ -26,6 +27,7 @@ from homekit.exceptions import AccessoryNotFoundError, AlreadyPairedError, Unava
 from homekit.model import Accessory
 from homekit.model.services import LightBulbService
 from homekit.model import mixin as model_mixin
+from homekit.protocol import get_resume_key
 from homekit.tools import BLE_TRANSPORT_SUPPORTED, IP_TRANSPORT_SUPPORTED
 
 if BLE_TRANSPORT_SUPPORTED:
@@ -372,6 +374,32 @@ class TestControllerIpPaired(unittest.TestCase):
         self.assertEqual(1, identify)
         identify = 0
 
+    def test_08_resume_session(self):
+        """Tests that a reconnect resumes the session established by the first pair verify."""
+        self.controller.load_data(self.controller_file.name)
+        pairing = self.controller.get_pairings()['alias']
+        pairing.list_accessories_and_characteristics()
+        self.assertEqual(1, len(self.controller.session_cache))
+        pairing.close()
+        pairing.session = None
+
+        with mock.patch('homekit.protocol.get_resume_key', wraps=get_resume_key) as resume_key:
+            result = pairing.get_characteristics([(1, 4)])
+        self.assertEqual('lusiardi.de', result[(1, 4)]['value'])
+        infos = [call[0][3] for call in resume_key.call_args_list]
+        self.assertIn('Pair-Resume-Shared-Secret-Info', infos)
+        self.assertEqual(1, len(self.controller.session_cache))
+
+    def test_08_resume_unknown_session(self):
+        """Tests that pair verify falls back to the full verification if the accessory does not know the session."""
+        self.controller.load_data(self.controller_file.name)
+        self.controller.session_cache.add(bytes(8), '12:34:56:00:01:0A', bytes(32))
+        pairing = self.controller.get_pairings()['alias']
+        result = pairing.get_characteristics([(1, 4)])
+        self.assertEqual('lusiardi.de', result[(1, 4)]['value'])
+        self.assertEqual(1, len(self.controller.session_cache))
+        self.assertIsNone(self.controller.session_cache.pop(bytes(8)))
+
     def test_99_remove_pairing(self):
         """Tests that a removed pairing is not present in the list of pairings anymore."""
         self.controller.load_data(self.controller_file.name)
@@ -0,0 +1,204 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import os
+import socket
+import threading
+import time
+import unittest
+
+from homekit.crypto.hap_cipher import HapCipher
+from homekit.exceptions import AccessoryDisconnectedError, AccessoryNotFoundError, TransportNotSupportedError
+from homekit.http_impl.frame_reader import FrameReader
+from homekit.http_impl.secure_http import SecureHttp
+from homekit.tools import IP_TRANSPORT_SUPPORTED
+
+if IP_TRANSPORT_SUPPORTED:
+    from homekit.controller.event_hub import EventHub
+    from homekit.controller.ip_implementation import IpPairing
+
+
+def wait_for(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class FakeAccessory(threading.Thread):
+    """
+    Answers registrations for events with 204, or with 207 for characteristics with iid 99, and sends events on
+    request.
+    """
+
+    def __init__(self, sock, c2a_key, a2c_key):
+        threading.Thread.__init__(self, daemon=True)
+        self.sock = sock
+        self.reader = FrameReader(sock, HapCipher(c2a_key))
+        self.a2c_cipher = HapCipher(a2c_key)
+        self.lock = threading.Lock()
+        self.registrations = []
+        self.disconnected = False
+
+    def _send(self, data):
+        with self.lock:
+            self.sock.setblocking(True)
+            self.sock.sendall(b''.join(self.a2c_cipher.encrypt_frames(data)))
+
+    def send_event(self, *values):
+        body = json.dumps({'characteristics': [{'aid': aid, 'iid': iid, 'value': value}
+                                               for aid, iid, value in values]}).encode()
+        self._send('EVENT/1.0 200 OK\r\nContent-Type: application/hap+json\r\nContent-Length: {}\r\n\r\n'
+                   .format(len(body)).encode() + body)
+
+    def disconnect(self):
+        self.sock.shutdown(socket.SHUT_RDWR)
+
+    def run(self):
+        while True:
+            try:
+                request = self.reader.read_frame(10)
+            except (AccessoryDisconnectedError, OSError):
+                self.disconnected = True
+                return
+            if request is None:
+                continue
+            # the requests are small enough for one frame
+            body = json.loads(bytes(request).split(b'\r\n\r\n', 1)[1].decode())['characteristics']
+            rejected = [{'aid': c['aid'], 'iid': c['iid'], 'status': -70406} for c in body if c['iid'] == 99]
+            if rejected:
+                data = json.dumps({'characteristics': rejected}).encode()
+                self._send('HTTP/1.1 207 Multi-Status\r\nContent-Length: {}\r\n\r\n'.format(len(data)).encode() + data)
+            else:
+                self._send(b'HTTP/1.1 204 No Content\r\n\r\n')
+            self.registrations.append([(c['aid'], c['iid'], c['ev']) for c in body])
+
+
+class FakeSession:
+    def __init__(self, pairing_data, session_cache=None):
+        self.sock, accessory_sock = socket.socketpair()
+        self.c2a_key = os.urandom(32)
+        self.a2c_key = os.urandom(32)
+        self.pairing_data = pairing_data
+        self.sec_http = SecureHttp(self)
+        self.accessory = FakeAccessory(accessory_sock, self.c2a_key, self.a2c_key)
+        self.accessory.start()
+
+    def close(self):
+        self.sec_http.close()
+        self.sock.close()
+
+
+@unittest.skipIf(not IP_TRANSPORT_SUPPORTED, 'IP transport not supported')
+class TestEventHub(unittest.TestCase):
+    def setUp(self):
+        self.sessions = {}
+        self.events = []
+        self.errors = []
+        self.pairings = {}
+        for alias in ['a', 'b', 'c']:
+            self.pairings[alias] = IpPairing({'AccessoryIP': '127.0.0.1', 'AccessoryPort': 1, 'alias': alias})
+        self.hub = EventHub(self.pairings, lambda alias, error: self.errors.append((alias, error)),
+                            min_retry_delay=0.05, session_factory=self._create_session)
+        self.hub.add_handler(self._handle)
+
+    def tearDown(self):
+        self.hub.stop()
+
+    def _create_session(self, pairing_data, session_cache):
+        session = FakeSession(pairing_data, session_cache)
+        self.sessions.setdefault(pairing_data['alias'], []).append(session)
+        return session
+
+    def _handle(self, alias, aid, iid, value):
+        self.events.append((threading.current_thread().name, alias, aid, iid, value))
+
+    def _accessory(self, alias, index=-1):
+        self.assertTrue(wait_for(lambda: len(self.sessions.get(alias, [])) > max(index, 0)))
+        return self.sessions[alias][index].accessory
+
+    def test_events_of_many_accessories(self):
+        for alias in self.pairings:
+            self.hub.subscribe(alias, [(1, 10), (1, 11)])
+        self.hub.start()
+        for alias in self.pairings:
+            accessory = self._accessory(alias)
+            self.assertTrue(wait_for(lambda: accessory.registrations))
+            self.assertEqual([[(1, 10, True), (1, 11, True)]], accessory.registrations)
+            accessory.send_event((1, 10, alias), (1, 11, 2))
+        self.assertTrue(wait_for(lambda: len(self.events) == 6))
+        # all handlers are called by the hub's thread
+        self.assertEqual({'EventHub'}, {event[0] for event in self.events})
+        self.assertEqual({('a', 1, 10, 'a'), ('b', 1, 10, 'b'), ('c', 1, 10, 'c')},
+                         {event[1:] for event in self.events if event[3] == 10})
+        self.assertEqual(1, len(self.sessions['a']))
+
+    def test_subscribe_while_running(self):
+        self.hub.start()
+        self.hub.subscribe('a', [(1, 10)])
+        accessory = self._accessory('a')
+        self.assertTrue(wait_for(lambda: accessory.registrations))
+        self.hub.subscribe('a', [(1, 10), (1, 11)])
+        self.assertTrue(wait_for(lambda: len(accessory.registrations) == 2))
+        self.assertEqual([(1, 11, True)], accessory.registrations[1])
+        self.assertEqual(1, len(self.sessions['a']))
+
+    def test_resubscribe_after_disconnect(self):
+        self.hub.subscribe('a', [(1, 10), (1, 11)])
+        self.hub.start()
+        accessory = self._accessory('a', 0)
+        self.assertTrue(wait_for(lambda: accessory.registrations))
+        accessory.disconnect()
+
+        accessory = self._accessory('a', 1)
+        self.assertTrue(wait_for(lambda: accessory.registrations))
+        self.assertEqual([[(1, 10, True), (1, 11, True)]], accessory.registrations)
+        self.assertIsInstance(self.errors[0][1], AccessoryDisconnectedError)
+        accessory.send_event((1, 11, 42))
+        self.assertTrue(wait_for(lambda: self.events))
+        self.assertEqual(('EventHub', 'a', 1, 11, 42), self.events[0])
+
+    def test_rejected_and_unsubscribe(self):
+        self.hub.subscribe('a', [(1, 10), (1, 99)])
+        self.hub.subscribe('b', [(1, 10)])
+        self.hub.start()
+        accessory = self._accessory('a')
+        self.assertTrue(wait_for(lambda: self.hub.get_subscriptions()['a'] == {(1, 10)}))
+
+        self.hub.unsubscribe('a', [(1, 10)])
+        self.assertTrue(wait_for(lambda: accessory.disconnected))
+        self.assertEqual({'b': {(1, 10)}}, self.hub.get_subscriptions())
+        self.assertEqual(1, len(self.sessions['a']))
+
+    def test_subscribe_errors(self):
+        self.pairings['ble'] = object()
+        self.assertRaises(AccessoryNotFoundError, self.hub.subscribe, 'unknown', [(1, 10)])
+        self.assertRaises(TransportNotSupportedError, self.hub.subscribe, 'ble', [(1, 10)])
+
+    def test_stop_closes_sessions(self):
+        self.hub.subscribe('a', [(1, 10)])
+        self.hub.start()
+        accessory = self._accessory('a')
+        self.assertTrue(wait_for(lambda: accessory.registrations))
+        self.hub.stop()
+        self.assertTrue(wait_for(lambda: accessory.disconnected))
+        # the subscriptions are registered again on the next start
+        self.hub.start()
+        accessory = self._accessory('a', 1)
+        self.assertTrue(wait_for(lambda: accessory.registrations))
@@ -0,0 +1,165 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import asyncio
+import time
+import unittest
+
+from homekit import Controller
+from homekit.exceptions import AccessoryDisconnectedError, AccessoryNotFoundError, AccessoryTimeoutError, \
+    TransportNotSupportedError
+from homekit.tools import IP_TRANSPORT_SUPPORTED
+
+if IP_TRANSPORT_SUPPORTED:
+    from homekit.controller.async_ip_implementation import AsyncController, AsyncIpPairing
+
+
+class FakePairing:
+    def __init__(self, delay=0, error=None):
+        self.delay = delay
+        self.error = error
+        self.calls = []
+
+    def _get_pairing_data(self):
+        return {'Connection': 'BLE'}
+
+    def get_characteristics(self, characteristics, **kwargs):
+        self.calls.append((characteristics, kwargs))
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return {(aid, iid): {'value': iid} for aid, iid in characteristics}
+
+    def put_characteristics(self, characteristics, do_conversion=False):
+        self.calls.append((characteristics, do_conversion))
+        time.sleep(self.delay)
+        return {}
+
+
+if IP_TRANSPORT_SUPPORTED:
+    class AsyncFakePairing(FakePairing, AsyncIpPairing):
+        async def get_characteristics(self, characteristics, **kwargs):
+            self.calls.append((characteristics, kwargs))
+            await asyncio.sleep(self.delay)
+            if self.error:
+                raise self.error
+            return {(aid, iid): {'value': iid} for aid, iid in characteristics}
+
+        async def put_characteristics(self, characteristics, do_conversion=False):
+            self.calls.append((characteristics, do_conversion))
+            await asyncio.sleep(self.delay)
+            return {}
+
+
+class TestFanOut(unittest.TestCase):
+    def setUp(self):
+        self.controller = Controller()
+
+    def test_requests_run_concurrently(self):
+        for i in range(4):
+            self.controller.pairings['p{}'.format(i)] = FakePairing(delay=0.5)
+        start = time.monotonic()
+        results, errors = self.controller.get_characteristics({'p{}'.format(i): [(1, i)] for i in range(4)})
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertEqual({}, errors)
+        self.assertEqual({'p{}'.format(i): {(1, i): {'value': i}} for i in range(4)}, results)
+
+    def test_partial_results(self):
+        self.controller.pairings['ok'] = FakePairing()
+        self.controller.pairings['broken'] = FakePairing(error=AccessoryDisconnectedError('gone'))
+        results, errors = self.controller.get_characteristics(
+            {'ok': [(1, 2)], 'broken': [(1, 2)], 'unknown': [(1, 2)]}, include_meta=True)
+        self.assertEqual({'ok': {(1, 2): {'value': 2}}}, results)
+        self.assertIsInstance(errors['broken'], AccessoryDisconnectedError)
+        self.assertIsInstance(errors['unknown'], AccessoryNotFoundError)
+        self.assertEqual([([(1, 2)], {'include_meta': True})], self.controller.pairings['ok'].calls)
+
+    def test_timeout_per_accessory(self):
+        self.controller.pairings['fast'] = FakePairing(delay=0.1)
+        self.controller.pairings['slow'] = FakePairing(delay=3)
+        start = time.monotonic()
+        results, errors = self.controller.get_characteristics({'fast': [(1, 2)], 'slow': [(1, 2)]}, timeout=0.5)
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertIn('fast', results)
+        self.assertIsInstance(errors['slow'], AccessoryTimeoutError)
+
+    def test_timeout_starts_with_the_request(self):
+        # with one worker the requests run one after another, each within its own timeout
+        for i in range(3):
+            self.controller.pairings['p{}'.format(i)] = FakePairing(delay=0.2)
+        results, errors = self.controller.get_characteristics({'p{}'.format(i): [(1, 2)] for i in range(3)},
+                                                              timeout=0.5, max_workers=1)
+        self.assertEqual({}, errors)
+        self.assertEqual(3, len(results))
+
+    def test_put_characteristics(self):
+        self.controller.pairings['a'] = FakePairing()
+        self.controller.pairings['b'] = FakePairing()
+        results, errors = self.controller.put_characteristics({'a': [(1, 2, True)], 'b': [(1, 3, 1)]},
+                                                              do_conversion=True)
+        self.assertEqual({'a': {}, 'b': {}}, results)
+        self.assertEqual({}, errors)
+        self.assertEqual([([(1, 3, 1)], True)], self.controller.pairings['b'].calls)
+
+    def test_no_requests(self):
+        self.assertEqual(({}, {}), self.controller.get_characteristics({}))
+
+
+@unittest.skipIf(not IP_TRANSPORT_SUPPORTED, 'IP transport not supported')
+class TestAsyncFanOut(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.controller = AsyncController()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_requests_run_concurrently(self):
+        for i in range(4):
+            self.controller.pairings['p{}'.format(i)] = AsyncFakePairing(delay=0.5)
+        start = time.monotonic()
+        results, errors = self.loop.run_until_complete(
+            self.controller.get_characteristics({'p{}'.format(i): [(1, i)] for i in range(4)}))
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertEqual({}, errors)
+        self.assertEqual(4, len(results))
+
+    def test_partial_results_and_timeout(self):
+        self.controller.pairings['ok'] = AsyncFakePairing()
+        self.controller.pairings['slow'] = AsyncFakePairing(delay=3)
+        self.controller.pairings['broken'] = AsyncFakePairing(error=AccessoryDisconnectedError('gone'))
+        results, errors = self.loop.run_until_complete(self.controller.get_characteristics(
+            {'ok': [(1, 2)], 'slow': [(1, 2)], 'broken': [(1, 2)], 'unknown': [(1, 2)]}, timeout=0.5))
+        self.assertEqual({'ok': {(1, 2): {'value': 2}}}, results)
+        self.assertIsInstance(errors['slow'], AccessoryTimeoutError)
+        self.assertIsInstance(errors['broken'], AccessoryDisconnectedError)
+        self.assertIsInstance(errors['unknown'], AccessoryNotFoundError)
+
+    def test_sync_pairings_are_rejected(self):
+        self.controller.pairings['ok'] = AsyncFakePairing()
+        self.controller.pairings['ble'] = FakePairing()
+        results, errors = self.loop.run_until_complete(
+            self.controller.get_characteristics({'ok': [(1, 2)], 'ble': [(1, 2)]}))
+        self.assertEqual({'ok': {(1, 2): {'value': 2}}}, results)
+        self.assertIsInstance(errors['ble'], TransportNotSupportedError)
+        self.assertEqual([], self.controller.pairings['ble'].calls)
+
+    def test_put_characteristics(self):
+        self.controller.pairings['a'] = AsyncFakePairing()
+        results, errors = self.loop.run_until_complete(
+            self.controller.put_characteristics({'a': [(1, 2, True)]}, do_conversion=True))
+        self.assertEqual({'a': {}}, results)
+        self.assertEqual([([(1, 2, True)], True)], self.controller.pairings['a'].calls)
@@ -0,0 +1,105 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import socket
+import threading
+import unittest
+
+from homekit.crypto.hap_cipher import HapCipher
+from homekit.exceptions import AccessoryDisconnectedError, EncryptionError
+from homekit.http_impl.frame_reader import FrameReader, MAX_FRAME_SIZE
+from homekit.http_impl.frame_writer import send_buffers
+
+KEY = bytes(range(32))
+
+
+class TestFrameReader(unittest.TestCase):
+
+    def setUp(self):
+        self.sender, self.receiver = socket.socketpair()
+        self.cipher = HapCipher(KEY)
+
+    def tearDown(self):
+        self.sender.close()
+        self.receiver.close()
+
+    def _frames(self, data: bytes) -> bytes:
+        return b''.join(self.cipher.encrypt_frames(data))
+
+    def _read_message(self, reader, length):
+        data = bytearray()
+        while len(data) < length:
+            frame = reader.read_frame(1)
+            self.assertIsNotNone(frame)
+            data += frame
+        return bytes(data)
+
+    def test_frames_received_together(self):
+        message = bytes(range(256)) * 10
+        self.sender.sendall(self._frames(message))
+        reader = FrameReader(self.receiver, HapCipher(KEY))
+        self.assertEqual(message[:1024], reader.read_frame(1))
+        # all frames were received with the first call
+        self.assertEqual(1042 + 530, reader.buffered())
+        self.assertEqual(message[1024:], self._read_message(reader, len(message) - 1024))
+        self.assertEqual(0, reader.buffered())
+
+    def test_partial_frame(self):
+        data = self._frames(b'Hello, World')
+        reader = FrameReader(self.receiver, HapCipher(KEY))
+        self.sender.sendall(data[:1])
+        self.assertIsNone(reader.read_frame(0.01))
+        self.sender.sendall(data[1:10])
+        self.assertIsNone(reader.read_frame(0.01))
+        threading.Timer(0.05, self.sender.sendall, args=(data[10:],)).start()
+        self.assertEqual(b'Hello, World', reader.read_frame(1))
+
+    def test_timeout(self):
+        reader = FrameReader(self.receiver, HapCipher(KEY))
+        self.assertIsNone(reader.read_frame(0.01))
+
+    def test_messages_stay_separated(self):
+        self.sender.sendall(self._frames(b'first') + self._frames(b'second'))
+        reader = FrameReader(self.receiver, HapCipher(KEY))
+        self.assertEqual(b'first', reader.read_frame(1))
+        self.assertEqual(2 + 6 + 16, reader.buffered())
+        self.assertEqual(b'second', reader.read_frame(1))
+
+    def test_small_buffer(self):
+        # the buffer holds only one frame, so unread data is moved to its front
+        message = bytes(i % 251 for i in range(20000))
+        reader = FrameReader(self.receiver, HapCipher(KEY), buffer_size=MAX_FRAME_SIZE + 100)
+        thread = threading.Thread(target=send_buffers, args=(self.sender, self.cipher.encrypt_frames(message)))
+        thread.start()
+        self.assertEqual(message, self._read_message(reader, len(message)))
+        thread.join()
+
+    def test_closed(self):
+        self.sender.sendall(self._frames(b'last'))
+        self.sender.close()
+        reader = FrameReader(self.receiver, HapCipher(KEY))
+        self.assertEqual(b'last', reader.read_frame(1))
+        self.assertRaises(AccessoryDisconnectedError, reader.read_frame, 1)
+
+    def test_wrong_key(self):
+        self.sender.sendall(self._frames(b'data'))
+        reader = FrameReader(self.receiver, HapCipher(bytes(32)))
+        self.assertRaises(EncryptionError, reader.read_frame, 1)
+
+    def test_frame_too_long(self):
+        self.sender.sendall(b'\xff\xff' + bytes(100))
+        reader = FrameReader(self.receiver, HapCipher(KEY))
+        self.assertRaises(EncryptionError, reader.read_frame, 1)
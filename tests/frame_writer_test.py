@@ -0,0 +1,77 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import socket
+import threading
+import unittest
+
+from homekit.crypto.hap_cipher import HapCipher
+from homekit.http_impl.frame_writer import send_buffers, write_frames
+
+
+class _SendallOnly:
+    def __init__(self):
+        self.data = b''
+
+    def sendall(self, data):
+        self.data += data
+
+
+class TestFrameWriter(unittest.TestCase):
+
+    def _receive(self, sock, length, result):
+        data = bytearray()
+        while len(data) < length:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        result.append(bytes(data))
+
+    def test_send_buffers_non_blocking(self):
+        # much more data than fits into the socket buffers, so sendmsg writes partially and has to wait
+        sender, receiver = socket.socketpair()
+        buffers = [bytes([i % 256]) * (1000 + i) for i in range(2000)]
+        expected = b''.join(buffers)
+        result = []
+        thread = threading.Thread(target=self._receive, args=(receiver, len(expected), result))
+        thread.start()
+        sender.setblocking(0)
+        send_buffers(sender, buffers)
+        thread.join()
+        sender.close()
+        receiver.close()
+        self.assertEqual(expected, result[0])
+
+    def test_send_buffers_without_sendmsg(self):
+        sock = _SendallOnly()
+        send_buffers(sock, [b'abc', bytearray(b''), memoryview(b'def')])
+        self.assertEqual(b'abcdef', sock.data)
+
+    def test_write_frames(self):
+        key = bytes(range(32))
+        data = b'x' * 3000
+        sock = _SendallOnly()
+        write_frames(sock, HapCipher(key), data)
+        receiver = HapCipher(key)
+        plain_text = b''
+        frames = sock.data
+        while frames:
+            length = int.from_bytes(frames[0:2], byteorder='little')
+            plain_text += receiver.decrypt_frame(length, frames[2:length + 18])
+            frames = frames[length + 18:]
+        self.assertEqual(data, plain_text)
+        self.assertEqual(3, receiver.counter)
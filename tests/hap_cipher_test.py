@@ -0,0 +1,86 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+
+from homekit.crypto.chacha20poly1305 import chacha20_aead_encrypt, chacha20_aead_decrypt, available_aead_backends, \
+    set_aead_backend
+from homekit.crypto.hap_cipher import HapCipher
+
+
+class TestHapCipher(unittest.TestCase):
+    key = bytes(range(32))
+
+    def tearDown(self):
+        set_aead_backend(None)
+
+    def test_encrypt_frame_matches_aead_encrypt(self):
+        for backend in available_aead_backends():
+            set_aead_backend(backend)
+            cipher = HapCipher(self.key)
+            for counter in range(0, 3):
+                block = ('block {c}'.format(c=counter) * 100).encode()
+                len_bytes = len(block).to_bytes(2, byteorder='little')
+                expected = chacha20_aead_encrypt(len_bytes, self.key, counter.to_bytes(8, byteorder='little'),
+                                                 bytes([0, 0, 0, 0]), block)
+                frame = cipher.encrypt_frame(block)
+                self.assertEqual(bytes(frame), len_bytes + expected[0] + expected[1], backend)
+            self.assertEqual(cipher.counter, 3)
+
+    def test_decrypt_frame(self):
+        for backend in available_aead_backends():
+            set_aead_backend(backend)
+            sender = HapCipher(self.key)
+            receiver = HapCipher(self.key)
+            for counter in range(0, 3):
+                frame = sender.encrypt_frame(b'some data')
+                length = int.from_bytes(frame[0:2], byteorder='little')
+                self.assertEqual(receiver.decrypt_frame(length, frame[2:]), b'some data', backend)
+            self.assertEqual(receiver.counter, 3)
+
+    def test_decrypt_with_bad_tag_keeps_counter(self):
+        for backend in available_aead_backends():
+            set_aead_backend(backend)
+            data = HapCipher(self.key).encrypt(b'payload')
+            receiver = HapCipher(self.key)
+            self.assertFalse(receiver.decrypt(data + b'\x00'))
+            self.assertEqual(receiver.counter, 0)
+            self.assertEqual(receiver.decrypt(data), b'payload')
+            self.assertEqual(receiver.counter, 1)
+
+    def test_interoperates_with_aead_decrypt(self):
+        cipher = HapCipher(self.key)
+        cipher.encrypt(b'first')
+        data = cipher.encrypt(b'second')
+        self.assertEqual(chacha20_aead_decrypt(bytes(), self.key, (1).to_bytes(8, byteorder='little'),
+                                               bytes([0, 0, 0, 0]), bytes(data)), b'second')
+
+    def test_encrypt_frames(self):
+        for backend in available_aead_backends():
+            set_aead_backend(backend)
+            data = bytes(range(256)) * 9
+            reference = HapCipher(self.key)
+            frames = b''.join(reference.encrypt_frame(data[o:o + 1024]) for o in range(0, len(data), 1024))
+            cipher = HapCipher(self.key)
+            buffers = cipher.encrypt_frames(data)
+            self.assertEqual(6, len(buffers))
+            self.assertEqual(frames, b''.join(buffers), backend)
+            self.assertEqual(cipher.counter, 3)
+
+    def test_encrypt_frames_empty(self):
+        cipher = HapCipher(self.key)
+        self.assertEqual([], cipher.encrypt_frames(b''))
+        self.assertEqual(cipher.counter, 0)
@@ -16,6 +16,7 @@
 import unittest
 import json
 
+from homekit.exceptions import HttpException
 from homekit.http_impl.response import HttpResponse
 
 
@@ -169,3 +170,59 @@ class TestHttpResponse(unittest.TestCase):
         self.assertEqual(res.code, 200)
         self.assertEqual(res.get_http_name(), 'HTTP')
         json.loads(res.body.decode())
+
+    def test_chunked_byte_by_byte(self):
+        data = b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nHello\r\n7;ext=1\r\n, World\r\n0\r\n\r\n'
+        response = HttpResponse()
+        for i in range(0, len(data)):
+            self.assertFalse(response.is_read_completely())
+            response.parse(data[i:i + 1])
+        self.assertTrue(response.is_read_completely())
+        self.assertEqual(b'Hello, World', response.body)
+
+    def test_chunked_waits_for_final_line(self):
+        response = HttpResponse()
+        response.parse(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n3\r\nabc\r\n0\r\n')
+        self.assertFalse(response.is_read_completely())
+        response.parse(b'X-Trailer: 1\r\n')
+        self.assertFalse(response.is_read_completely())
+        response.parse(b'\r\n')
+        self.assertTrue(response.is_read_completely())
+        self.assertEqual(b'abc', response.body)
+
+    def test_chunked_large(self):
+        chunks = [bytes([i % 256]) * 1000 for i in range(200)]
+        data = b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+        data += b''.join('{:x}\r\n'.format(len(c)).encode() + c + b'\r\n' for c in chunks) + b'0\r\n\r\n'
+        response = HttpResponse()
+        for offset in range(0, len(data), 1040):
+            response.parse(data[offset:offset + 1040])
+            # the consumed data is dropped from time to time
+            self.assertLess(len(response._buffer), 2 * HttpResponse.COMPACT_THRESHOLD + 1040)
+        self.assertTrue(response.is_read_completely())
+        self.assertEqual(b''.join(chunks), response.body)
+
+    def test_chunked_malformed(self):
+        response = HttpResponse()
+        response.parse(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n')
+        self.assertRaises(HttpException, response.parse, b'xyz\r\n')
+        response = HttpResponse()
+        response.parse(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n')
+        self.assertRaises(HttpException, response.parse, b'2\r\nabcd\r\n')
+
+    def test_content_length_split(self):
+        body = b'{"value": "\r\n"}'
+        data = 'HTTP/1.1 200 OK\r\nContent-Length: {}\r\n\r\n'.format(len(body)).encode() + body
+        response = HttpResponse()
+        for i in range(0, len(data), 3):
+            response.parse(data[i:i + 3])
+        self.assertTrue(response.is_read_completely())
+        self.assertEqual(body, response.read())
+        with response.body_view() as view:
+            self.assertEqual(body, view.tobytes())
+
+    def test_no_content(self):
+        response = HttpResponse()
+        response.parse(b'HTTP/1.1 204 No Content\r\n\r\n')
+        self.assertTrue(response.is_read_completely())
+        self.assertEqual(b'', response.body)
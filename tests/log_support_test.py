@@ -0,0 +1,54 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import logging
+import unittest
+from unittest import mock
+
+from homekit.log_support import DIAGNOSTICS, LazyFormat, lazy_hex
+from homekit.protocol.tlv import TLV
+
+
+class TestLogSupport(unittest.TestCase):
+
+    def test_lazy_format(self):
+        function = mock.Mock(return_value='formatted')
+        argument = LazyFormat(function, 1, 2)
+        function.assert_not_called()
+        self.assertEqual('value formatted', 'value %s' % argument)
+        function.assert_called_once_with(1, 2)
+
+    def test_lazy_hex(self):
+        self.assertEqual('00ff', str(lazy_hex(b'\x00\xff')))
+        self.assertEqual('00ff', str(lazy_hex(bytearray(b'\x00\xff'))))
+        self.assertEqual('00ff', str(lazy_hex([0, 255])))
+
+    def test_tlv_not_formatted_without_debug(self):
+        logger = logging.getLogger('homekit.protocol.tlv')
+        level = logger.level
+        logger.setLevel(logging.INFO)
+        try:
+            with mock.patch.object(TLV, 'to_string', side_effect=AssertionError('formatted')):
+                data = TLV.encode_list([(TLV.kTLVType_State, TLV.M1)])
+                TLV.decode_bytes(data)
+        finally:
+            logger.setLevel(level)
+
+    @unittest.skipUnless(DIAGNOSTICS, 'diagnostics are disabled')
+    def test_tlv_formatted_with_debug(self):
+        with self.assertLogs('homekit.protocol.tlv', logging.DEBUG) as logs:
+            TLV.encode_list([(TLV.kTLVType_State, TLV.M1)])
+        self.assertIn('sending', logs.output[0])
@@ -0,0 +1,159 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import threading
+import time
+import unittest
+
+from homekit.controller.polling import PollingScheduler
+from homekit.exceptions import AccessoryDisconnectedError, AccessoryNotFoundError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakePairing:
+    def __init__(self):
+        self.values = {}
+        self.requests = []
+        self.error = None
+
+    def get_characteristics(self, characteristics):
+        self.requests.append(sorted(characteristics))
+        if self.error:
+            raise self.error
+        return {c: {'value': self.values.get(c, 0)} if c in self.values else
+                {'status': -70409, 'description': 'Resource does not exist.'} for c in characteristics}
+
+
+class TestPollingScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.pairing = FakePairing()
+        self.pairing.values = {(1, 10): 20.5, (1, 11): 40, (1, 12): True}
+        self.changes = []
+        self.errors = []
+        self.scheduler = PollingScheduler({'alias': self.pairing}, self._changed, self._failed, jitter=0,
+                                          clock=self.clock)
+
+    def _changed(self, alias, aid, iid, value):
+        self.changes.append((alias, aid, iid, value))
+
+    def _failed(self, alias, error):
+        self.errors.append((alias, error))
+
+    def _run_until(self, end):
+        # advance the fake clock from one due time to the next
+        while self.scheduler.next_due() is not None and self.scheduler.next_due() <= end:
+            self.clock.now = max(self.clock.now, self.scheduler.next_due())
+            self.scheduler.poll()
+        self.clock.now = end
+
+    def test_nothing_to_poll(self):
+        self.assertIsNone(self.scheduler.next_due())
+        self.assertEqual(0, self.scheduler.poll())
+
+    def test_first_read_within_interval(self):
+        self.scheduler.add('alias', [(1, 10), (1, 11)], interval=10)
+        due = self.scheduler.next_due()
+        self.assertTrue(1000 <= due <= 1010)
+        self._run_until(1010)
+        # both are read with one request and reported
+        self.assertEqual([[(1, 10), (1, 11)]], self.pairing.requests)
+        self.assertEqual([('alias', 1, 10, 20.5), ('alias', 1, 11, 40)], sorted(self.changes))
+
+    def test_backoff_and_reset(self):
+        self.scheduler.add('alias', [(1, 10)], interval=1, max_interval=4)
+        self._run_until(1001)
+        start = self.clock.now
+        self.pairing.requests = []
+        # unchanged: read after 2, 4, 4, 4 ... seconds
+        self._run_until(start + 14)
+        self.assertEqual(4, len(self.pairing.requests))
+        self.assertEqual(1, len(self.changes))
+
+        self.pairing.values[(1, 10)] = 21.0
+        self._run_until(self.scheduler.next_due())
+        self.assertEqual(('alias', 1, 10, 21.0), self.changes[-1])
+        # after the change the interval is back at 1 second
+        self.assertEqual(self.clock.now + 1, self.scheduler.next_due())
+
+    def test_coalesce_characteristics_of_one_accessory(self):
+        self.scheduler.add('alias', [(1, 10)], interval=10)
+        self.scheduler.add('alias', [(1, 11)], interval=10)
+        self._run_until(1400)
+        # characteristics added later join the next read of the accessory and stay together from then on
+        self.assertLess(5, len(self.pairing.requests))
+        for request in self.pairing.requests:
+            self.assertEqual([(1, 10), (1, 11)], request)
+
+        # one that is due much more often than the others only takes them along when they are almost due
+        self.scheduler.add('alias', [(1, 12)], interval=1)
+        self.pairing.requests = []
+        self._run_until(1500)
+        self.assertIn([(1, 12)], self.pairing.requests)
+        self.assertIn([(1, 10), (1, 11), (1, 12)], self.pairing.requests)
+
+    def test_characteristics_with_status(self):
+        self.scheduler.add('alias', [(1, 10), (1, 99)], interval=1)
+        self._run_until(1001)
+        self.assertEqual([('alias', 1, 10, 20.5)], self.changes)
+
+    def test_errors(self):
+        self.scheduler.add('alias', [(1, 10)], interval=1)
+        self.scheduler.add('unknown', [(1, 10)], interval=1)
+        self.pairing.error = AccessoryDisconnectedError('gone')
+        self._run_until(1001)
+        self.assertEqual({'alias', 'unknown'}, {alias for alias, _ in self.errors})
+        self.assertIsInstance(dict(self.errors)['unknown'], AccessoryNotFoundError)
+        self.assertEqual([], self.changes)
+        # failing accessories are read less often
+        self.assertTrue(self.scheduler.next_due() >= self.clock.now + 1)
+
+    def test_remove(self):
+        self.scheduler.add('alias', [(1, 10), (1, 11)], interval=1)
+        self.scheduler.remove('alias', [(1, 10)])
+        self._run_until(1001)
+        self.assertEqual([[(1, 11)]], self.pairing.requests)
+        self.scheduler.remove('alias')
+        self.assertIsNone(self.scheduler.next_due())
+
+    def test_jitter(self):
+        scheduler = PollingScheduler({'alias': self.pairing}, self._changed, jitter=0.5, clock=self.clock)
+        scheduler.add('alias', [(1, 10)], interval=10)
+        self.clock.now = scheduler.next_due()
+        scheduler.poll()
+        self.assertTrue(self.clock.now + 5 <= scheduler.next_due() <= self.clock.now + 10)
+
+
+class TestPollingSchedulerThread(unittest.TestCase):
+    def test_start_stop(self):
+        pairing = FakePairing()
+        pairing.values = {(1, 10): 1}
+        received = threading.Event()
+        scheduler = PollingScheduler({'alias': pairing}, lambda *args: received.set())
+        scheduler.start()
+        scheduler.add('alias', [(1, 10)], interval=0.2)
+        self.assertTrue(received.wait(5))
+        scheduler.stop()
+        count = len(pairing.requests)
+        time.sleep(0.5)
+        self.assertEqual(count, len(pairing.requests))
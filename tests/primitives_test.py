@@ -0,0 +1,63 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+
+from homekit.crypto.primitives import hkdf_sha512, hkdf_sha512_expand, get_signing_key, get_verifying_key, \
+    create_ed25519_keypair, Ed25519SigningKey, Ed25519VerifyingKey
+
+
+class TestPrimitives(unittest.TestCase):
+
+    def test_hkdf_sha512_rfc5869_case1(self):
+        # HKDF-SHA-512 for the vector of RFC 5869 test case 1 (the RFC itself only lists SHA-256 results)
+        ikm = bytes.fromhex('0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b')
+        salt = bytes.fromhex('000102030405060708090a0b0c')
+        info = bytes.fromhex('f0f1f2f3f4f5f6f7f8f9')
+        okm = hkdf_sha512(salt, ikm, info, 42)
+        self.assertEqual(okm.hex(), '832390086cda71fb47625bb5ceb168e4c8e26a1a16ed34d9fc7fe92c1481579338da362cb8d9f925'
+                                    'd7cb')
+
+    def test_hkdf_long_output(self):
+        key = hkdf_sha512(b'salt', b'secret', b'info', 100)
+        self.assertEqual(100, len(key))
+        self.assertEqual(key[:32], hkdf_sha512(b'salt', b'secret', b'info'))
+
+    def test_hkdf_expand_many(self):
+        infos = [b'Control-Write-Encryption-Key', b'Control-Read-Encryption-Key']
+        keys = hkdf_sha512_expand(b'Control-Salt', bytes(32), infos)
+        self.assertEqual(keys[0], hkdf_sha512(b'Control-Salt', bytes(32), b'Control-Write-Encryption-Key'))
+        self.assertEqual(keys[1], hkdf_sha512(b'Control-Salt', bytes(32), b'Control-Read-Encryption-Key'))
+        self.assertNotEqual(keys[0], keys[1])
+
+    def test_ed25519_rfc8032_test1(self):
+        seed = bytes.fromhex('9d61b19deffd5a60ba844af492ec2cc44449c5697b326919703bac031cae7f60')
+        public_key = bytes.fromhex('d75a980182b10ab7d54bfed3c964073a0ee172f3daa62325af021a68f707511a')
+        signature = bytes.fromhex('e5564300c360ac729086e2cc806e828a84877f1eb8e5d974d873e06522490155'
+                                  '5fb8821590a33bacc61e39701cf9b46bd25bf5f0595bbe24655141438e7a100b')
+        key = Ed25519SigningKey(seed)
+        self.assertEqual(public_key, key.public_key)
+        self.assertEqual(signature, key.sign(b''))
+        self.assertTrue(Ed25519VerifyingKey(public_key).verify(signature, b''))
+        self.assertFalse(Ed25519VerifyingKey(public_key).verify(signature, b'\x00'))
+        self.assertFalse(Ed25519VerifyingKey(public_key).verify(signature[:10], b''))
+
+    def test_keys_are_cached(self):
+        seed, public_key = create_ed25519_keypair()
+        self.assertIs(get_signing_key(seed), get_signing_key(bytearray(seed)))
+        self.assertIs(get_verifying_key(public_key), get_verifying_key(public_key))
+        self.assertEqual(public_key, get_signing_key(seed).public_key)
+        self.assertTrue(get_verifying_key(public_key).verify(get_signing_key(seed).sign(b'data'), b'data'))
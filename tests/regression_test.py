@@ -17,6 +17,7 @@ from homekit.controller.ip_implementation import IpPairing
 from homekit.http_impl import HomeKitHTTPConnection
 from homekit.http_impl.secure_http import SecureHttp
 from homekit.protocol import create_ip_pair_setup_write, create_ip_pair_verify_write
+from homekit.protocol.tlv import TLV
 
 
 class TestHTTPPairing(unittest.TestCase):
@@ -90,13 +91,13 @@ class TestSecureSession(unittest.TestCase):
 
         with mock.patch.object(secure_http, '_handle_request') as handle_req:
             secure_http.get('/characteristics')
-            assert '\nHost: 192.168.1.2:8080\n' in handle_req.call_args[0][0]
+            assert b'\r\nHost: 192.168.1.2:8080\r\n' in handle_req.call_args[0][0]
 
             secure_http.post('/characteristics', '')
-            assert '\nHost: 192.168.1.2:8080\n' in handle_req.call_args[0][0]
+            assert b'\r\nHost: 192.168.1.2:8080\r\n' in handle_req.call_args[0][0]
 
             secure_http.put('/characteristics', '')
-            assert '\nHost: 192.168.1.2:8080\n' in handle_req.call_args[0][0]
+            assert b'\r\nHost: 192.168.1.2:8080\r\n' in handle_req.call_args[0][0]
 
     def test_requests_only_send_params_for_true_case(self):
         """
@@ -118,3 +119,25 @@ class TestSecureSession(unittest.TestCase):
 
             pairing.get_characteristics([(1, 2)], include_meta=True)
             assert session.get.call_args[0][0] == '/characteristics?id=1.2&meta=1'
+
+    def test_list_pairings_without_separators(self):
+        """
+        Some accessories leave out the separators between the pairings of a list pairings response. Each identifier
+        still starts a new pairing, otherwise all pairings would be merged into one.
+        """
+        pairing = IpPairing({})
+        with mock.patch.object(pairing, 'session') as session:
+            session.post.return_value.read.return_value = TLV.encode_list([
+                (TLV.kTLVType_State, TLV.M2),
+                (TLV.kTLVType_Identifier, b'first'),
+                (TLV.kTLVType_PublicKey, b'\x01' * 32),
+                (TLV.kTLVType_Permissions, TLV.kTLVType_Permission_AdminUser),
+                (TLV.kTLVType_Identifier, b'second'),
+                (TLV.kTLVType_PublicKey, b'\x02' * 32),
+                (TLV.kTLVType_Permissions, TLV.kTLVType_Permission_RegularUser),
+            ])
+
+            result = pairing.list_pairings()
+            assert [p['pairingId'] for p in result] == ['first', 'second']
+            assert [p['controllerType'] for p in result] == ['admin', 'regular']
+            assert result[1]['publicKey'] == '02' * 32
@@ -0,0 +1,55 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+
+from homekit.http_impl import HttpContentTypes
+from homekit.http_impl.request import RequestBuilder
+from homekit.http_impl.response import HttpResponse
+
+
+class TestRequestBuilder(unittest.TestCase):
+    def setUp(self):
+        self.builder = RequestBuilder('10.0.0.2', 3000)
+
+    def test_get(self):
+        self.assertEqual(b'GET /accessories HTTP/1.1\r\nHost: 10.0.0.2:3000\r\n\r\n',
+                         self.builder.build('GET', '/accessories'))
+
+    def test_put_str_body(self):
+        self.assertEqual(b'PUT /characteristics HTTP/1.1\r\nHost: 10.0.0.2:3000\r\n'
+                         b'Content-Type: application/hap+json\r\nContent-Length: 2\r\n\r\n{}',
+                         self.builder.build('PUT', '/characteristics', '{}', HttpContentTypes.JSON))
+
+    def test_content_length_counts_bytes(self):
+        request = self.builder.build('PUT', '/characteristics', '"ä"', HttpContentTypes.JSON)
+        self.assertIn(b'Content-Length: 4\r\n', request)
+        self.assertTrue(request.endswith('"ä"'.encode()))
+
+    def test_binary_body_is_not_altered(self):
+        body = bytes([0x06, 0x01, 0x01, 0x0a, 0x0d, 0x0a, 0xff, 0xfe, 0x00])
+        request = self.builder.build('POST', '/pairings', body, HttpContentTypes.TLV)
+        self.assertTrue(request.endswith(b'\r\n\r\n' + body))
+        self.assertIn(b'Content-Length: 9\r\n', request)
+
+        # the accessory sees the body as it was given
+        parsed = HttpResponse()
+        parsed.parse(b'HTTP/1.1 200 OK\r\n' + request.split(b'\r\n', 1)[1])
+        self.assertEqual(body, bytes(parsed.read()))
+
+    def test_body_of_bytearray(self):
+        request = self.builder.build('POST', '/pairings', bytearray(b'\x01\x02'), HttpContentTypes.TLV)
+        self.assertTrue(request.endswith(b'\r\n\r\n\x01\x02'))
@@ -18,7 +18,10 @@ import unittest
 from unittest import mock
 import socket
 import threading
+import time
 
+from homekit.crypto.hap_cipher import HapCipher
+from homekit.http_impl.frame_reader import FrameReader
 from homekit.http_impl.secure_http import SecureHttp
 from homekit.exceptions import AccessoryDisconnectedError, EncryptionError
 from homekit.crypto.chacha20poly1305 import chacha20_aead_encrypt, chacha20_aead_decrypt
@@ -72,6 +75,53 @@ class ResponseProvider(threading.Thread):
         self.sock.send(combined_data)
 
 
+class PipelineAccessory(threading.Thread):
+    """
+    Answers each request with its target as body after reading the given number of requests. An event is sent before
+    the responses.
+    """
+
+    def __init__(self, sock, c2a_key, a2c_key, request_count):
+        threading.Thread.__init__(self)
+        self.sock = sock
+        self.reader = FrameReader(sock, HapCipher(c2a_key))
+        self.a2c_cipher = HapCipher(a2c_key)
+        self.request_count = request_count
+
+    def _send(self, data):
+        self.sock.setblocking(True)
+        self.sock.sendall(b''.join(self.a2c_cipher.encrypt_frames(data)))
+
+    def run(self):
+        targets = []
+        while len(targets) < self.request_count:
+            # the requests have no body and fit into one frame
+            request = bytes(self.reader.read_frame(10))
+            assert request.endswith(b'\r\n\r\n')
+            targets.append(request.split(b' ')[1].decode())
+        self._send(b'EVENT/1.0 200 OK\r\nContent-Type: application/hap+json\r\nContent-Length: 2\r\n\r\n{}')
+        for target in targets:
+            body = target.encode()
+            self._send('HTTP/1.1 200 OK\r\nContent-Length: {}\r\n\r\n'.format(len(body)).encode() + body)
+
+
+class SplitAccessory(PipelineAccessory):
+    """
+    Answers one request with a response whose status line is split over two frames that are sent with a pause in
+    between.
+    """
+
+    def __init__(self, sock, c2a_key, a2c_key, pause):
+        PipelineAccessory.__init__(self, sock, c2a_key, a2c_key, 1)
+        self.pause = pause
+
+    def run(self):
+        self.reader.read_frame(10)
+        self._send(b'HTTP/1.1 200')
+        time.sleep(self.pause)
+        self._send(b' OK\r\nContent-Length: 2\r\n\r\nok')
+
+
 class TestSecureHttp(unittest.TestCase):
     def test_get_on_disconnected_device(self):
         with mock.patch('homekit.controller.ip_implementation.IpSession') as session:
@@ -209,3 +259,109 @@ class TestSecureHttp(unittest.TestCase):
         accessory_socket.close()
         self.assertEqual(200, result.code)
         self.assertEqual(bytearray(b' ' * 1025), result.body)
+
+    def test_get_on_closed_connection(self):
+        controller_socket, accessory_socket = socket.socketpair()
+
+        with mock.patch('homekit.controller.ip_implementation.IpSession') as session:
+            session.sock = controller_socket
+            session.a2c_key = b'\x00' * 32
+            session.c2a_key = b'\x00' * 32
+            session.pairing_data = {
+                'AccessoryIP': '10.0.0.2',
+                'AccessoryPort': 3000,
+            }
+
+            sh = SecureHttp(session, timeout=10)
+            accessory_socket.shutdown(socket.SHUT_WR)
+            self.assertRaises(AccessoryDisconnectedError, sh.get, '/')
+
+        controller_socket.close()
+        accessory_socket.close()
+
+    def _pipeline_session(self, request_count):
+        controller_socket, accessory_socket = socket.socketpair()
+        accessory = PipelineAccessory(accessory_socket, b'\x01' * 32, b'\x02' * 32, request_count)
+        accessory.start()
+        session = mock.Mock()
+        session.sock = controller_socket
+        session.c2a_key = b'\x01' * 32
+        session.a2c_key = b'\x02' * 32
+        session.pairing_data = {
+            'AccessoryIP': '10.0.0.2',
+            'AccessoryPort': 3000,
+        }
+        sh = SecureHttp(session, timeout=10)
+        self.addCleanup(accessory_socket.close)
+        self.addCleanup(controller_socket.close)
+        self.addCleanup(sh.close)
+        return sh
+
+    def test_pipelined_requests(self):
+        # all requests are sent before the accessory answers
+        sh = self._pipeline_session(3)
+        events = []
+        sh.add_event_listener(events.append)
+        pending = [sh.send(sh.requests.build('GET', '/{}'.format(i))) for i in range(3)]
+        for i, p in enumerate(pending):
+            self.assertEqual('/{}'.format(i).encode(), p.result(10).body)
+        # the event arrived in between and was not taken as a response
+        self.assertEqual(1, len(events))
+        self.assertEqual('EVENT', events[0].get_http_name())
+        self.assertEqual(b'{}', sh.handle_event_response().body)
+
+    def test_concurrent_requests(self):
+        sh = self._pipeline_session(4)
+        results = {}
+
+        def request(name):
+            results[name] = sh.post('/' + name, '').body
+
+        threads = [threading.Thread(target=request, args=(str(i),)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual({str(i): '/{}'.format(i).encode() for i in range(4)}, results)
+
+    def test_pending_requests_fail_on_disconnect(self):
+        controller_socket, accessory_socket = socket.socketpair()
+        session = mock.Mock()
+        session.sock = controller_socket
+        session.c2a_key = b'\x01' * 32
+        session.a2c_key = b'\x02' * 32
+        session.pairing_data = {
+            'AccessoryIP': '10.0.0.2',
+            'AccessoryPort': 3000,
+        }
+        sh = SecureHttp(session, timeout=10)
+        pending = sh.send(sh.requests.build('GET', '/'))
+        accessory_socket.close()
+        self.assertRaises(AccessoryDisconnectedError, pending.result, 10)
+        self.assertRaises(AccessoryDisconnectedError, sh.handle_event_response)
+        self.assertRaises(AccessoryDisconnectedError, sh.handle_event_response)
+        self.assertRaises(AccessoryDisconnectedError, sh.get, '/')
+        controller_socket.close()
+
+    @mock.patch.object(SecureHttp, 'IDLE_TIMEOUT', 0.1)
+    def test_split_status_line(self):
+        # the pause is longer than the idle timeout of the reader thread
+        controller_socket, accessory_socket = socket.socketpair()
+        accessory = SplitAccessory(accessory_socket, b'\x01' * 32, b'\x02' * 32, 0.5)
+        accessory.start()
+        session = mock.Mock()
+        session.sock = controller_socket
+        session.c2a_key = b'\x01' * 32
+        session.a2c_key = b'\x02' * 32
+        session.pairing_data = {
+            'AccessoryIP': '10.0.0.2',
+            'AccessoryPort': 3000,
+        }
+        sh = SecureHttp(session, timeout=10)
+        self.addCleanup(accessory_socket.close)
+        self.addCleanup(controller_socket.close)
+        self.addCleanup(sh.close)
+        result = sh.get('/')
+        self.assertEqual(200, result.code)
+        self.assertEqual('OK', result.reason)
+        self.assertEqual(b'ok', result.body)
@@ -0,0 +1,108 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+
+from homekit.benchmark import PairVerifyStandIn
+from homekit.exceptions import AuthenticationError
+from homekit.protocol import get_session_keys
+from homekit.protocol.session_cache import SessionCache
+from homekit.protocol.tlv import TLV
+
+
+class RejectingStandIn(PairVerifyStandIn):
+    """
+    An accessory that answers pair resume requests with an error instead of a normal pair verify M2.
+    """
+
+    def __init__(self, error=TLV.kTLVError_Authentication, reject_all=False):
+        PairVerifyStandIn.__init__(self)
+        self.error = error
+        self.reject_all = reject_all
+        self.requests = []
+
+    def write(self, request, expected):
+        d_req = {key: bytes(value) for key, value in TLV.decode_bytes(request)}
+        self.requests.append(d_req)
+        if d_req[TLV.kTLVType_State] == TLV.M1 and (self.reject_all or TLV.kTLVType_Method in d_req):
+            return [[TLV.kTLVType_State, TLV.M2], [TLV.kTLVType_Error, self.error]]
+        return PairVerifyStandIn.write(self, request, expected)
+
+
+class TestSessionCache(unittest.TestCase):
+
+    def test_pop_once(self):
+        cache = SessionCache()
+        cache.add(b'12345678', 'pairing', b'secret')
+        self.assertEqual(('pairing', b'secret'), cache.pop(b'12345678'))
+        self.assertIsNone(cache.pop(b'12345678'))
+
+    def test_pop_unknown(self):
+        cache = SessionCache()
+        self.assertIsNone(cache.pop(b'12345678'))
+
+    def test_expired(self):
+        cache = SessionCache(lifetime=0)
+        cache.add(b'12345678', 'pairing', b'secret')
+        self.assertEqual(0, len(cache))
+        self.assertIsNone(cache.pop(b'12345678'))
+
+    def test_max_sessions(self):
+        cache = SessionCache(max_sessions=2)
+        cache.add(b'1', 'pairing', b'secret 1')
+        cache.add(b'2', 'pairing', b'secret 2')
+        cache.add(b'3', 'pairing', b'secret 3')
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.pop(b'1'))
+        self.assertEqual(('pairing', b'secret 3'), cache.pop(b'3'))
+
+    def test_pop_by_pairing_id_returns_newest(self):
+        cache = SessionCache()
+        cache.add(b'1', 'pairing', b'secret 1')
+        cache.add(b'2', 'other', b'secret 2')
+        cache.add(b'3', 'pairing', b'secret 3')
+        self.assertEqual((b'3', b'secret 3'), cache.pop_by_pairing_id('pairing'))
+        self.assertEqual((b'1', b'secret 1'), cache.pop_by_pairing_id('pairing'))
+        self.assertIsNone(cache.pop_by_pairing_id('pairing'))
+
+    def test_remove_pairing(self):
+        cache = SessionCache()
+        cache.add(b'1', 'pairing', b'secret 1')
+        cache.add(b'2', 'other', b'secret 2')
+        cache.remove_pairing('pairing')
+        self.assertEqual(1, len(cache))
+        self.assertIsNone(cache.pop(b'1'))
+
+    def test_rejected_resume_falls_back_to_pair_verify(self):
+        stand_in = RejectingStandIn()
+        cache = SessionCache()
+        cache.add(bytes(8), stand_in.accessory_pairing_id, bytes(32))
+        keys = get_session_keys(None, stand_in.pairing_data, stand_in.write, cache)
+        self.assertEqual(2, len(keys))
+        # resume, normal M1 on the same connection, M3
+        self.assertEqual([TLV.M1, TLV.M1, TLV.M3], [r[TLV.kTLVType_State] for r in stand_in.requests])
+        self.assertIn(TLV.kTLVType_SessionID, stand_in.requests[0])
+        self.assertNotIn(TLV.kTLVType_Method, stand_in.requests[1])
+        self.assertEqual(stand_in.requests[0][TLV.kTLVType_PublicKey], stand_in.requests[1][TLV.kTLVType_PublicKey])
+        # the new session can be resumed next time
+        self.assertEqual(1, len(cache))
+
+    def test_rejected_pair_verify(self):
+        stand_in = RejectingStandIn(reject_all=True)
+        cache = SessionCache()
+        cache.add(bytes(8), stand_in.accessory_pairing_id, bytes(32))
+        self.assertRaises(AuthenticationError, get_session_keys, None, stand_in.pairing_data, stand_in.write, cache)
+        self.assertEqual(2, len(stand_in.requests))
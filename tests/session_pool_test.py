@@ -0,0 +1,192 @@
+#
+# Copyright 2018 Joachim Lusiardi
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import threading
+import time
+import unittest
+
+from homekit.controller.ip_implementation import IpPairing, SessionPool
+from homekit.exceptions import AccessoryDisconnectedError, AccessoryNotFoundError
+from homekit.http_impl.response import HttpResponse
+
+
+class _Response(HttpResponse):
+    def __init__(self, code, body=b''):
+        HttpResponse.__init__(self)
+        self.code = code
+        self.body = bytearray(body)
+
+
+class FakeSession:
+    """
+    Stands in for IpSession, the factory counts the sessions and can be told to fail.
+    """
+    created = []
+    fail = False
+    delay = 0
+
+    def __init__(self, pairing_data, session_cache=None):
+        time.sleep(FakeSession.delay)
+        if FakeSession.fail:
+            raise AccessoryNotFoundError('not found')
+        self.alive = True
+        self.requests = []
+        self.listeners = []
+        self.last_used = time.monotonic()
+        FakeSession.created.append(self)
+
+    def is_alive(self):
+        return self.alive
+
+    def add_disconnect_listener(self, listener):
+        self.listeners.append(listener)
+
+    def disconnect(self):
+        self.alive = False
+        for listener in self.listeners:
+            listener()
+
+    def close(self):
+        self.alive = False
+
+    def get(self, url):
+        if not self.alive:
+            raise AccessoryDisconnectedError('closed')
+        self.last_used = time.monotonic()
+        self.requests.append(url)
+        return _Response(200, url.encode())
+
+    def put(self, url, body, content_type=None):
+        return self.get(url)
+
+    def post(self, url, body, content_type=None):
+        return self.get(url)
+
+
+class TestSessionPool(unittest.TestCase):
+
+    def setUp(self):
+        FakeSession.created = []
+        FakeSession.fail = False
+        FakeSession.delay = 0
+
+    def _pool(self, size=1, keepalive_interval=None, pairing_data=None):
+        pool = SessionPool(pairing_data if pairing_data is not None else {}, size=size,
+                           keepalive_interval=keepalive_interval, session_factory=FakeSession)
+        self.addCleanup(pool.close)
+        return pool
+
+    def _wait_for(self, condition, timeout=5):
+        end = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > end:
+                self.fail('condition not reached')
+            time.sleep(0.01)
+
+    def test_session_is_reused(self):
+        pool = self._pool()
+        self.assertEqual(b'/a', pool.get('/a').body)
+        self.assertEqual(b'/b', pool.put('/b', '').body)
+        self.assertEqual(b'/c', pool.post('/c', '').body)
+        self.assertEqual(1, len(FakeSession.created))
+        self.assertEqual(['/a', '/b', '/c'], FakeSession.created[0].requests)
+
+    def test_pool_is_filled_in_background(self):
+        pool = self._pool(size=3)
+        pool.get('/a')
+        self._wait_for(lambda: len(pool) == 3)
+        for i in range(6):
+            pool.get('/{}'.format(i))
+        # the requests are spread over all sessions
+        self.assertEqual([3, 2, 2], sorted((len(s.requests) for s in FakeSession.created), reverse=True))
+
+    def test_broken_session_is_replaced(self):
+        pool = self._pool()
+        pool.get('/a')
+        FakeSession.created[0].disconnect()
+        # the new session is created without waiting for the next request
+        self._wait_for(lambda: len(FakeSession.created) == 2 and len(pool) == 1)
+        pool.get('/b')
+        self.assertEqual(['/b'], FakeSession.created[1].requests)
+
+    def test_failed_request_discards_session(self):
+        pool = self._pool()
+        session = pool.acquire()
+        session.alive = False
+        FakeSession.delay = 0.5
+        # is_alive is checked before a session is handed out, so the request waits for a new one
+        self.assertEqual(b'/a', pool.get('/a').body)
+        self.assertEqual(2, len(FakeSession.created))
+
+    def test_malformed_response_discards_only_its_session(self):
+        pool = self._pool(size=2)
+        pool.get('/a')
+        self._wait_for(lambda: len(pool) == 2)
+        pairing = IpPairing({}, session_pool=pool)
+        # the fake sessions answer with the url as body, which is no JSON
+        self.assertRaises(AccessoryDisconnectedError, pairing.get_characteristics, [(1, 2)])
+        served = [s for s in FakeSession.created if '/characteristics?id=1.2' in s.requests]
+        self.assertEqual(1, len(served))
+        self.assertFalse(served[0].alive)
+        self.assertEqual(1, len([s for s in FakeSession.created[:2] if s.alive]))
+        # nothing to discard if the thread's last request was already handled
+        pool.discard_served()
+        self.assertEqual(1, len([s for s in FakeSession.created[:2] if s.alive]))
+
+    def test_reconnect_failure(self):
+        pool = self._pool()
+        FakeSession.fail = True
+        self.assertRaises(AccessoryNotFoundError, pool.get, '/a')
+        FakeSession.fail = False
+        self.assertEqual(b'/a', pool.get('/a').body)
+
+    def test_keepalive(self):
+        pool = self._pool(keepalive_interval=0.1)
+        pool.get('/a')
+        self._wait_for(lambda: SessionPool.PROBE_TARGET in FakeSession.created[0].requests)
+
+    def test_keepalive_reads_the_name(self):
+        accessories = [{'aid': 1, 'services': [{'type': '3E', 'iid': 1, 'characteristics': [
+            {'type': '14', 'iid': 2, 'perms': ['pw']},
+            {'type': '23', 'iid': 3, 'perms': ['pr'], 'value': 'Lamp'},
+        ]}]}]
+        pool = self._pool(keepalive_interval=0.1, pairing_data={'accessories': accessories})
+        pool.get('/a')
+        self._wait_for(lambda: '/characteristics?id=1.3' in FakeSession.created[0].requests)
+        self.assertNotIn(SessionPool.PROBE_TARGET, FakeSession.created[0].requests)
+
+    def test_concurrent_first_use(self):
+        FakeSession.delay = 0.2
+        pool = self._pool(size=1)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(pool.get('/a').body)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([b'/a'] * 5, results)
+        self.assertEqual(1, len(FakeSession.created))
+
+    def test_close(self):
+        pool = self._pool(size=2)
+        pool.get('/a')
+        self._wait_for(lambda: len(pool) == 2)
+        sessions = list(FakeSession.created)
+        pool.close()
+        self.assertFalse(any(s.alive for s in sessions))
+        self.assertEqual(0, len(pool))
+        # the pool can be used again
+        self.assertEqual(b'/b', pool.get('/b').body)
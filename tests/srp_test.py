@@ -14,9 +14,10 @@
 # limitations under the License.
 #
 
+import hashlib
 import unittest
 
-from homekit.crypto.srp import SrpServer, SrpClient
+from homekit.crypto.srp import SrpServer, SrpClient, Srp, _G, _G_EXP, _K, _N
 
 
 class TestSrp(unittest.TestCase):
@@ -46,3 +47,34 @@ class TestSrp(unittest.TestCase):
 
         # step M5
         self.assertTrue(client.verify_servers_proof(servers_proof))
+
+    def test_fixed_base_exponentiation(self):
+        for x in [0, 1, 2, 15, 16, 17, 2 ** 127 + 12345, 2 ** 512 - 1, 2 ** 512, 2 ** 600 + 3]:
+            self.assertEqual(_G_EXP.pow(x), pow(_G, x, _N), x)
+
+    def test_group_constants(self):
+        hash_instance = hashlib.sha512()
+        hash_instance.update(Srp.to_byte_array(_N))
+        hash_instance.update(bytearray.fromhex(383 * '00' + '05'))
+        self.assertEqual(_K, int.from_bytes(hash_instance.digest(), 'big'))
+
+    def test_exchange_values_are_cached(self):
+        setup_code = '123-45-678'
+        server = SrpServer('Pair-Setup', setup_code)
+        client = SrpClient('Pair-Setup', setup_code)
+        client.set_salt(server.get_salt())
+        client.set_server_public_key(server.get_public_key())
+        server.set_client_public_key(client.get_public_key())
+
+        self.assertEqual(client.get_public_key(), pow(client.g, client.a, client.n))
+        self.assertEqual(client.get_shared_secret(), server.get_shared_secret())
+        self.assertIs(client.get_session_key(), client.get_session_key())
+        self.assertIs(client.get_proof(), client.get_proof())
+
+        # a new public key starts a new exchange
+        other = SrpServer('Pair-Setup', setup_code)
+        client.set_salt(other.get_salt())
+        client.set_server_public_key(other.get_public_key())
+        other.set_client_public_key(client.get_public_key())
+        self.assertEqual(client.get_session_key(), other.get_session_key())
+        self.assertTrue(other.verify_clients_proof(client.get_proof()))
@@ -16,7 +16,7 @@
 
 import unittest
 
-from homekit.protocol.tlv import TLV, TlvParseException
+from homekit.protocol.tlv import TLV, TlvMessage, TlvParser, TlvParseException
 
 
 class TestTLV(unittest.TestCase):
@@ -181,3 +181,173 @@ class TestTLV(unittest.TestCase):
 
         data = TLV.decode_bytes(example, expected=[6])
         self.assertListEqual(data, expected)
+
+    def test_decode_does_not_modify_input(self):
+        example = bytearray.fromhex('060103' + '0102abcd')
+        data = TLV.decode_bytearray(example)
+        data[0][1] += b'\x04'
+        example.append(0)
+        self.assertEqual(example, bytearray.fromhex('060103' + '0102abcd' + '00'))
+
+    def test_decode_memoryview_and_list(self):
+        expected = [[6, bytearray(b'\x03')], [1, bytearray(b'\xab\xcd')]]
+        self.assertListEqual(TLV.decode_bytes(memoryview(bytes.fromhex('ff060103' + '0102abcd'))[1:]), expected)
+        self.assertListEqual(TLV.decode_bytes([6, 1, 3, 1, 2, 0xab, 0xcd]), expected)
+
+    def test_decode_missing_length(self):
+        self.assertRaises(TlvParseException, TLV.decode_bytes, bytes.fromhex('06010301'))
+
+    def test_decode_many_fragments(self):
+        value = bytes(range(256)) * 40
+        example = TLV.encode_list([(TLV.kTLVType_Certificate, value), (TLV.kTLVType_Signature, b'sig')])
+        data = TLV.decode_bytes(bytes(example))
+        self.assertListEqual(data, [[TLV.kTLVType_Certificate, bytearray(value)],
+                                    [TLV.kTLVType_Signature, bytearray(b'sig')]])
+
+    def test_encoded_length(self):
+        example = [(TLV.kTLVType_State, TLV.M1), (TLV.kTLVType_Certificate, bytes(510)), (TLV.kTLVType_Salt, b''),
+                   TLV.kTLVType_Separator_Pair, (TLV.kTLVType_Signature, bytes(256))]
+        self.assertEqual(len(TLV.encode_list(example)), TLV.encoded_length(example))
+        self.assertEqual(3 + 514 + 0 + 2 + 260, TLV.encoded_length(example))
+
+    def test_encode_into(self):
+        example = [(TLV.kTLVType_State, TLV.M3), (TLV.kTLVType_Certificate, bytes(range(256)) * 2)]
+        buffer = bytearray(b'\xff' * (TLV.encoded_length(example) + 4))
+        end = TLV.encode_into(example, buffer, 2)
+        self.assertEqual(len(buffer) - 2, end)
+        self.assertEqual(bytearray(b'\xff\xff') + TLV.encode_list(example) + bytearray(b'\xff\xff'), buffer)
+        self.assertRaises(ValueError, TLV.encode_into, example, buffer, 5)
+
+    def test_encode_list_of_ints(self):
+        self.assertEqual(bytearray(b'\x01\x02\x05\x06'), TLV.encode_list([(1, [5, 6])]))
+
+
+class TestTlvMessage(unittest.TestCase):
+
+    def test_lookup(self):
+        data = TLV.encode_list([(TLV.kTLVType_Salt, b'salt'), (TLV.kTLVType_State, TLV.M2),
+                                (TLV.kTLVType_PublicKey, bytes(range(256)) * 2)])
+        message = TlvMessage(bytes(data))
+        self.assertEqual(3, len(message))
+        self.assertIn(TLV.kTLVType_State, message)
+        self.assertNotIn(TLV.kTLVType_Error, message)
+        self.assertEqual(TLV.M2, message[TLV.kTLVType_State])
+        self.assertEqual(bytearray(bytes(range(256)) * 2), message[TLV.kTLVType_PublicKey])
+        self.assertIsNone(message.get(TLV.kTLVType_Error))
+        self.assertEqual(b'x', message.get(TLV.kTLVType_Error, b'x'))
+        self.assertRaises(KeyError, message.__getitem__, TLV.kTLVType_Error)
+        self.assertEqual([TLV.kTLVType_Salt, TLV.kTLVType_State, TLV.kTLVType_PublicKey], message.keys())
+        self.assertEqual(TLV.decode_bytes(data), message.to_list())
+
+    def test_values_are_copies(self):
+        data = bytearray.fromhex('060102' + '0102abcd')
+        message = TlvMessage(data)
+        data[2] = 4
+        self.assertEqual(TLV.M2, message[TLV.kTLVType_State])
+        message[TLV.kTLVType_Identifier].append(0)
+        self.assertEqual(bytearray.fromhex('060104' + '0102abcd'), data)
+
+    def test_expected(self):
+        data = bytes.fromhex('060102' + '0102abcd' + '0301ff')
+        message = TlvMessage(data, [TLV.kTLVType_State])
+        self.assertEqual([TLV.kTLVType_State], message.keys())
+
+    def test_not_enough_data(self):
+        self.assertRaises(TlvParseException, TlvMessage, bytes.fromhex('060103' + '09FF' + 25 * '61'))
+
+    def test_split_and_get_all(self):
+        data = TLV.encode_list([
+            (TLV.kTLVType_State, TLV.M2),
+            (TLV.kTLVType_Identifier, b'first'),
+            (TLV.kTLVType_Permissions, TLV.kTLVType_Permission_AdminUser),
+            TLV.kTLVType_Separator_Pair,
+            (TLV.kTLVType_Identifier, b'second'),
+            (TLV.kTLVType_Permissions, TLV.kTLVType_Permission_RegularUser),
+        ])
+        message = TlvMessage(data)
+        self.assertEqual([b'first', b'second'], message.get_all(TLV.kTLVType_Identifier))
+        parts = message.split()
+        self.assertEqual(2, len(parts))
+        self.assertEqual(TLV.M2, parts[0][TLV.kTLVType_State])
+        self.assertEqual(b'first', parts[0][TLV.kTLVType_Identifier])
+        self.assertEqual(b'second', parts[1][TLV.kTLVType_Identifier])
+        self.assertEqual(TLV.kTLVType_Permission_RegularUser, parts[1][TLV.kTLVType_Permissions])
+
+    def test_split_without_separators(self):
+        data = TLV.encode_list([
+            (TLV.kTLVType_State, TLV.M2),
+            (TLV.kTLVType_Identifier, b'first'),
+            (TLV.kTLVType_Permissions, TLV.kTLVType_Permission_AdminUser),
+            (TLV.kTLVType_Identifier, b'second'),
+            (TLV.kTLVType_Permissions, TLV.kTLVType_Permission_RegularUser),
+            TLV.kTLVType_Separator_Pair,
+            (TLV.kTLVType_Identifier, b'third'),
+        ])
+        message = TlvMessage(data)
+        self.assertEqual(2, len(message.split()))
+        parts = message.split(start=TLV.kTLVType_Identifier)
+        self.assertEqual([b'first', b'second', b'third'], [p[TLV.kTLVType_Identifier] for p in parts])
+        self.assertEqual(TLV.kTLVType_Permission_AdminUser, parts[0][TLV.kTLVType_Permissions])
+        self.assertEqual(TLV.kTLVType_Permission_RegularUser, parts[1][TLV.kTLVType_Permissions])
+        self.assertNotIn(TLV.kTLVType_Permissions, parts[2])
+
+    def test_of(self):
+        message = TlvMessage(bytes.fromhex('060102'))
+        self.assertIs(message, TlvMessage.of(message))
+        from_list = TlvMessage.of([[TLV.kTLVType_State, TLV.M4], [TLV.kTLVType_Error, TLV.kTLVError_Busy]])
+        self.assertEqual(TLV.kTLVError_Busy, from_list[TLV.kTLVType_Error])
+        self.assertEqual([(TLV.kTLVType_State, TLV.M4), (TLV.kTLVType_Error, TLV.kTLVError_Busy)], list(from_list))
+
+
+class TestTlvParser(unittest.TestCase):
+    example = TLV.encode_list([
+        (TLV.kTLVType_State, TLV.M2),
+        (TLV.kTLVType_Certificate, bytes(range(256)) * 3),
+        (TLV.kTLVType_Signature, bytes(64)),
+    ])
+
+    def test_byte_by_byte(self):
+        parser = TlvParser()
+        items = []
+        for index in range(0, len(self.example)):
+            completed = parser.feed(self.example[index:index + 1])
+            if index == 2:
+                # the state item is returned as soon as its value is complete
+                self.assertEqual([[TLV.kTLVType_State, TLV.M2]], completed)
+            items.extend(completed)
+        items.extend(parser.close())
+        self.assertEqual(TLV.decode_bytes(self.example), items)
+
+    def test_fragment_of_255_bytes_waits_for_next_item(self):
+        parser = TlvParser()
+        self.assertEqual([], parser.feed(TLV.encode_list([(TLV.kTLVType_Salt, bytes(255))])))
+        self.assertEqual([[TLV.kTLVType_Salt, bytearray(256)]], parser.feed(b'\x02\x01\x00'))
+        self.assertEqual([], parser.close())
+
+    def test_hap_fragments(self):
+        fragments = []
+        for offset in range(0, len(self.example), 100):
+            key = TLV.kTLVType_FragmentData if offset + 100 < len(self.example) else TLV.kTLVType_FragmentLast
+            fragments.append((key, self.example[offset:offset + 100]))
+        parser = TlvParser()
+        items = parser.feed(TLV.encode_list(fragments))
+        self.assertEqual(TLV.decode_bytes(self.example), items)
+        self.assertEqual([], parser.close())
+
+    def test_inner_parser(self):
+        # like the value parameter of a BLE response
+        data = TLV.encode_list([(TLV.kTLVHAPParamValue, self.example)])
+        parser = TlvParser([TLV.kTLVHAPParamValue], [TLV.kTLVHAPParamValue], TlvParser(None, ()))
+        items = parser.feed(data[:300]) + parser.feed(data[300:]) + parser.close()
+        self.assertEqual(TLV.decode_bytes(self.example), items)
+
+    def test_expected(self):
+        parser = TlvParser([TLV.kTLVType_State, TLV.kTLVType_Certificate])
+        items = parser.feed(self.example) + parser.close()
+        self.assertEqual(TLV.decode_bytes(self.example, [TLV.kTLVType_State, TLV.kTLVType_Certificate]), items)
+        self.assertTrue(parser.stopped)
+
+    def test_truncated(self):
+        parser = TlvParser()
+        parser.feed(self.example[:-1])
+        self.assertRaises(TlvParseException, parser.close)